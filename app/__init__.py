@@ -17,6 +17,13 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    try:
+        from app.json_provider import OrjsonProvider
+        app.json = OrjsonProvider(app)
+    except ImportError:
+        # orjson non installato: resta il provider JSON di default di Flask
+        pass
+
     CORS(app, resources={r"/api/*": {"origins": "*"}})
 
     # Lega le estensioni all'istanza dell'app
@@ -27,6 +34,13 @@ def create_app(config_class=Config):
 
     # Importa i modelli per farli riconoscere da Flask-Migrate
     from app import models
+    from app.catalog import events, search, tags, geo, similarity, recommend, version, cli
+    version.init_app(app)
+    cli.init_app(app)
+    from app import instrumentation
+    instrumentation.init_app(app)
+    from app.history import cli as history_cli
+    history_cli.init_app(app)
     from app.api import bp as api_blueprint
     app.register_blueprint(api_blueprint, url_prefix='/api')
 
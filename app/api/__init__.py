@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('api', __name__)
 
-from app.api import tags, stations, auth, user, playlist
\ No newline at end of file
+from app.api import tags, stations, auth, user, playlist, metrics
\ No newline at end of file
@@ -1,23 +1,38 @@
-from flask import request, jsonify
+import math
+
+from flask import current_app, request, jsonify
 from app.models import User
 from app import db
 from app.api import bp
+from app.passwords import PasswordHasherBusy, get_throttle, needs_rehash
+from app.api.identity import current_identity, revoke_tokens, token_claims
 
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 
 
+def _busy():
+    response = jsonify({'error': 'Authentication is temporarily unavailable'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
 @bp.route('/auth/register', methods=['POST'])
 def register():
     data = request.get_json() or {}
 
     if 'username' not in data or 'password' not in data:
         return jsonify({'error': 'must include username and password fields'}), 400
+    if not isinstance(data['password'], str) or not data['password']:
+        return jsonify({'error': 'password must be a non-empty string'}), 400
     if User.query.filter_by(username=data['username']).first():
         return jsonify({'error': 'username already exists'}), 400
 
     user = User()
     user.username = data['username']
-    user.set_password(data['password'])
+    try:
+        user.set_password(data['password'])
+    except PasswordHasherBusy:
+        return _busy()
 
     db.session.add(user)
     db.session.commit()
@@ -32,30 +47,60 @@ def login():
     if 'username' not in data or 'password' not in data:
         return jsonify({'error': 'must include username and password fields'}), 400
 
+    # Limite dei tentativi falliti controllato prima di calcolare bcrypt
+    config = current_app.config
+    throttle = get_throttle()
+    user_key, ip_key = f"user:{data['username']}", f'ip:{request.remote_addr}'
+    wait = throttle.retry_after({user_key: config['LOGIN_MAX_FAILURES_PER_USER'],
+                                 ip_key: config['LOGIN_MAX_FAILURES_PER_IP']})
+    if wait:
+        response = jsonify({'error': 'Too many login attempts, try again later'})
+        response.headers['Retry-After'] = str(math.ceil(wait))
+        return response, 429
+
     user = User.query.filter_by(username=data['username']).first()
 
-    if user is None or not user.check_password(data['password']):
+    try:
+        valid = (user is not None and isinstance(data['password'], str)
+                 and user.check_password(data['password']))
+    except PasswordHasherBusy:
+        return _busy()
+    if not valid:
+        throttle.failed(user_key, ip_key)
         return jsonify({'error': 'Invalid username or password'}), 401  # Unauthorized
+    throttle.reset(user_key)
+
+    if needs_rehash(user.password_hash):
+        # Costo di bcrypt cambiato: nuovo hash ora che la password e' nota
+        try:
+            user.set_password(data['password'])
+            db.session.commit()
+        except PasswordHasherBusy:
+            # Verra' rigenerato a un prossimo login
+            pass
 
-    access_token = create_access_token(identity=user.id)
+    access_token = create_access_token(identity=user.id, additional_claims=token_claims(user))
 
     return jsonify(access_token=access_token)
 
 
-@bp.route('/auth/profile', methods=['GET'])
+@bp.route('/auth/logout', methods=['POST'])
 @jwt_required()
-def get_profile():
-    current_user_id = get_jwt_identity()
+def logout():
+    # Revoca tutti i token dell'utente, non solo quello usato
+    revoke_tokens(get_jwt_identity())
+    return jsonify({"message": "Logged out"}), 200
 
-    user = User.query.get(current_user_id)
 
-    if not user:
-        return jsonify({"error": "User not found"}), 404
+@bp.route('/auth/profile', methods=['GET'])
+@jwt_required()
+def get_profile():
+    identity = current_identity()
 
     user_data = {
-        "id": user.id,
-        "username": user.username,
-        "registered_since": user.created_at.isoformat()
+        "id": identity.id,
+        "username": identity.username,
+        "registered_since": identity.registered_since.isoformat() if identity.registered_since else None
     }
 
-    return jsonify(user_data), 200
\ No newline at end of file
+    return jsonify(user_data), 200
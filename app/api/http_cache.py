@@ -0,0 +1,41 @@
+"""GET condizionali (ETag / Last-Modified) per gli endpoint del catalogo.
+
+Le risposte degli endpoint decorati con ``catalog_conditional`` dipendono
+solo dai parametri della richiesta e dalla versione del catalogo: l'ETag e'
+derivato dalla versione, quindi un ``If-None-Match`` valido riceve un 304
+prima di eseguire la view e senza toccare il database.
+"""
+from datetime import timezone
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from app.catalog.version import catalog_version
+
+
+def _not_modified(etag, updated_at):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and updated_at is not None:
+        return updated_at.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    return False
+
+
+def catalog_conditional(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version, updated_at = catalog_version()
+        etag = f'catalog-{version}'
+        if _not_modified(etag, updated_at):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        if updated_at is not None:
+            response.last_modified = updated_at.replace(tzinfo=timezone.utc)
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['CATALOG_CACHE_MAX_AGE']
+        return response
+    return wrapper
@@ -0,0 +1,127 @@
+"""Identita' dell'utente dai claim del token, senza leggere ``user`` a ogni richiesta.
+
+Il token emesso dal login contiene id (``sub``), ``username``, data di
+registrazione, ``ver``, la versione dei token dell'utente
+(``User.token_version``), e ``gen``, la generazione del catalogo.
+Incrementare la versione (``revoke_tokens``, usato dal logout) invalida
+tutti i token gia' emessi. Una sostituzione completa del catalogo cancella
+gli utenti e ne fa ripartire gli id: la generazione cambia e i token
+emessi prima non valgono piu', anche se un nuovo utente ha lo stesso id.
+
+Il controllo di revoca confronta ``ver`` con la versione corrente, tenuta in
+una cache per processo per ``TOKEN_VERSION_TTL`` secondi: il database viene
+letto al massimo una volta per utente e intervallo. La revoca e' immediata
+nel processo che la esegue, negli altri entro il TTL. Un utente eliminato
+risulta revocato.
+
+I token emessi prima di questi claim valgono come versione e generazione
+0 e per loro ``current_identity`` legge l'utente dal database.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from flask import abort, current_app, g
+from flask_jwt_extended import get_jwt
+from sqlalchemy import select
+
+from app import db, jwt
+from app.catalog import catalog_replaced
+from app.catalog.version import catalog_generation
+from app.models import User
+
+_lock = threading.Lock()
+
+Identity = namedtuple('Identity', 'id username registered_since')
+
+
+def token_claims(user):
+    """Claim aggiuntivi per ``create_access_token``."""
+    return {
+        'username': user.username,
+        'registered_since': user.created_at.isoformat() if user.created_at else None,
+        'ver': user.token_version or 0,
+        'gen': catalog_generation(),
+    }
+
+
+def current_identity():
+    """Utente della richiesta autenticata (dopo ``jwt_required``)."""
+    identity = g.get('identity')
+    if identity is None:
+        claims = get_jwt()
+        if 'username' in claims:
+            registered = claims['registered_since']
+            identity = Identity(claims['sub'], claims['username'],
+                                datetime.fromisoformat(registered) if registered else None)
+        else:
+            user = db.session.get(User, claims['sub'])
+            if user is None:
+                abort(404)
+            identity = Identity(user.id, user.username, user.created_at)
+        g.identity = identity
+    return identity
+
+
+class TokenVersions:
+    """Versione corrente dei token per utente, con scadenza e limite di voci."""
+
+    def __init__(self, ttl, max_users):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.entries = OrderedDict()  # utente -> (versione o None, istante di lettura)
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                self.entries.move_to_end(user_id)
+                return entry[0]
+        version = db.session.execute(select(User.token_version).where(User.id == user_id)).scalar()
+        self.set(user_id, version)
+        return version
+
+    def set(self, user_id, version):
+        with self.lock:
+            self.entries[user_id] = (version, time.monotonic())
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+
+def get_token_versions(app=None):
+    app = app or current_app._get_current_object()
+    versions = app.extensions.get('token_versions')
+    if versions is None:
+        with _lock:
+            versions = app.extensions.get('token_versions')
+            if versions is None:
+                versions = app.extensions['token_versions'] = TokenVersions(
+                    app.config['TOKEN_VERSION_TTL'], app.config['TOKEN_VERSION_CACHE_SIZE'])
+    return versions
+
+
+def revoke_tokens(user_id):
+    """Invalida tutti i token emessi finora per l'utente."""
+    db.session.execute(User.__table__.update().where(User.id == user_id)
+                       .values(token_version=User.token_version + 1))
+    db.session.commit()
+    version = db.session.execute(select(User.token_version).where(User.id == user_id)).scalar()
+    get_token_versions().set(user_id, version)
+
+
+@jwt.token_in_blocklist_loader
+def _token_revoked(jwt_header, jwt_payload):
+    if jwt_payload.get('gen', 0) != catalog_generation():
+        return True
+    version = get_token_versions().get(jwt_payload['sub'])
+    return version is None or jwt_payload.get('ver', 0) != version
+
+
+@catalog_replaced.connect
+def _reset_on_catalog_replace(app):
+    # Utenti cancellati: le versioni in cache sono di utenti che non esistono piu'
+    app.extensions.pop('token_versions', None)
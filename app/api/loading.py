@@ -0,0 +1,30 @@
+"""Opzioni di caricamento condivise dagli endpoint che serializzano stazioni.
+
+Gli schemi annidati leggono ``music_genres``, ``decades``, ``topics``,
+``langs`` e ``moods`` di ogni stazione: con il lazy loading di default una
+pagina da 20 stazioni costa ~100 SELECT. Con ``selectinload`` ogni
+categoria viene caricata con una sola query ``WHERE station_id IN (...)``
+per tutta la pagina, quindi il numero di query e' costante.
+"""
+from sqlalchemy.orm import selectinload
+
+from app.models import Station
+
+STATION_TAG_RELATIONSHIPS = (
+    Station.music_genres,
+    Station.decades,
+    Station.topics,
+    Station.langs,
+    Station.moods,
+)
+
+
+def station_tags():
+    """Opzioni per una query che restituisce direttamente stazioni."""
+    return [selectinload(relationship) for relationship in STATION_TAG_RELATIONSHIPS]
+
+
+def stations_with_tags(relationship):
+    """Opzione per caricare le stazioni raggiunte tramite ``relationship``
+    (es. ``PlayHistory.station`` o ``Playlist.stations``) insieme ai loro tag."""
+    return selectinload(relationship).options(*station_tags())
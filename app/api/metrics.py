@@ -0,0 +1,100 @@
+import hmac
+from functools import wraps
+
+from app.api import bp
+from flask import abort, current_app, jsonify, request
+
+from app.api.result_cache import get_backend
+from app.instrumentation import get_metrics
+
+
+def metrics_access(view):
+    """Endpoint interni: 404 senza ``METRICS_TOKEN`` configurato, 401 senza il token giusto.
+
+    Le metriche contengono il testo SQL delle query, quindi non sono pubbliche:
+    il token va passato come ``Authorization: Bearer <token>``.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config['METRICS_TOKEN']
+        if not token:
+            abort(404)
+        scheme, _, supplied = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(supplied.encode(), token.encode()):
+            return jsonify({'error': 'Invalid metrics token'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class _Exposition:
+    """Testo nel formato di esposizione di Prometheus (0.0.4)."""
+
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, kind, description, samples):
+        self.lines.append(f'# HELP {name} {description}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for suffix, labels, value in samples:
+            self.lines.append(f'{name}{suffix}{_labels(**labels)} {value}')
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+@bp.route('/metrics', methods=['GET'])
+@metrics_access
+def get_prometheus_metrics():
+    """Metriche di questo processo in formato Prometheus."""
+    out = _Exposition()
+
+    cache = get_backend().stats()
+    for key, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                      ('expirations', 'counter'), ('entries', 'gauge'), ('bytes', 'gauge')):
+        if key in cache:
+            name = f'terratune_result_cache_{key}' + ('_total' if kind == 'counter' else '')
+            out.metric(name, kind, f'Result cache {key}.', [('', {}, cache[key])])
+
+    endpoints = get_metrics().snapshot()
+    out.metric('terratune_sql_sample_rate', 'gauge', 'Fraction of requests with SQL tracing.',
+               [('', {}, current_app.config['SQL_SAMPLE_RATE'])])
+    for key, description in (('requests', 'Sampled requests.'),
+                             ('db_seconds', 'Time spent executing SQL in sampled requests.'),
+                             ('request_seconds', 'Total duration of sampled requests.'),
+                             ('n_plus_one', 'Sampled requests with repeated statements (likely N+1).')):
+        name = f'terratune_sql_{key}_total'
+        out.metric(name, 'counter', description,
+                   [('', {'endpoint': endpoint}, stats[key]) for endpoint, stats in endpoints.items()])
+    samples = []
+    for endpoint, stats in endpoints.items():
+        for limit, count in stats['buckets']:
+            samples.append(('_bucket', {'endpoint': endpoint, 'le': limit}, count))
+        samples.append(('_bucket', {'endpoint': endpoint, 'le': '+Inf'}, stats['requests']))
+        samples.append(('_sum', {'endpoint': endpoint}, stats['statements']))
+        samples.append(('_count', {'endpoint': endpoint}, stats['requests']))
+    out.metric('terratune_sql_statements_per_request', 'histogram',
+               'SQL statements per sampled request.', samples)
+
+    return current_app.response_class(out.text(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/metrics/cache', methods=['GET'])
+@metrics_access
+def get_cache_stats():
+    """Statistiche della cache dei risultati (hit rate, espulsioni, memoria)."""
+    return jsonify(get_backend().stats())
+
+
+@bp.route('/metrics/sql', methods=['GET'])
+@metrics_access
+def get_sql_stats():
+    """Per endpoint: statement, tempo nel database, statement piu' lenti e ripetuti."""
+    return jsonify(get_metrics().snapshot())
@@ -0,0 +1,88 @@
+"""Paginazione a cursore (keyset) per gli endpoint che restituiscono liste.
+
+Il cursore e' un token opaco che contiene la chiave di ordinamento
+dell'ultimo elemento restituito: la pagina successiva filtra con
+``WHERE chiave > cursore`` invece di usare ``OFFSET`` e non esegue il
+``COUNT(*)``, quindi ogni pagina costa lo stesso indipendentemente da
+quanto e' profonda.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def wants_cursor(args):
+    """Il client sceglie la modalita' a cursore passando ``cursor`` (anche vuoto)."""
+    return 'cursor' in args
+
+
+def encode_cursor(values):
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, ordering=None):
+    """Decodifica il cursore; con ``ordering`` ne verifica lunghezza e tipi."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list) or (ordering is not None and len(values) != len(ordering)):
+        raise InvalidCursor(token)
+    if ordering is None:
+        return values
+    decoded = []
+    for value, (column, _) in zip(values, ordering):
+        if value is not None and _python_type(column) is datetime:
+            try:
+                value = datetime.fromisoformat(value)
+            except (ValueError, TypeError):
+                raise InvalidCursor(token)
+        decoded.append(value)
+    return decoded
+
+
+def _python_type(column):
+    try:
+        return column.type.python_type
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+def _after(ordering, values):
+    """Condizione ``(c1, c2, ...) > (v1, v2, ...)`` rispettando asc/desc."""
+    clauses = []
+    for i, (column, descending) in enumerate(ordering):
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*[c == v for (c, _), v in zip(ordering[:i], values[:i])], step))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, ordering, per_page, cursor=None, key=None):
+    """Restituisce ``(items, next_cursor)``.
+
+    ``ordering`` e' una lista di ``(colonna, descending)`` che deve
+    identificare univocamente le righe (aggiungere sempre l'id come ultima
+    chiave). ``key`` ricava i valori della chiave da un elemento; di default
+    legge gli attributi con lo stesso nome delle colonne.
+    """
+    if key is None:
+        key = lambda item: [getattr(item, column.key) for column, _ in ordering]
+    if cursor:
+        query = query.filter(_after(ordering, decode_cursor(cursor, ordering)))
+    query = query.order_by(*[column.desc() if descending else column.asc()
+                             for column, descending in ordering])
+    items = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(key(items[-1]))
+    return items, next_cursor
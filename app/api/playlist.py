@@ -5,6 +5,11 @@ from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
 from .stations import stations_schema, ma # Riusiamo gli schemi delle stazioni
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
+from .pagination import wants_cursor, keyset_paginate, InvalidCursor
+from .loading import stations_with_tags
+from .serializers import compile_serializer
+from .result_cache import cached_response
+from sqlalchemy.orm import selectinload
 
 class PlaylistSchema(SQLAlchemyAutoSchema):
     class Meta:
@@ -23,6 +28,14 @@ class UserSchema(SQLAlchemyAutoSchema):
 playlist_schema = PlaylistSchema()
 playlists_schema = PlaylistSchema(many=True)
 
+dump_playlist = compile_serializer(playlist_schema)
+dump_playlists = compile_serializer(playlists_schema)
+
+
+def playlist_loads():
+    """Proprietario e stazioni (con i tag) caricati in blocco per tutte le playlist."""
+    return [selectinload(Playlist.owner), stations_with_tags(Playlist.stations)]
+
 
 @bp.route('/playlists', methods=['POST'])
 @jwt_required()
@@ -46,17 +59,31 @@ def create_playlist():
     )
     db.session.add(new_playlist)
     db.session.commit()
-    return jsonify(playlist_schema.dump(new_playlist)), 201
+    return jsonify(dump_playlist(new_playlist)), 201
 
 @bp.route('/playlists', methods=['GET'])
+@cached_response('playlists', depends_on_playlists=True)
 def get_public_playlists():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
-    pagination = (Playlist.query.filter_by(is_public=True)
+    if wants_cursor(request.args):
+        try:
+            public_playlists, next_cursor = keyset_paginate(
+                Playlist.query.options(*playlist_loads()).filter_by(is_public=True),
+                [(Playlist.created_at, True), (Playlist.id, True)],
+                per_page, request.args.get('cursor'))
+        except InvalidCursor:
+            return jsonify({"error" : "Invalid cursor"}), 400
+        return jsonify({
+            "items" : dump_playlists(public_playlists),
+            "next_cursor" : next_cursor,
+            "per_page" : per_page
+                       })
+    pagination = (Playlist.query.options(*playlist_loads()).filter_by(is_public=True)
                   .order_by(Playlist.created_at.desc())
                   .paginate(page=page, per_page=per_page, error_out=False))
     public_playlists = pagination.items
-    result = playlists_schema.dump(public_playlists)
+    result = dump_playlists(public_playlists)
     return jsonify({
         "items" : result,
         "total_items" : pagination.total,
@@ -69,10 +96,10 @@ def get_public_playlists():
 @jwt_required(optional=True)
 @bp.route('/playlists/<int:playlist_id>', methods=['GET'])
 def get_playlist(playlist_id):
-    playlist = Playlist.query.get_or_404(playlist_id)
+    playlist = Playlist.query.options(*playlist_loads()).get_or_404(playlist_id)
 
     if playlist.is_public:
-        return jsonify(playlist_schema.dump(playlist))
+        return jsonify(dump_playlist(playlist))
     try:
         verify_jwt_in_request()
     except Exception as e:
@@ -82,7 +109,7 @@ def get_playlist(playlist_id):
     if playlist.user_id != current_user_id:
         return jsonify({"error" : "Playlist not found"})
 
-    return jsonify(playlist_schema.dump(playlist))
+    return jsonify(dump_playlist(playlist))
 
 @bp.route('/playlists/<int:playlist_id>', methods=['PUT'])
 @jwt_required()
@@ -105,7 +132,7 @@ def update_playlist(playlist_id):
         playlist.is_public = data['is_public']
 
     db.session.commit()
-    return jsonify(playlist_schema.dump(playlist))
+    return jsonify(dump_playlist(playlist))
 
 
 @bp.route('/playlists/<int:playlist_id>', methods=['DELETE'])
@@ -0,0 +1,161 @@
+"""Cache lato server delle risposte degli endpoint di lettura piu' richiesti.
+
+``cached_response(namespace)`` memorizza il corpo JSON gia' serializzato
+delle risposte 200, con chiave data da endpoint e parametri normalizzati.
+L'invalidazione non deve cercare le chiavi: la chiave contiene la versione
+del catalogo (che cambia a ogni modifica di stazioni o tag) e, per le
+playlist, la versione delle playlist; entrambe stanno nella riga
+``catalog_version`` del database (vedi ``app.catalog.version``). Il worker
+che fa la modifica la vede subito, gli altri entro ``CATALOG_VERSION_TTL``
+secondi, e tutti i worker usano le stesse chiavi per gli stessi dati. Le
+voci vecchie diventano irraggiungibili e vengono espulse da LRU e TTL.
+
+Il backend di default e' un LRU in memoria per processo, limitato per
+numero di voci e byte. ``RESULT_CACHE_BACKEND`` puo' indicare una classe
+che implementa ``CacheBackend`` (es. su Redis) per condividere la cache tra
+i worker.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from importlib import import_module
+from urllib.parse import urlencode
+
+from flask import current_app, request
+
+from app.catalog.version import catalog_version, playlists_version
+
+
+class CacheBackend:
+    """Interfaccia dei backend della cache dei risultati."""
+
+    def get(self, key):
+        """Restituisce il valore (bytes) o ``None``."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class MemoryCacheBackend(CacheBackend):
+    """LRU in memoria con TTL, limitato per numero di voci e per byte."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # chiave -> (scadenza, valore)
+        self.size = 0
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.size += len(value)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, value = self.entries.pop(key)
+        self.size -= len(value)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+def _create_backend(app):
+    backend = app.config['RESULT_CACHE_BACKEND']
+    if backend == 'memory':
+        return MemoryCacheBackend(app.config['RESULT_CACHE_MAX_ENTRIES'],
+                                  app.config['RESULT_CACHE_MAX_BYTES'])
+    if isinstance(backend, str):
+        module_name, _, class_name = backend.partition(':')
+        backend = getattr(import_module(module_name), class_name)
+    return backend(app)
+
+
+def get_backend(app=None):
+    app = app or current_app
+    backend = app.extensions.get('result_cache')
+    if backend is None:
+        backend = app.extensions.setdefault('result_cache', _create_backend(app))
+    return backend
+
+
+def _normalized_args():
+    """Parametri senza valori vuoti, in ordine di nome.
+
+    Nomi e valori vengono ricodificati: ``genre=rock%26page%3D2`` non deve
+    avere la stessa chiave di ``genre=rock&page=2``.
+    """
+    return urlencode(sorted((name, value) for name, value in request.args.items(multi=True) if value))
+
+
+def cached_response(namespace, depends_on_playlists=False):
+    """Decoratore che serve dalla cache le risposte 200 della view."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            config = current_app.config
+            if not config['RESULT_CACHE_ENABLED']:
+                return view(*args, **kwargs)
+            backend = get_backend()
+            version, _ = catalog_version()
+            key = f'{namespace}:{version}'
+            if depends_on_playlists:
+                key += f':{playlists_version()}'
+            key += f':{request.path}?{_normalized_args()}'
+
+            body = backend.get(key)
+            if body is not None:
+                return current_app.response_class(body, mimetype='application/json')
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and response.mimetype == 'application/json':
+                backend.set(key, response.get_data(), config['RESULT_CACHE_TTL'])
+            return response
+        return wrapper
+    return decorator
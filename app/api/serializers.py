@@ -0,0 +1,77 @@
+"""Serializzatori compilati a partire dagli schemi marshmallow.
+
+``compile_serializer(schema)`` legge i campi di uno schema (anche annidati)
+e genera una funzione Python che costruisce direttamente il dizionario,
+senza il dispatch per campo di marshmallow. L'output e' identico a
+``schema.dump``; gli schemi restano la fonte di verita' per i campi e
+vengono ancora usati per la validazione e il caricamento.
+"""
+from marshmallow import fields
+
+_SIMPLE_FIELDS = (fields.String, fields.Boolean, fields.Raw)
+
+
+def _iso(value):
+    return None if value is None else value.isoformat()
+
+
+def _int(value):
+    return None if value is None else int(value)
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+def _is_plain_datetime(field):
+    return type(field) is fields.DateTime and (field.format or 'iso') in ('iso', 'iso8601')
+
+
+def _build(schema, namespace, counter):
+    """Genera il sorgente di una funzione ``obj -> dict`` e restituisce il suo nome."""
+    name = f'_dump_{len(counter)}'
+    counter.append(name)
+    items = []
+    for key, field in schema.dump_fields.items():
+        attribute = field.attribute or key
+        output = field.data_key or key
+        if not attribute.isidentifier():
+            bound = f'_field_{len(counter)}_{len(items)}'
+            namespace[bound] = field
+            expression = f'{bound}.serialize({key!r}, obj)'
+        else:
+            value = f'obj.{attribute}'
+            if isinstance(field, fields.Nested):
+                nested = _build(field.schema, namespace, counter)
+                if field.schema.many:
+                    expression = f'[{nested}(item) for item in {value}] if {value} is not None else None'
+                else:
+                    expression = f'{nested}({value}) if {value} is not None else None'
+            elif _is_plain_datetime(field):
+                expression = f'_iso({value})'
+            elif type(field) is fields.Integer and not field.as_string:
+                expression = f'_int({value})'
+            elif type(field) is fields.Float and not field.as_string:
+                expression = f'_float({value})'
+            elif type(field) in _SIMPLE_FIELDS:
+                expression = value
+            else:
+                bound = f'_field_{len(counter)}_{len(items)}'
+                namespace[bound] = field
+                expression = f'{bound}.serialize({key!r}, obj)'
+        items.append(f'        {output!r}: {expression},')
+    source = f'def {name}(obj):\n    return {{\n' + '\n'.join(items) + '\n    }\n'
+    exec(compile(source, f'<serializer {type(schema).__name__}>', 'exec'), namespace)
+    return name
+
+
+def compile_serializer(schema):
+    """Restituisce una funzione equivalente a ``schema.dump``.
+
+    Se lo schema ha ``many=True`` la funzione accetta una lista di oggetti.
+    """
+    namespace = {'_iso': _iso, '_int': _int, '_float': _float}
+    dump_one = namespace[_build(schema, namespace, [])]
+    if schema.many:
+        return lambda objs: [dump_one(obj) for obj in objs]
+    return dump_one
@@ -1,11 +1,20 @@
+import math
+import zlib
 from app.models import Station, MusicGenre, Decade, Topic, Lang, Mood
 from app.api import bp
-from flask import request, jsonify
+from flask import request, jsonify, current_app, abort, stream_with_context
 from flask_marshmallow import Marshmallow
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
-from sqlalchemy import func, case
 from app import db
-from app.models import station_musicgenres
+from app.catalog import get_index, bitmap
+from app.catalog.snapshot import current_snapshot
+from app.api.pagination import wants_cursor, encode_cursor, decode_cursor, InvalidCursor
+from app.api.loading import station_tags
+from app.api.serializers import compile_serializer
+from app.api.http_cache import catalog_conditional
+from app.catalog.version import catalog_version
+from app.api.result_cache import cached_response
+from app.history.trending import get_trending
 
 ma = Marshmallow(bp)
 
@@ -45,6 +54,7 @@ class StationSchema(SQLAlchemyAutoSchema):
         model = Station
         load_instance = True
         include_fk = True
+        exclude = ('updated_version', 'content_hash')
 
     music_genres = ma.Nested(MusicGenreSchema, many=True)
     decades = ma.Nested(DecadeSchema, many=True)
@@ -56,87 +66,288 @@ class StationSchema(SQLAlchemyAutoSchema):
 station_schema = StationSchema()
 stations_schema = StationSchema(many=True)
 
+# Serializzatore compilato per gli endpoint di lettura (stesso output di stations_schema.dump)
+dump_stations = compile_serializer(stations_schema)
+
 
 
 @bp.route('/stations', methods=['GET'])
+@catalog_conditional
+@cached_response('stations')
 def get_stations():
-    """Endpoint per cercare e filtrare le stazioni."""
+    """Endpoint per cercare e filtrare le stazioni.
+
+    Con ``cursor`` senza ricerca la chiave e' l'id dell'ultima stazione, quindi
+    le pagine restano coerenti anche se il catalogo cambia. Con ``search``
+    invece l'ordine e' quello di rilevanza e la chiave e' la posizione nella
+    classifica: il cursore contiene anche la versione del catalogo e, se nel
+    frattempo il catalogo e' cambiato (stazioni saltate o ripetute), viene
+    rifiutato con 409 e il client deve ripartire dalla prima pagina.
+    """
 
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
 
-    query = Station.query
-
-    search_term = request.args.get('search')
-    if search_term:
-        query = query.filter(Station.name.ilike(f'%{search_term}%'))
-
-    filter_map = {
-        'genre': (Station.music_genres, MusicGenre),
-        'decade': (Station.decades, Decade),
-        'topic': (Station.topics, Topic),
-        'lang': (Station.langs, Lang),
-        'mood': (Station.moods, Mood),
-        'countrycode': (Station.countrycode, None)  # Filtro diretto
-    }
-
-    for arg, (relationship, model) in filter_map.items():
-        if request.args.get(arg):
-            values = request.args.get(arg).split(',')
-            if model:
-                query = query.join(relationship).filter(model.name.in_(values))
+    if page < 1:
+        page = 1
+    if per_page < 1:
+        per_page = 20
+
+    try:
+        selected, ranked_ids = _match_stations(request.args)
+    except ValueError:
+        return jsonify({'error': "match must be 'any' or 'all'"}), 400
+
+    use_cursor = wants_cursor(request.args)
+    after = None
+    version, _ = catalog_version()
+    if use_cursor and request.args.get('cursor'):
+        try:
+            values = decode_cursor(request.args.get('cursor'))
+            if ranked_ids is not None:
+                after, cursor_version = values
             else:
-                query = query.filter(relationship.in_(values))
-
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-    stations = pagination.items
-
-    result = stations_schema.dump(stations)
+                after, = values
+            after = int(after)
+        except (InvalidCursor, ValueError, TypeError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+        if after < 0:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        if ranked_ids is not None and cursor_version != version:
+            return jsonify({'error': 'Cursor expired: the catalog has changed, restart from the first page'}), 409
+
+    if ranked_ids is not None:
+        # Con la ricerca la chiave del cursore e' la posizione nella classifica
+        total = len(ranked_ids)
+        start = (after + 1 if after is not None else 0) if use_cursor else (page - 1) * per_page
+        page_ids = ranked_ids[start:start + per_page + (1 if use_cursor else 0)]
+        last_key = start + per_page - 1
+    else:
+        if use_cursor:
+            page_ids = bitmap.take(selected, per_page + 1, after=after)
+        else:
+            total = selected.bit_count()
+            page_ids = bitmap.take(selected, per_page, offset=(page - 1) * per_page)
+        last_key = page_ids[per_page - 1] if len(page_ids) > per_page else None
+
+    if use_cursor:
+        key = [last_key, version] if ranked_ids is not None else [last_key]
+        next_cursor = encode_cursor(key) if len(page_ids) > per_page else None
+        return jsonify({
+            'items': station_items(page_ids[:per_page]),
+            'next_cursor': next_cursor,
+            'per_page': per_page
+        })
+
+    result = station_items(page_ids)
 
     return jsonify({
         'items': result,
-        'total_items': pagination.total,
-        'total_pages': pagination.pages,
+        'total_items': total,
+        'total_pages': math.ceil(total / per_page),
         'page': page,
         'per_page': per_page
     })
 
 
+def _match_stations(args):
+    """Applica ricerca e filtri di ``args`` agli indici in memoria.
+
+    Restituisce ``(bitmap, ranked_ids)``: ``ranked_ids`` e' ``None`` senza
+    ricerca, altrimenti gli id trovati ordinati per rilevanza. Solleva
+    ``ValueError`` se ``match`` non e' valido.
+    """
+    tag_index = get_index('tags')
+    filtered = tag_index.filter(args, args.get('match', 'any'))
+    selected = filtered if filtered is not None else tag_index.all
+
+    ranked_ids = None
+    search_term = args.get('search')
+    if search_term:
+        # Ricerca fuzzy sull'indice a trigrammi: tutti i risultati che passano
+        # i filtri, ordinati per rilevanza (conteggi e pagine sono completi)
+        accept = bitmap.membership(filtered) if filtered is not None else None
+        ranked_ids = get_index('search').search(search_term, accept=accept)
+        selected = bitmap.from_ids(ranked_ids)
+    return selected, ranked_ids
+
+
+@bp.route('/stations/facets', methods=['GET'])
+@catalog_conditional
+def get_station_facets():
+    """Conteggi per tag e per country code sui risultati dei filtri correnti."""
+    try:
+        selected, _ = _match_stations(request.args)
+    except ValueError:
+        return jsonify({'error': "match must be 'any' or 'all'"}), 400
+
+    return jsonify({
+        'total_items': selected.bit_count(),
+        'facets': get_index('tags').counts(selected)
+    })
+
+
+@bp.route('/stations/nearby', methods=['GET'])
+@catalog_conditional
+def get_nearby_stations():
+    """Le stazioni piu' vicine a ``lat``/``lon``, eventualmente filtrate per tag."""
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None:
+        return jsonify({'error': 'must include lat and lon'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({'error': 'lat/lon out of range'}), 400
+
+    config = current_app.config
+    radius_km = request.args.get('radius_km', config['NEARBY_DEFAULT_RADIUS_KM'], type=float)
+    radius_km = min(max(radius_km, 0), config['NEARBY_MAX_RADIUS_KM'])
+    limit = min(max(request.args.get('limit', 20, type=int), 0), config['NEARBY_MAX_LIMIT'])
+
+    try:
+        selected = get_index('tags').filter(request.args, request.args.get('match', 'any'))
+    except ValueError:
+        return jsonify({'error': "match must be 'any' or 'all'"}), 400
+    accept = bitmap.membership(selected) if selected is not None else None
+
+    nearest = get_index('geo').nearest(lat, lon, limit, radius_km, accept=accept)
+    distances = dict(nearest)
+
+    result = station_items([station_id for station_id, _ in nearest])
+    for item in result:
+        item['distance_km'] = round(distances[item['id']], 3)
+    return jsonify(result)
+
+
+def _ranked_stations(kind):
+    limit = min(max(request.args.get('limit', 20, type=int), 0), current_app.config['TRENDING_MAX_LIMIT'])
+    tag_index = get_index('tags')
+    try:
+        selected = tag_index.filter(request.args, request.args.get('match', 'any'))
+    except ValueError:
+        return jsonify({'error': "match must be 'any' or 'all'"}), 400
+    # Le stazioni cancellate restano nei contatori finche' il peso non si azzera
+    accept = bitmap.membership(selected) if selected is not None else tag_index.contains
+
+    ranked = get_trending().top(kind, limit, accept=accept)
+    scores = dict(ranked)
+    result = station_items([station_id for station_id, _ in ranked])
+    for item in result:
+        item['score'] = round(scores[item['id']], 3)
+    return jsonify(result)
+
+
+@bp.route('/stations/trending', methods=['GET'])
+def get_trending_stations():
+    """Le stazioni piu' ascoltate nelle ultime ore, filtrabili come ``/stations``."""
+    return _ranked_stations('trending')
+
+
+@bp.route('/stations/popular', methods=['GET'])
+def get_popular_stations():
+    """Le stazioni piu' ascoltate negli ultimi giorni, filtrabili come ``/stations``."""
+    return _ranked_stations('popular')
+
+
+@bp.route('/stations/export', methods=['GET'])
+def export_stations():
+    """Esporta in streaming (NDJSON) le stazioni con i loro tag.
+
+    Accetta gli stessi filtri di ``get_stations`` e ``since=<versione>``
+    per esportare solo le stazioni modificate dopo quella versione del
+    catalogo. La memoria usata non dipende dalla dimensione del catalogo.
+    """
+    tag_index = get_index('tags')
+    try:
+        selected = tag_index.filter(request.args, request.args.get('match', 'any'))
+    except ValueError:
+        return jsonify({'error': "match must be 'any' or 'all'"}), 400
+
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'error': 'since must be a catalog version number'}), 400
+
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    dumps = current_app.json.dumps
+
+    def station_ids():
+        if since is None:
+            yield from bitmap.iter_ids(selected if selected is not None else tag_index.all)
+            return
+        # Le stazioni modificate vengono lette con un cursore lato server
+        contains = bitmap.membership(selected) if selected is not None else None
+        query = (db.session.query(Station.id).filter(Station.updated_version > since)
+                 .order_by(Station.id).execution_options(stream_results=True, yield_per=batch_size))
+        for station_id, in query:
+            if contains is None or contains(station_id):
+                yield station_id
+
+    def generate():
+        batch = []
+        for station_id in station_ids():
+            batch.append(station_id)
+            if len(batch) == batch_size:
+                yield _export_lines(batch, dumps)
+                batch = []
+        if batch:
+            yield _export_lines(batch, dumps)
+
+    body = stream_with_context(generate())
+    use_gzip = 'gzip' in request.accept_encodings
+    if use_gzip:
+        body = _gzip_stream(body)
+    response = current_app.response_class(body, mimetype='application/x-ndjson')
+    response.vary.add('Accept-Encoding')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def _export_lines(station_ids, dumps):
+    lines = [dumps(item) for item in station_items(station_ids)]
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def load_stations(station_ids):
+    """Carica le stazioni con una sola query mantenendo l'ordine di ``station_ids``."""
+    if not station_ids:
+        return []
+    query = Station.query.options(*station_tags()).filter(Station.id.in_(station_ids))
+    by_id = {station.id: station for station in query}
+    return [by_id[station_id] for station_id in station_ids if station_id in by_id]
+
+
+def station_items(station_ids):
+    """Stazioni serializzate nell'ordine di ``station_ids``.
+
+    Se c'e' uno snapshot mmap allineato alla versione corrente del catalogo
+    le stazioni vengono lette da li' senza interrogare il database.
+    """
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        return snapshot.stations(station_ids)
+    return dump_stations(load_stations(station_ids))
+
+
 @bp.route('/stations/<int:station_id>/similar', methods=['GET'])
+@catalog_conditional
+@cached_response('similar')
 def get_similar_stations(station_id):
     limit = request.args.get('limit', 10, type=int)
-    source_station = Station.query.get_or_404(station_id)
-
-    source_genre_ids = {tag.id for tag in source_station.music_genres}
-    source_decade_ids = {tag.id for tag in source_station.decades}
-    source_topic_ids = {tag.id for tag in source_station.topics}
-    source_lang_ids = {tag.id for tag in source_station.langs}
-    source_mood_ids = {tag.id for tag in source_station.moods}
-
-    if not any([source_genre_ids, source_decade_ids, source_topic_ids, source_lang_ids, source_mood_ids]):
-        return jsonify([])
-
-    score_expression = (
-            func.sum(case((MusicGenre.id.in_(source_genre_ids), 5), else_=0)) +
-            func.sum(case((Lang.id.in_(source_lang_ids), 4), else_=0)) +
-            func.sum(case((Decade.id.in_(source_decade_ids), 3), else_=0)) +
-            func.sum(case((Topic.id.in_(source_topic_ids), 2), else_=0)) +
-            func.sum(case((Mood.id.in_(source_mood_ids), 1), else_=0))
-    ).label("similarity_score")
-
-
-    query = db.session.query(Station, score_expression) \
-        .outerjoin(Station.music_genres) \
-        .outerjoin(Station.decades) \
-        .outerjoin(Station.topics) \
-        .outerjoin(Station.langs) \
-        .outerjoin(Station.moods) \
-        .filter(Station.id != station_id) \
-        .group_by(Station.id) \
-        .having(score_expression > 0) \
-        .order_by(score_expression.desc()) \
-        .limit(limit)
-
-    similar_stations = [station for station, score in query.all()]
-
-    return jsonify(stations_schema.dump(similar_stations))
\ No newline at end of file
+    if not get_index('tags').contains(station_id):
+        abort(404)
+
+    # Punteggio pesato sui tag in comune calcolato sulle bitmap in memoria
+    similar = get_index('similarity').similar(station_id, limit)
+    return jsonify(station_items([similar_id for similar_id, _ in similar]))
\ No newline at end of file
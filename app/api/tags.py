@@ -1,6 +1,7 @@
 from app.models import MusicGenre, Decade, Topic, Lang, Mood
 from app.api import bp
 from flask import jsonify
+from app.api.http_cache import catalog_conditional
 
 CATEGORY_MODEL_MAP = {
     "Music Genre": MusicGenre,
@@ -12,12 +13,14 @@ CATEGORY_MODEL_MAP = {
 
 
 @bp.route('/tags/categories', methods=['GET'])
+@catalog_conditional
 def get_categories():
     categories = list(CATEGORY_MODEL_MAP.keys())
     return jsonify(categories)
 
 
 @bp.route('/tags/<string:category_name>', methods=['GET'])
+@catalog_conditional
 def get_tags_by_category(category_name):
     model_class = CATEGORY_MODEL_MAP.get(category_name)
 
@@ -1,14 +1,23 @@
 from sqlalchemy.testing.util import total_size
+from datetime import datetime, timedelta
+from sqlalchemy import desc, func
 
-from app.models import User, Station, PlayHistory, Playlist
+from app.models import Station, PlayHistory, Playlist, DailyUserPlays, user_favorites
 from app.api import bp
 from app import db
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from .playlist import playlists_schema
+from .playlist import dump_playlists, playlist_loads
 
-from .stations import stations_schema, StationSchema, ma
+from .stations import dump_stations, station_items, StationSchema, ma
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
+from .pagination import wants_cursor, keyset_paginate, InvalidCursor
+from .loading import station_tags, stations_with_tags
+from .serializers import compile_serializer
+from app.catalog import get_index
+from app.catalog.recommend import recommend, invalidate_recommendations
+from app.history.buffer import BufferFull, get_buffer
+from app.history.sessions import SESSION_EVENTS, decode_session, encode_session
 
 
 class PlayHistorySchema(SQLAlchemyAutoSchema):
@@ -18,22 +27,29 @@ class PlayHistorySchema(SQLAlchemyAutoSchema):
     station = ma.Nested(StationSchema)
 
 play_history_schema = PlayHistorySchema(many=True)
+dump_play_history = compile_serializer(play_history_schema)
+
+
+def _is_favorite(user_id, station_id):
+    return db.session.query(user_favorites.c.station_id).filter(
+        user_favorites.c.user_id == user_id, user_favorites.c.station_id == station_id).first() is not None
 
 
 @bp.route('/user/favorites', methods=['GET'])
 @jwt_required()
 def get_favorites():
     current_user_id = get_jwt_identity()
-    user = User.query.get_or_404(current_user_id)
-    favorite_stations = user.favorite_stations.all()
-    return jsonify(stations_schema.dump(favorite_stations))
+    # L'utente viene dal token (vedi app.api.identity): nessuna lettura di ``user``
+    favorite_stations = (Station.query.options(*station_tags())
+                         .join(user_favorites, user_favorites.c.station_id == Station.id)
+                         .filter(user_favorites.c.user_id == current_user_id).all())
+    return jsonify(dump_stations(favorite_stations))
 
 
 @bp.route('/user/favorites', methods=['POST'])
 @jwt_required()
 def add_favorite():
     current_user_id = get_jwt_identity()
-    user = User.query.get_or_404(current_user_id)
 
     data = request.get_json()
     if not data or 'station_id' not in data:
@@ -41,11 +57,12 @@ def add_favorite():
 
     station = Station.query.get_or_404(data['station_id'])
 
-    if station in user.favorite_stations:
+    if _is_favorite(current_user_id, station.id):
         return jsonify({"message": "Station already in favorites"}), 200
 
-    user.favorite_stations.append(station)
+    db.session.execute(user_favorites.insert().values(user_id=current_user_id, station_id=station.id))
     db.session.commit()
+    invalidate_recommendations(current_user_id)
     return jsonify({"message": "Station added to favorites"}), 201
 
 
@@ -53,33 +70,65 @@ def add_favorite():
 @jwt_required()
 def remove_favorite(station_id):
     current_user_id = get_jwt_identity()
-    user = User.query.get_or_404(current_user_id)
-    station = Station.query.get_or_404(station_id)
 
-    if station not in user.favorite_stations:
+    removed = db.session.execute(user_favorites.delete().where(
+        user_favorites.c.user_id == current_user_id, user_favorites.c.station_id == station_id)).rowcount
+    if not removed:
+        # La stazione inesistente resta un 404, come prima
+        Station.query.get_or_404(station_id)
         return jsonify({"error": "Station not in favorites"}), 400
 
-    user.favorite_stations.remove(station)
     db.session.commit()
+    invalidate_recommendations(current_user_id)
     return jsonify({"message": "Station removed from favorites"}), 200
 
 
 @bp.route('/user/history', methods=['POST'])
 @jwt_required()
 def add_to_history():
+    """Eventi della sessione di ascolto: ``start`` (default), ``heartbeat`` e ``stop``.
+
+    Vedi app.history.sessions per la fusione delle sessioni e
+    app.history.buffer per le garanzie di consegna.
+    """
     current_user_id = get_jwt_identity()
     data = request.get_json()
-    if not data or 'station_id' not in data:
+    if not data:
+        return jsonify({"error": "Missing station_id"}), 400
+    event = data.get('event', 'start')
+    if event not in SESSION_EVENTS:
+        return jsonify({"error": "event must be 'start', 'heartbeat' or 'stop'"}), 400
+    buffer = get_buffer()
+
+    if event != 'start':
+        try:
+            station_id, started_at = decode_session(data.get('session_id'))
+        except ValueError:
+            return jsonify({"error": "Invalid session_id"}), 400
+        now = datetime.utcnow()
+        if started_at > now:
+            return jsonify({"error": "Invalid session_id"}), 400
+        try:
+            buffer.heartbeat(current_user_id, station_id, started_at, now)
+        except BufferFull:
+            return jsonify({"error": "History is temporarily unavailable"}), 503
+        return jsonify({"message": "Session updated",
+                        "session_id": encode_session(station_id, started_at)}), 200
+
+    if 'station_id' not in data:
         return jsonify({"error": "Missing station_id"}), 400
-
     station_id = data['station_id']
-    if not Station.query.get(station_id):
+    if not isinstance(station_id, int) or isinstance(station_id, bool):
+        return jsonify({"error": "Invalid station_id"}), 400
+    if not get_index('tags').contains(station_id):
         return jsonify({"error": "Station not found"}), 404
 
-    history_entry = PlayHistory(user_id=current_user_id, station_id=station_id)
-    db.session.add(history_entry)
-    db.session.commit()
-    return jsonify({"message": "Playback recorded"}), 201
+    try:
+        started_at = buffer.start(current_user_id, station_id)
+    except BufferFull:
+        return jsonify({"error": "History is temporarily unavailable"}), 503
+    return jsonify({"message": "Playback recorded",
+                    "session_id": encode_session(station_id, started_at)}), 201
 
 
 @bp.route('/user/history', methods=['GET'])
@@ -89,11 +138,30 @@ def get_history():
     per_page = request.args.get('per_page', 30, type=int)
 
     current_user_id = get_jwt_identity()
-    user = User.query.get_or_404(current_user_id)
-
-    pagination = user.play_history.paginate(page=page, per_page=per_page, error_out=False)
-
-    result = play_history_schema.dump(pagination.items)
+    # Gli ascolti ancora in coda devono comparire nella cronologia
+    buffer = get_buffer()
+    if buffer.pending(current_user_id):
+        buffer.flush()
+    history = PlayHistory.query.filter_by(user_id=current_user_id)
+
+    if wants_cursor(request.args):
+        try:
+            entries, next_cursor = keyset_paginate(
+                history.options(stations_with_tags(PlayHistory.station)),
+                [(PlayHistory.played_at, True), (PlayHistory.id, True)],
+                per_page, request.args.get('cursor'))
+        except InvalidCursor:
+            return jsonify({"error": "Invalid cursor"}), 400
+        return jsonify({
+            'items': dump_play_history(entries),
+            'next_cursor': next_cursor,
+            'per_page': per_page
+        })
+
+    pagination = (history.options(stations_with_tags(PlayHistory.station))
+                  .order_by(desc(PlayHistory.played_at)).paginate(page=page, per_page=per_page, error_out=False))
+
+    result = dump_play_history(pagination.items)
 
     return jsonify({
         'items': result,
@@ -103,20 +171,57 @@ def get_history():
         'per_page': per_page
     })
 
+@bp.route('/user/history/stats', methods=['GET'])
+@jwt_required()
+def get_history_stats():
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    current_user_id = get_jwt_identity()
+    buffer = get_buffer()
+    if buffer.pending(current_user_id):
+        buffer.flush()
+
+    # Solo conteggi giornalieri: nessuna scansione degli ascolti grezzi
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date()
+    recent = [DailyUserPlays.user_id == current_user_id, DailyUserPlays.day >= since]
+    plays, seconds = func.sum(DailyUserPlays.plays), func.sum(DailyUserPlays.seconds)
+    per_day = (db.session.query(DailyUserPlays.day, plays, seconds)
+               .filter(*recent).group_by(DailyUserPlays.day).order_by(DailyUserPlays.day).all())
+    top = (db.session.query(DailyUserPlays.station_id, plays.label('plays'), seconds)
+           .filter(*recent).group_by(DailyUserPlays.station_id)
+           .order_by(desc('plays'), DailyUserPlays.station_id).limit(10).all())
+    stations = station_items([station_id for station_id, _, _ in top])
+    return jsonify({
+        'days': [{'day': day.isoformat(), 'plays': count, 'seconds': listened}
+                 for day, count, listened in per_day],
+        'total_plays': sum(count for _, count, _ in per_day),
+        'total_seconds': sum(listened for _, _, listened in per_day),
+        'top_stations': [{'station': station, 'plays': count, 'seconds': listened}
+                         for station, (_, count, listened) in zip(stations, top)],
+    })
+
 @bp.route('/user/playlists', methods=['GET'])
 @jwt_required()
 def get_my_playlists():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 30, type=int)
     current_user_id = get_jwt_identity()
-    user = User.query.get_or_404(current_user_id)
-    pagination = (user.playlists.order_by(Playlist.created_at.desc())
+    pagination = (Playlist.query.filter_by(user_id=current_user_id).options(*playlist_loads())
+                  .order_by(Playlist.created_at.desc())
                   .paginate(page=page, per_page=per_page, error_out=False))
     my_playlists = pagination.items
     return jsonify({
-        "items" : playlists_schema.dump(my_playlists),
+        "items" : dump_playlists(my_playlists),
         "total_items": pagination.total,
         "total_pages": pagination.pages,
         "page": page,
         "per_page": per_page
-    })
\ No newline at end of file
+    })
+
+@bp.route('/user/recommendations', methods=['GET'])
+@jwt_required()
+def get_recommendations():
+    limit = min(max(request.args.get('limit', 20, type=int), 0), 100)
+    current_user_id = get_jwt_identity()
+
+    station_ids = recommend(current_user_id, limit)
+    return jsonify(station_items(station_ids))
@@ -0,0 +1,114 @@
+"""Indici in memoria costruiti a partire dal catalogo delle stazioni.
+
+Ogni indice viene costruito in modo lazy alla prima richiesta e poi
+aggiornato in modo incrementale quando le stazioni cambiano (vedi
+``app.catalog.events``).
+"""
+import threading
+
+from blinker import Namespace
+from flask import current_app
+
+_signals = Namespace()
+
+# Inviato dopo ogni modifica del catalogo. Argomenti: sender=app, upserted e
+# deleted (set di id), tags_changed (bool), full=True se non si sa cosa e'
+# cambiato (es. modifica fatta da un altro processo).
+catalog_changed = _signals.signal('catalog-changed')
+
+# Inviato dopo una sostituzione completa del catalogo, anche fatta da un altro
+# processo (sender=app): utenti, cronologia e playlist sono stati svuotati.
+# Segue sempre un ``catalog_changed`` con full=True.
+catalog_replaced = _signals.signal('catalog-replaced')
+
+_INDEX_CLASSES = {}
+
+
+def register_index(name):
+    """Decoratore che registra una classe di indice sotto ``name``."""
+    def decorator(cls):
+        _INDEX_CLASSES[name] = cls
+        return cls
+    return decorator
+
+
+class CatalogIndex:
+    """Base per gli indici: ``build`` ricostruisce, ``apply`` aggiorna."""
+
+    # Se True un cambiamento delle tabelle dei tag forza una ricostruzione
+    depends_on_tags = False
+
+    @classmethod
+    def build(cls):
+        raise NotImplementedError
+
+    def apply(self, upserted, deleted):
+        """Aggiorna l'indice per le stazioni modificate o cancellate.
+
+        Restituisce False se l'indice non supporta l'aggiornamento
+        incrementale e va ricostruito.
+        """
+        return False
+
+
+class IndexHolder:
+    """Contiene un indice e le modifiche in attesa di essere applicate."""
+
+    def __init__(self, index_class):
+        self.index_class = index_class
+        self.index = None
+        self.upserted = set()
+        self.deleted = set()
+        self.stale = False
+        self.lock = threading.RLock()
+
+    def notify(self, upserted=(), deleted=(), tags_changed=False):
+        with self.lock:
+            if self.index is None:
+                return
+            if tags_changed and self.index_class.depends_on_tags:
+                self.stale = True
+            self.upserted.update(upserted)
+            self.upserted.difference_update(deleted)
+            self.deleted.update(deleted)
+
+    def invalidate(self):
+        with self.lock:
+            self.stale = True
+
+    def get(self):
+        with self.lock:
+            if self.index is not None and not self.stale and (self.upserted or self.deleted):
+                if not self.index.apply(self.upserted, self.deleted):
+                    self.stale = True
+                self.upserted, self.deleted = set(), set()
+            if self.index is None or self.stale:
+                self.index = self.index_class.build()
+                self.upserted, self.deleted = set(), set()
+                self.stale = False
+            return self.index
+
+
+def _holders(app):
+    return app.extensions.setdefault('catalog_indexes', {})
+
+
+def get_index(name):
+    """Restituisce l'indice ``name`` per l'app corrente, costruendolo se serve."""
+    holders = _holders(current_app)
+    holder = holders.get(name)
+    if holder is None:
+        holder = holders.setdefault(name, IndexHolder(_INDEX_CLASSES[name]))
+    return holder.get()
+
+
+def notify_indexes(app, upserted=(), deleted=(), tags_changed=False):
+    """Propaga un cambiamento del catalogo a tutti gli indici gia' costruiti."""
+    for holder in list(_holders(app).values()):
+        holder.notify(upserted, deleted, tags_changed)
+
+
+def invalidate_indexes(app):
+    """Forza la ricostruzione di tutti gli indici alla prossima richiesta."""
+    for holder in list(_holders(app).values()):
+        holder.invalidate()
@@ -0,0 +1,74 @@
+"""Comandi ``flask catalog ...`` per gestire il catalogo delle stazioni."""
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.catalog.importer import DEFAULT_BATCH_SIZE, import_catalog, sync_catalog
+from app.catalog.snapshot import build_snapshot
+from app.catalog.synthetic import generate_dataset
+
+catalog_cli = AppGroup('catalog', help='Comandi per il catalogo delle stazioni.')
+
+
+def _write_snapshot(path):
+    start = time.perf_counter()
+    version, count = build_snapshot(path)
+    click.echo(f'Snapshot della versione {version}: {count} stazioni in {path} '
+               f'({time.perf_counter() - start:.1f}s)')
+
+
+@catalog_cli.command('snapshot')
+@click.argument('path', required=False)
+def snapshot_command(path):
+    """Costruisce lo snapshot mmap del catalogo."""
+    path = path or current_app.config.get('CATALOG_SNAPSHOT_PATH')
+    if not path:
+        raise click.UsageError('Specificare il percorso o impostare CATALOG_SNAPSHOT_PATH.')
+    _write_snapshot(path)
+
+
+@catalog_cli.command('import')
+@click.argument('csv_path', default='scripts/stations_final.csv')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Stazioni scritte per ogni blocco.')
+@click.option('--sync', is_flag=True,
+              help='Applica solo le differenze mantenendo gli id delle stazioni.')
+@click.option('--workers', default=1, show_default=True,
+              help='Processi che analizzano il CSV in parallelo (0 = numero di CPU).')
+def import_command(csv_path, batch_size, sync, workers):
+    """Sostituisce (o sincronizza con --sync) il catalogo con il contenuto del CSV."""
+    run = sync_catalog if sync else import_catalog
+    stats = run(csv_path, batch_size=batch_size, workers=workers or os.cpu_count())
+    click.echo(f'Importazione completata: {stats.summary()}')
+    # Lo snapshot configurato viene riallineato alla nuova versione
+    path = current_app.config.get('CATALOG_SNAPSHOT_PATH')
+    if path and stats.version is not None:
+        _write_snapshot(path)
+
+
+@catalog_cli.command('generate')
+@click.option('--stations', default=10000, show_default=True, help='Numero di stazioni.')
+@click.option('--users', default=1000, show_default=True, help='Numero di utenti (user1, user2, ...).')
+@click.option('--favorites', default=10, show_default=True, help='Preferiti medi per utente.')
+@click.option('--playlists', default=1, show_default=True, help='Playlist medie per utente.')
+@click.option('--plays', default=50, show_default=True, help='Ascolti medi per utente.')
+@click.option('--seed', default=0, show_default=True, help='Seme del generatore casuale.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Righe scritte per ogni blocco.')
+@click.confirmation_option(prompt='Il database verra\' svuotato. Continuare?')
+def generate_command(stations, users, favorites, playlists, plays, seed, batch_size):
+    """Sostituisce il database con un dataset sintetico riproducibile."""
+    stats, counts = generate_dataset(stations, users, favorites, playlists, plays,
+                                     seed=seed, batch_size=batch_size)
+    click.echo(f'Catalogo generato: {stats.summary()}')
+    click.echo('Attivita\': ' + ', '.join(f'{count} righe in {table}' for table, count in counts.items()))
+    path = current_app.config.get('CATALOG_SNAPSHOT_PATH')
+    if path:
+        _write_snapshot(path)
+
+
+def init_app(app):
+    app.cli.add_command(catalog_cli)
@@ -0,0 +1,87 @@
+"""Tracciamento delle modifiche al catalogo fatte tramite la sessione ORM.
+
+Durante il flush raccogliamo gli id delle stazioni inserite, modificate o
+cancellate; dopo il commit inviamo il segnale ``catalog_changed`` cosi' gli
+indici in memoria possono aggiornarsi. Le modifiche alle playlist
+incrementano ``playlists_version`` (vedi ``app.catalog.version``). Un
+rollback scarta le modifiche.
+"""
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.catalog import catalog_changed, notify_indexes, invalidate_indexes
+from app.catalog.version import (bump_catalog_version, bump_playlists_version, mark_stations,
+                                 record_playlists_version, record_version)
+from app.models import Station, MusicGenre, Decade, Topic, Lang, Mood, Playlist
+
+TAG_MODELS = (MusicGenre, Decade, Topic, Lang, Mood)
+
+
+def _pending(session):
+    return session.info.setdefault('catalog_changes', {
+        'upserted': set(), 'deleted': set(), 'tags_changed': False
+    })
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changes = None
+    touched = set()
+    if 'playlists_version' not in session.info:
+        for obj in session.new | session.dirty | session.deleted:
+            if isinstance(obj, Playlist):
+                # Una sola volta per transazione, come la versione del catalogo
+                session.info['playlists_version'] = bump_playlists_version(session.connection())
+                break
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Station):
+            changes = changes or _pending(session)
+            changes['upserted'].add(obj.id)
+            touched.add(obj.id)
+        elif isinstance(obj, TAG_MODELS):
+            # Le collezioni dei tag cambiano gia' insieme alla stazione
+            if obj in session.new or session.is_modified(obj, include_collections=False):
+                changes = changes or _pending(session)
+                changes['tags_changed'] = True
+    for obj in session.deleted:
+        if isinstance(obj, Station):
+            changes = changes or _pending(session)
+            changes['deleted'].add(obj.id)
+        elif isinstance(obj, TAG_MODELS):
+            changes = changes or _pending(session)
+            changes['tags_changed'] = True
+    if changes is not None and 'version' not in changes:
+        # Una sola volta per transazione, insieme alle modifiche stesse
+        changes['version'], changes['updated_at'] = bump_catalog_version(session.connection())
+    if touched:
+        mark_stations(session.connection(), touched, changes['version'])
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_changes(session):
+    changes = session.info.pop('catalog_changes', None)
+    playlists = session.info.pop('playlists_version', None)
+    if not has_app_context():
+        return
+    if changes:
+        catalog_changed.send(current_app._get_current_object(), **changes)
+    if playlists is not None:
+        record_playlists_version(current_app._get_current_object(), playlists)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('catalog_changes', None)
+    session.info.pop('playlists_version', None)
+
+
+@catalog_changed.connect
+def _update_indexes(app, upserted=(), deleted=(), tags_changed=False, full=False,
+                    version=None, updated_at=None):
+    if version is not None and record_version(app, version, updated_at):
+        full = True
+    if full:
+        invalidate_indexes(app)
+    else:
+        notify_indexes(app, upserted, deleted, tags_changed)
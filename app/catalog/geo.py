@@ -0,0 +1,151 @@
+"""Indice spaziale per trovare le stazioni piu' vicine a un punto.
+
+Le coordinate vengono proiettate sulla sfera unitaria (x, y, z) e messe in
+una griglia di cubi di lato fisso. La distanza euclidea tra due punti (la
+corda) cresce con la distanza sulla superficie, quindi basta visitare i
+cubi ad anelli concentrici attorno al punto cercato: dopo l'anello ``r``
+ogni punto non ancora visto dista almeno ``r * lato``, e ci si ferma
+appena questo limite supera il raggio o il k-esimo risultato migliore.
+La distanza viene calcolata solo sui candidati, mai su tutta la tabella.
+"""
+import heapq
+import math
+
+from flask import current_app
+
+from app import db
+from app.catalog import CatalogIndex, register_index
+from app.models import Station
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_xyz(lat, lon):
+    phi, lam = math.radians(lat), math.radians(lon)
+    cos_phi = math.cos(phi)
+    return cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi)
+
+
+def km_to_chord(km):
+    return 2 * math.sin(min(km, math.pi * EARTH_RADIUS_KM) / (2 * EARTH_RADIUS_KM))
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+def _ring(center, r):
+    """Celle a distanza di Chebyshev esattamente ``r`` da ``center``."""
+    cx, cy, cz = center
+    if r == 0:
+        yield center
+        return
+    for dx in range(-r, r + 1):
+        for dy in range(-r, r + 1):
+            if abs(dx) == r or abs(dy) == r:
+                for dz in range(-r, r + 1):
+                    yield cx + dx, cy + dy, cz + dz
+            else:
+                yield cx + dx, cy + dy, cz - r
+                yield cx + dx, cy + dy, cz + r
+
+
+@register_index('geo')
+class GeoGridIndex(CatalogIndex):
+
+    def __init__(self, cell_km):
+        self.cell = km_to_chord(cell_km)
+        self.cells = {}      # cella -> {station_id: (x, y, z)}
+        self.locations = {}  # station_id -> cella
+
+    @classmethod
+    def build(cls):
+        index = cls(current_app.config['GEO_CELL_KM'])
+        query = (db.session.query(Station.id, Station.geo_lat, Station.geo_long)
+                 .filter(Station.geo_lat.isnot(None), Station.geo_long.isnot(None)))
+        for station_id, lat, lon in query.yield_per(10000):
+            index.add(station_id, lat, lon)
+        return index
+
+    def apply(self, upserted, deleted):
+        for station_id in set(upserted) | set(deleted):
+            self.remove(station_id)
+        if upserted:
+            query = (db.session.query(Station.id, Station.geo_lat, Station.geo_long)
+                     .filter(Station.id.in_(upserted),
+                             Station.geo_lat.isnot(None), Station.geo_long.isnot(None)))
+            for station_id, lat, lon in query:
+                self.add(station_id, lat, lon)
+        return True
+
+    def _key(self, point):
+        return tuple(math.floor(coordinate / self.cell) for coordinate in point)
+
+    def add(self, station_id, lat, lon):
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return
+        point = to_xyz(lat, lon)
+        key = self._key(point)
+        self.cells.setdefault(key, {})[station_id] = point
+        self.locations[station_id] = key
+
+    def remove(self, station_id):
+        key = self.locations.pop(station_id, None)
+        if key is not None:
+            cell = self.cells[key]
+            cell.pop(station_id, None)
+            if not cell:
+                del self.cells[key]
+
+    def _rings(self, center):
+        """Coppie ``(r, celle)`` ad anelli crescenti attorno a ``center``.
+
+        Quando un anello avrebbe piu' celle di quelle occupate conviene
+        scorrere direttamente le celle occupate raggruppate per distanza.
+        """
+        r = 0
+        while True:
+            if 24 * r * r > len(self.cells):
+                remaining = {}
+                for key in self.cells:
+                    distance = max(abs(a - b) for a, b in zip(key, center))
+                    if distance >= r:
+                        remaining.setdefault(distance, []).append(key)
+                for distance in sorted(remaining):
+                    yield distance, remaining[distance]
+                return
+            yield r, _ring(center, r)
+            r += 1
+
+    def nearest(self, lat, lon, limit, radius_km, accept=None):
+        """Lista di ``(station_id, distanza_km)`` in ordine di distanza.
+
+        ``accept`` (opzionale) e' una funzione ``id -> bool`` per combinare
+        la ricerca con altri filtri.
+        """
+        if limit <= 0:
+            return []
+        qx, qy, qz = point = to_xyz(lat, lon)
+        center = self._key(point)
+        max_chord = km_to_chord(radius_km)
+        # max-heap dei migliori ``limit`` risultati: (-distanza, -id)
+        best = []
+        for r, keys in self._rings(center):
+            for key in keys:
+                cell = self.cells.get(key)
+                if not cell:
+                    continue
+                for station_id, (x, y, z) in cell.items():
+                    chord = math.sqrt((x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2)
+                    if chord > max_chord or (accept is not None and not accept(station_id)):
+                        continue
+                    entry = (-chord, -station_id)
+                    if len(best) < limit:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+            bound = r * self.cell
+            if bound > max_chord or (len(best) == limit and bound >= -best[0][0]):
+                break
+        best.sort(reverse=True)
+        return [(-neg_id, chord_to_km(-neg_chord)) for neg_chord, neg_id in best]
@@ -0,0 +1,519 @@
+"""Importazione in blocco del catalogo delle stazioni da CSV.
+
+Il file viene letto una sola volta in streaming: ogni riga viene
+normalizzata, i tag vengono internati al volo (nome -> id assegnato qui)
+e stazioni, tag nuovi e righe delle tabelle di associazione vengono
+scritti a blocchi di ``batch_size`` stazioni, senza passare dall'ORM.
+La scrittura dipende dal dialetto: COPY su Postgres, ``executemany``
+diretto sul cursore su SQLite, insert di Core altrimenti.
+
+Tutto avviene in una sola transazione insieme all'incremento della
+versione del catalogo, quindi gli altri processi vedono il nuovo catalogo
+solo a importazione completata.
+
+``import_catalog`` sostituisce l'intero catalogo; ``sync_catalog`` invece
+applica solo le differenze rispetto al database e mantiene gli id delle
+stazioni (e quindi preferiti, playlist e cronologia degli utenti).
+"""
+import csv
+import hashlib
+import io
+import os
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy import bindparam, select, text, update
+
+from app import db
+from app.catalog import catalog_changed, catalog_replaced
+from app.catalog.tags import TAG_CATEGORIES, parse_values
+from app.catalog.version import bump_catalog_generation, bump_catalog_version, record_generation
+from app.models import CatalogVersion, Station
+
+try:
+    import resource
+except ImportError:  # non disponibile su Windows
+    resource = None
+
+STATION_COLUMNS = ('name', 'url', 'url_resolved', 'homepage', 'favicon', 'country',
+                   'countrycode', 'state', 'codec', 'bitrate', 'geo_lat', 'geo_long')
+
+# Colonne del CSV con i tag, nell'ordine di TAG_CATEGORIES
+CSV_TAG_COLUMNS = {'genre': 'Music Genre', 'decade': 'Decade', 'topic': 'Topic',
+                   'lang': 'Lang', 'mood': 'Mood'}
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Dimensione indicativa dei blocchi del CSV analizzati in parallelo
+CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def _text(value):
+    return value.strip() if value else None
+
+
+def parse_row(row):
+    """Normalizza una riga del CSV in (campi della stazione, tag per categoria)."""
+    fields = tuple(_text(row.get(column)) for column in STATION_COLUMNS[:9]) + (
+        int(row['bitrate']) if row.get('bitrate') else None,
+        float(row['geo_lat']) if row.get('geo_lat') else None,
+        float(row['geo_long']) if row.get('geo_long') else None,
+    )
+    tags = tuple(list(dict.fromkeys(parse_values(row.get(column) or '')))
+                 for column in CSV_TAG_COLUMNS.values())
+    return fields, tags
+
+
+def content_hash(fields, tags):
+    """Hash dei campi e dei tag (senza ordine) di una stazione."""
+    parts = ['\0' if value is None else str(value) for value in fields]
+    parts.extend(','.join(sorted(names)) for names in tags)
+    return hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _parse_rows(rows):
+    """(campi, tag, hash) per ogni riga; i nomi dei tag ripetuti sono lo stesso oggetto."""
+    names = {}
+    for row in rows:
+        fields, tags = parse_row(row)
+        tags = tuple([names.setdefault(name, name) for name in values] for values in tags)
+        yield fields, tags, content_hash(fields, tags)
+
+
+def _last_row_end(block):
+    """Posizione dopo l'ultimo fine riga di ``block`` che non cade tra virgolette."""
+    end = block.rfind(b'\n')
+    # Il blocco inizia fuori dalle virgolette: un numero dispari prima del
+    # fine riga vuol dire che il campo continua sulla riga successiva
+    while end >= 0 and block.count(b'"', 0, end) % 2:
+        end = block.rfind(b'\n', 0, end)
+    return end + 1 if end >= 0 else None
+
+
+def chunk_ranges(path, chunk_bytes=CHUNK_BYTES):
+    """Intestazione del CSV e intervalli di byte che contengono righe intere."""
+    ranges = []
+    with open(path, 'rb') as f:
+        fieldnames = next(csv.reader([f.readline().decode('utf-8')]))
+        start = f.tell()
+        block = b''
+        while True:
+            data = f.read(chunk_bytes)
+            block += data
+            if not data:
+                if block:
+                    ranges.append((start, start + len(block)))
+                return fieldnames, ranges
+            end = _last_row_end(block)
+            if end is None:
+                # Una riga piu' lunga del blocco: si continua a leggere
+                continue
+            ranges.append((start, start + end))
+            start += end
+            block = block[end:]
+
+
+def _parse_chunk(path, start, end, fieldnames):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start).decode('utf-8')
+    return list(_parse_rows(csv.DictReader(io.StringIO(data, newline=''), fieldnames=fieldnames)))
+
+
+def _read_parallel(path, workers):
+    # Almeno qualche blocco per processo anche con file piccoli
+    chunk_bytes = min(CHUNK_BYTES, max(os.path.getsize(path) // (workers * 4), 1 << 16))
+    fieldnames, ranges = chunk_ranges(path, chunk_bytes)
+    ranges = iter(ranges)
+    with ProcessPoolExecutor(workers) as pool:
+        # Al piu' due blocchi per processo in attesa: la memoria resta limitata
+        pending = deque(pool.submit(_parse_chunk, path, start, end, fieldnames)
+                        for start, end in islice(ranges, workers * 2))
+        while pending:
+            rows = pending.popleft().result()
+            for start, end in islice(ranges, 1):
+                pending.append(pool.submit(_parse_chunk, path, start, end, fieldnames))
+            yield from rows
+
+
+def read_csv(path, workers=1):
+    """Righe normalizzate del CSV, ``(campi, tag, hash)``, nell'ordine del file.
+
+    Con ``workers > 1`` il file viene diviso in blocchi di byte analizzati
+    in parallelo da un pool di processi; i risultati vengono comunque
+    consumati in ordine da un solo scrittore, quindi gli id assegnati a
+    stazioni e tag sono gli stessi della lettura sequenziale.
+    """
+    if workers > 1:
+        yield from _read_parallel(path, workers)
+        return
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        yield from _parse_rows(csv.DictReader(f))
+
+
+class CoreWriter:
+    """Scrittura generica con gli insert ``executemany`` di Core."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def insert(self, table, columns, rows):
+        if rows:
+            self.connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+
+    def clear(self, tables):
+        for table in tables:
+            self.connection.execute(table.delete())
+
+    def finish(self, tables):
+        pass
+
+
+class SqliteWriter(CoreWriter):
+    """``executemany`` direttamente sul cursore sqlite3, senza dizionari."""
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.cursor = connection.connection.cursor()
+        self.quote = connection.dialect.identifier_preparer.quote
+
+    def insert(self, table, columns, rows):
+        if not rows:
+            return
+        # Conversioni di SQLAlchemy (es. DateTime -> stringa, Boolean -> 0/1)
+        dialect = self.connection.dialect
+        processors = [table.c[column].type.dialect_impl(dialect).bind_processor(dialect)
+                      for column in columns]
+        if any(processors):
+            rows = [tuple(value if process is None or value is None else process(value)
+                          for process, value in zip(processors, row)) for row in rows]
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            self.quote(table.name), ', '.join(self.quote(c) for c in columns),
+            ', '.join('?' * len(columns)))
+        self.cursor.executemany(sql, rows)
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+    return str(value)
+
+
+class PostgresWriter(CoreWriter):
+    """Protocollo COPY (formato testo) di psycopg2."""
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.cursor = connection.connection.cursor()
+        self.quote = connection.dialect.identifier_preparer.quote
+
+    def insert(self, table, columns, rows):
+        if not rows:
+            return
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(_copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        self.cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(
+            self.quote(table.name), ', '.join(self.quote(c) for c in columns)), buffer)
+
+    def clear(self, tables):
+        names = ', '.join(self.quote(table.name) for table in tables)
+        self.connection.execute(text(f'TRUNCATE TABLE {names} RESTART IDENTITY CASCADE'))
+
+    def finish(self, tables):
+        # Gli id sono assegnati dall'importatore: riallineiamo le sequenze
+        for table in tables:
+            name = self.quote(table.name)
+            self.connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {name}"))
+
+
+WRITERS = {'postgresql': PostgresWriter, 'sqlite': SqliteWriter}
+
+
+def make_writer(connection):
+    return WRITERS.get(connection.dialect.name, CoreWriter)(connection)
+
+
+class ImportStats:
+
+    def __init__(self):
+        self.stations = 0
+        self.tags = 0
+        self.links = 0
+        # Solo per la sincronizzazione
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.version = None
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        rows = self.stations + self.updated + self.unchanged
+        return rows / self.elapsed if self.elapsed else 0.0
+
+    @staticmethod
+    def peak_memory_mb():
+        """Picco di memoria residente del processo (``None`` se non misurabile)."""
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def summary(self):
+        line = f'{self.stations} stazioni inserite'
+        if self.updated or self.deleted or self.unchanged:
+            line += f', {self.updated} aggiornate, {self.deleted} eliminate, {self.unchanged} invariate'
+        line += (f', {self.tags} tag nuovi, {self.links} associazioni '
+                 f'in {self.elapsed:.1f}s ({self.rows_per_second:.0f} righe/s)')
+        peak = self.peak_memory_mb()
+        if peak is not None:
+            line += f', picco di memoria {peak:.0f} MB'
+        return line
+
+
+_STATION_INSERT = ('id',) + STATION_COLUMNS + ('updated_version', 'content_hash')
+
+
+class BatchLoader:
+    """Interna i tag e scrive stazioni e associazioni a blocchi.
+
+    ``tag_ids`` contiene i tag gia' presenti nel database; i nuovi ricevono
+    id successivi al massimo esistente. La versione del catalogo viene
+    incrementata alla prima scrittura.
+    """
+
+    def __init__(self, writer, batch_size, stats, tag_ids=None):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.stats = stats
+        self.updated_at = None
+        self.tag_ids = tag_ids or {arg: {} for arg in TAG_CATEGORIES}
+        self.next_tag_ids = {arg: max(ids.values(), default=0) + 1 for arg, ids in self.tag_ids.items()}
+        self.new_tags = {arg: [] for arg in TAG_CATEGORIES}
+        self.links = {arg: [] for arg in TAG_CATEGORIES}
+        self.stations = []
+
+    def current_version(self):
+        if self.stats.version is None:
+            self.stats.version, self.updated_at = bump_catalog_version(self.writer.connection)
+        return self.stats.version
+
+    def tag_id(self, arg, name):
+        ids = self.tag_ids[arg]
+        tag_id = ids.get(name)
+        if tag_id is None:
+            tag_id = ids[name] = self.next_tag_ids[arg]
+            self.next_tag_ids[arg] += 1
+            self.new_tags[arg].append((tag_id, name))
+        return tag_id
+
+    def add(self, station_id, fields, tags, digest):
+        self.stations.append((station_id,) + fields + (self.current_version(), digest))
+        for arg, names in zip(TAG_CATEGORIES, tags):
+            links = self.links[arg]
+            for name in names:
+                links.append((station_id, self.tag_id(arg, name)))
+        if len(self.stations) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Prima i tag nuovi e le stazioni, poi le associazioni che li referenziano
+        for arg, (model, _, _) in TAG_CATEGORIES.items():
+            self.writer.insert(model.__table__, ('id', 'name'), self.new_tags[arg])
+            self.stats.tags += len(self.new_tags[arg])
+            self.new_tags[arg] = []
+        self.writer.insert(Station.__table__, _STATION_INSERT, self.stations)
+        self.stats.stations += len(self.stations)
+        self.stations = []
+        for arg, (_, table, fk) in TAG_CATEGORIES.items():
+            self.writer.insert(table, ('station_id', fk.name), self.links[arg])
+            self.stats.links += len(self.links[arg])
+            self.links[arg] = []
+
+
+def _existing_tag_ids(connection):
+    return {arg: {name: tag_id for tag_id, name in
+                  connection.execute(select(model.__table__.c.id, model.__table__.c.name))}
+            for arg, (model, _, _) in TAG_CATEGORIES.items()}
+
+
+class SyncLoader(BatchLoader):
+    """Confronta il CSV con le stazioni esistenti e applica solo le differenze.
+
+    Le stazioni vengono abbinate per (``url_resolved``, nome) e confrontate
+    tramite ``content_hash``: quelle nuove vengono inserite, quelle cambiate
+    aggiornate (tag compresi, come differenza delle associazioni) e quelle
+    non piu' presenti nel CSV eliminate. Gli id esistenti non cambiano.
+    """
+
+    def __init__(self, writer, batch_size, stats):
+        connection = writer.connection
+        super().__init__(writer, batch_size, stats, tag_ids=_existing_tag_ids(connection))
+        station = Station.__table__
+        self.by_key = defaultdict(list)
+        self.hashes = {}
+        query = select(station.c.id, station.c.url_resolved, station.c.name, station.c.content_hash)
+        for station_id, url_resolved, name, digest in connection.execute(query.order_by(station.c.id)):
+            self.by_key[(url_resolved, name)].append(station_id)
+            self.hashes[station_id] = digest
+        self.next_station_id = max(self.hashes, default=0) + 1
+        self.updates = []
+        self.upserted = set()
+
+    @property
+    def tags_changed(self):
+        return self.stats.tags > 0
+
+    def sync(self, fields, tags, digest):
+        ids = self.by_key.get((fields[2], fields[0]))
+        if not ids:
+            station_id = self.next_station_id
+            self.next_station_id += 1
+            self.upserted.add(station_id)
+            self.add(station_id, fields, tags, digest)
+            return
+        station_id = ids.pop(0)
+        if self.hashes.pop(station_id) == digest:
+            self.stats.unchanged += 1
+            return
+        self.upserted.add(station_id)
+        self.updates.append((station_id, fields, tags, digest))
+        if len(self.updates) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.updates:
+            self._apply_updates()
+        super().flush()
+
+    def _apply_updates(self):
+        connection = self.writer.connection
+        station = Station.__table__
+        columns = STATION_COLUMNS + ('updated_version', 'content_hash')
+        version = self.current_version()
+        connection.execute(
+            update(station).where(station.c.id == bindparam('b_id'))
+            .values({column: bindparam(f'b_{column}') for column in columns}),
+            [dict(zip(('b_id',) + tuple(f'b_{column}' for column in columns),
+                      (station_id,) + fields + (version, digest)))
+             for station_id, fields, _, digest in self.updates])
+
+        # Differenza delle associazioni: si rimuove solo cio' che non c'e' piu'
+        ids = [station_id for station_id, _, _, _ in self.updates]
+        for i, (arg, (_, table, fk)) in enumerate(TAG_CATEGORIES.items()):
+            current = {tuple(row) for row in connection.execute(
+                select(table.c.station_id, fk).where(table.c.station_id.in_(ids)))}
+            wanted = {(station_id, self.tag_id(arg, name))
+                      for station_id, _, tags, _ in self.updates for name in tags[i]}
+            removed = current - wanted
+            if removed:
+                connection.execute(
+                    table.delete().where(table.c.station_id == bindparam('b_station'),
+                                         fk == bindparam('b_tag')),
+                    [{'b_station': station_id, 'b_tag': tag_id} for station_id, tag_id in removed])
+            self.links[arg].extend(wanted - current)
+        self.stats.updated += len(self.updates)
+        self.updates = []
+
+    def delete_missing(self):
+        """Elimina le stazioni non piu' presenti nel CSV e le righe che le referenziano."""
+        connection = self.writer.connection
+        missing = sorted(self.hashes)
+        if missing:
+            self.current_version()
+        dependents = [table for table in reversed(db.metadata.sorted_tables)
+                      if 'station_id' in table.c and table.c.station_id.references(Station.__table__.c.id)]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            for table in dependents:
+                connection.execute(table.delete().where(table.c.station_id.in_(batch)))
+            connection.execute(Station.__table__.delete().where(Station.__table__.c.id.in_(batch)))
+        self.stats.deleted = len(missing)
+        return set(missing)
+
+
+def catalog_tables():
+    """Tabelle svuotate da un'importazione completa (tutte tranne la versione).
+
+    Come il vecchio ``TRUNCATE ... CASCADE``, anche utenti, preferiti,
+    cronologia e playlist vengono eliminati, dato che referenziano le stazioni.
+    """
+    return [table for table in reversed(db.metadata.sorted_tables)
+            if table is not CatalogVersion.__table__]
+
+
+def _id_tables():
+    return [Station.__table__] + [model.__table__ for model, _, _ in TAG_CATEGORIES.values()]
+
+
+def replace_catalog(rows, batch_size=DEFAULT_BATCH_SIZE, extra=None):
+    """Sostituisce il catalogo con ``rows`` (``(campi, tag, hash)``).
+
+    ``extra(writer)``, se indicata, viene eseguita nella stessa transazione
+    dopo le stazioni e restituisce altre tabelle con id da riallineare.
+    """
+    stats = ImportStats()
+    with db.engine.begin() as connection:
+        writer = make_writer(connection)
+        writer.clear(catalog_tables())
+        loader = BatchLoader(writer, batch_size, stats)
+        # Il catalogo cambia anche se non ci sono righe
+        loader.current_version()
+        generation = bump_catalog_generation(connection)
+        for station_id, (fields, tags, digest) in enumerate(rows, 1):
+            loader.add(station_id, fields, tags, digest)
+        loader.flush()
+        tables = _id_tables()
+        if extra is not None:
+            tables += extra(writer)
+        writer.finish(tables)
+    stats.stop()
+    app = current_app._get_current_object()
+    record_generation(app, generation)
+    catalog_changed.send(app, full=True, version=stats.version, updated_at=loader.updated_at)
+    catalog_replaced.send(app)
+    return stats
+
+
+def import_catalog(path, batch_size=DEFAULT_BATCH_SIZE, workers=1):
+    """Sostituisce il catalogo con il contenuto del CSV; restituisce le statistiche."""
+    return replace_catalog(read_csv(path, workers), batch_size)
+
+
+def sync_catalog(path, batch_size=DEFAULT_BATCH_SIZE, workers=1):
+    """Allinea il catalogo al CSV toccando solo le stazioni cambiate.
+
+    Se nulla e' cambiato la versione del catalogo resta la stessa
+    (``stats.version`` e' ``None``).
+    """
+    stats = ImportStats()
+    with db.engine.begin() as connection:
+        writer = make_writer(connection)
+        loader = SyncLoader(writer, batch_size, stats)
+        for fields, tags, digest in read_csv(path, workers):
+            loader.sync(fields, tags, digest)
+        loader.flush()
+        deleted = loader.delete_missing()
+        if loader.upserted:
+            writer.finish(_id_tables())
+    stats.stop()
+    if stats.version is not None:
+        app = current_app._get_current_object()
+        catalog_changed.send(app, upserted=loader.upserted, deleted=deleted,
+                             tags_changed=loader.tags_changed,
+                             version=stats.version, updated_at=loader.updated_at)
+    return stats
@@ -0,0 +1,160 @@
+"""Raccomandazioni personalizzate a partire da ascolti e preferiti.
+
+Il profilo dell'utente e' un vettore di pesi sui tag: ogni stazione
+ascoltata di recente contribuisce con i propri tag, pesati per categoria
+(come nella similarita') e per un decadimento esponenziale sull'eta'
+dell'ascolto; i preferiti contribuiscono con un peso fisso. Il catalogo
+viene valutato in un solo passaggio sulle bitmap dei tag (pesi quantizzati
+a interi, somma bit-sliced) e i migliori candidati vengono poi riordinati
+con il punteggio esatto.
+"""
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, time, timedelta
+
+from flask import current_app
+
+from app import db
+from app.catalog import get_index, catalog_changed
+from app.catalog import bitmap
+from app.catalog.similarity import SIMILARITY_WEIGHTS, add_weighted, top_k
+from app.history import plays_recorded
+from app.history.rollups import play_weight
+from app.models import DailyUserPlays, user_favorites
+
+# Risoluzione dei pesi quantizzati usati per la somma sulle bitmap
+_QUANTIZATION_LEVELS = 255
+
+
+class RecommendationCache:
+    """Cache LRU per utente delle raccomandazioni gia' calcolate."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None:
+                self.entries.move_to_end(user_id)
+            return entry
+
+    def set(self, user_id, value):
+        with self.lock:
+            self.entries[user_id] = value
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def _cache(app=None):
+    app = app or current_app
+    cache = app.extensions.get('recommendations')
+    if cache is None:
+        cache = app.extensions.setdefault(
+            'recommendations', RecommendationCache(app.config['RECOMMENDATION_CACHE_SIZE']))
+    return cache
+
+
+def invalidate_recommendations(user_id):
+    """Da chiamare quando l'utente ascolta o aggiunge/rimuove un preferito."""
+    _cache().discard(user_id)
+
+
+@plays_recorded.connect
+def _forget_listeners(app, plays):
+    cache = app.extensions.get('recommendations')
+    if cache is not None:
+        for user_id in {play['user_id'] for play in plays}:
+            cache.discard(user_id)
+
+
+@catalog_changed.connect
+def _clear_on_catalog_change(app, **changes):
+    cache = app.extensions.get('recommendations')
+    if cache is not None:
+        cache.clear()
+
+
+def taste_profile(user_id, now=None):
+    """Restituisce ``(pesi per tag, id delle stazioni gia' conosciute)``."""
+    config = current_app.config
+    now = now or datetime.utcnow()
+    half_life = config['RECOMMENDATION_HALF_LIFE_DAYS'] * 86400.0
+
+    station_weights = defaultdict(float)
+    # Conteggi giornalieri invece degli eventi: gli ascolti di un giorno
+    # sono collocati a mezzogiorno e pesano anche per il tempo di ascolto
+    since = (now - timedelta(days=config['RECOMMENDATION_HISTORY_DAYS'])).date()
+    plays = (db.session.query(DailyUserPlays.station_id, DailyUserPlays.day,
+                              DailyUserPlays.plays, DailyUserPlays.seconds)
+             .filter(DailyUserPlays.user_id == user_id, DailyUserPlays.day >= since))
+    for station_id, day, count, seconds in plays:
+        age = max((now - datetime.combine(day, time(12))).total_seconds(), 0.0)
+        listened = play_weight(count, seconds, config['SESSION_SECONDS_PER_PLAY'])
+        station_weights[station_id] += listened * 0.5 ** (age / half_life)
+
+    favorites = db.session.query(user_favorites.c.station_id).filter(user_favorites.c.user_id == user_id)
+    for station_id, in favorites:
+        station_weights[station_id] += config['RECOMMENDATION_FAVORITE_WEIGHT']
+
+    station_tags = get_index('similarity').station_tags
+    taste = defaultdict(float)
+    for station_id, weight in station_weights.items():
+        for arg, name in station_tags.get(station_id, ()):
+            taste[(arg, name)] += weight * SIMILARITY_WEIGHTS[arg]
+    return taste, set(station_weights)
+
+
+def score_catalog(taste, known, limit):
+    """Le ``limit`` stazioni non conosciute con il punteggio piu' alto."""
+    if not taste or limit <= 0:
+        return []
+    tag_bitmaps = get_index('tags').bitmaps
+    top_weight = max(taste.values())
+
+    slices = []
+    candidates = 0
+    for (arg, name), weight in taste.items():
+        quantized = round(weight / top_weight * _QUANTIZATION_LEVELS)
+        members = tag_bitmaps[arg].get(name, 0)
+        if quantized and members:
+            add_weighted(slices, members, quantized)
+            candidates |= members
+    candidates &= ~bitmap.from_ids(known)
+
+    # Margine per assorbire l'errore di quantizzazione prima del riordino esatto
+    wanted = limit * 2 + 10
+    greater, ties = top_k(slices, candidates, wanted)
+    ids = list(bitmap.iter_ids(greater))
+    ids += bitmap.take(ties, wanted - len(ids))
+
+    station_tags = get_index('similarity').station_tags
+    scored = sorted(
+        ((-sum(taste.get(tag, 0.0) for tag in station_tags.get(station_id, ())), station_id)
+         for station_id in ids)
+    )
+    return [station_id for _, station_id in scored[:limit]]
+
+
+def recommend(user_id, limit):
+    """Id delle stazioni consigliate all'utente, dalla cache se possibile."""
+    cache = _cache()
+    cached = cache.get(user_id)
+    if cached is not None and cached[0] >= limit:
+        return cached[1][:limit]
+    taste, known = taste_profile(user_id)
+    depth = max(limit, current_app.config['RECOMMENDATION_CACHE_DEPTH'])
+    result = score_catalog(taste, known, depth)
+    cache.set(user_id, (depth, result))
+    return result[:limit]
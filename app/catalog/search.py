@@ -0,0 +1,128 @@
+"""Indice a trigrammi per la ricerca (fuzzy) sui nomi delle stazioni.
+
+Ogni nome viene normalizzato (minuscolo, senza accenti e punteggiatura) e
+scomposto in trigrammi come fa ``pg_trgm``. Una ricerca conta i trigrammi
+in comune tra query e nome: la tolleranza agli errori di battitura viene
+dal fatto che un refuso cambia solo pochi trigrammi.
+
+Per tenere la latenza costante al crescere del catalogo i candidati
+vengono generati solo dalle posting list dei trigrammi piu' rari della
+query (prefix filtering): un nome con almeno ``need`` trigrammi in comune
+deve per forza contenere uno dei ``len(query) - need + 1`` piu' rari.
+"""
+import heapq
+import math
+import re
+import unicodedata
+
+from flask import current_app
+
+from app import db
+from app.catalog import CatalogIndex, register_index
+from app.models import Station
+
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize(text):
+    """Minuscolo, senza accenti e con la punteggiatura ridotta a spazi."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return ' '.join(_NON_WORD.sub(' ', text).split())
+
+
+def trigrams(text):
+    """Insieme dei trigrammi di ``text``, parola per parola, con padding."""
+    grams = set()
+    for word in normalize(text).split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+@register_index('search')
+class TrigramIndex(CatalogIndex):
+
+    def __init__(self):
+        self.postings = {}  # trigramma -> set di station id
+        self.docs = {}      # station id -> (frozenset trigrammi, nome normalizzato)
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        for station_id, name in db.session.query(Station.id, Station.name).yield_per(5000):
+            index.add(station_id, name)
+        return index
+
+    def apply(self, upserted, deleted):
+        for station_id in deleted:
+            self.remove(station_id)
+        if upserted:
+            rows = db.session.query(Station.id, Station.name).filter(Station.id.in_(upserted)).all()
+            for station_id in upserted:
+                self.remove(station_id)
+            for station_id, name in rows:
+                self.add(station_id, name)
+        return True
+
+    def add(self, station_id, name):
+        grams = frozenset(trigrams(name))
+        self.docs[station_id] = (grams, normalize(name))
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(station_id)
+
+    def remove(self, station_id):
+        doc = self.docs.pop(station_id, None)
+        if doc is None:
+            return
+        for gram in doc[0]:
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(station_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def search(self, query, limit=None, threshold=None, accept=None):
+        """Restituisce gli id delle stazioni ordinati per rilevanza.
+
+        Il punteggio e' la frazione di trigrammi della query presenti nel
+        nome, con un bonus se la query compare come sottostringa (e ancora
+        di piu' se come prefisso). A parita' vincono i nomi piu' corti.
+        ``accept(station_id)``, se indicata, scarta i candidati prima del
+        punteggio (e quindi prima di ``limit``).
+        """
+        if threshold is None:
+            threshold = current_app.config['SEARCH_MIN_SIMILARITY']
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        needle = normalize(query)
+        need = max(1, math.ceil(threshold * len(query_grams)))
+
+        by_rarity = sorted(query_grams, key=lambda g: len(self.postings.get(g, ())))
+        candidates = set()
+        for gram in by_rarity[:len(query_grams) - need + 1]:
+            candidates.update(self.postings.get(gram, ()))
+        if accept is not None:
+            candidates = [station_id for station_id in candidates if accept(station_id)]
+
+        scored = []
+        for station_id in candidates:
+            grams, name = self.docs[station_id]
+            common = len(query_grams & grams)
+            if common < need:
+                continue
+            score = common / len(query_grams)
+            position = name.find(needle)
+            if position == 0:
+                score += 1.5
+            elif position > 0:
+                score += 1.0
+            similarity = common / len(query_grams | grams)
+            scored.append((-score, -similarity, station_id))
+
+        if limit is not None:
+            scored = heapq.nsmallest(limit, scored)
+        else:
+            scored.sort()
+        return [station_id for _, _, station_id in scored]
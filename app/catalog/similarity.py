@@ -0,0 +1,130 @@
+"""Motore di similarita' tra stazioni basato sui tag.
+
+Il punteggio di una stazione rispetto a quella di partenza e' la somma dei
+pesi dei tag che hanno in comune (genere 5, lingua 4, decade 3, topic 2,
+mood 1): e' il prodotto scalare tra le righe della matrice sparsa
+stazione x tag. Invece di ciclare sulle stazioni il punteggio viene
+calcolato per tutte insieme sulle bitmap dell'indice dei tag, come somma
+binaria "bit-sliced": ``slices[i]`` e' la bitmap delle stazioni che hanno
+il bit ``i`` del punteggio acceso. Ogni somma costa qualche AND/XOR su
+interi grandi, indipendentemente da quante stazioni hanno il tag.
+"""
+from collections import defaultdict
+
+from app.catalog import CatalogIndex, register_index, get_index
+from app.catalog import bitmap
+from app.catalog.tags import tag_rows
+
+SIMILARITY_WEIGHTS = {
+    'genre': 5,
+    'lang': 4,
+    'decade': 3,
+    'topic': 2,
+    'mood': 1,
+}
+
+
+def add_weighted(slices, members, weight):
+    """Somma ``weight`` al punteggio di tutte le stazioni in ``members``."""
+    position = 0
+    while weight:
+        if weight & 1:
+            carry, i = members, position
+            while carry:
+                while i >= len(slices):
+                    slices.append(0)
+                current = slices[i]
+                slices[i] = current ^ carry
+                carry = current & carry
+                i += 1
+        weight >>= 1
+        position += 1
+
+
+def with_score(slices, score, candidates):
+    """Bitmap delle stazioni in ``candidates`` con punteggio esattamente ``score``."""
+    result = candidates
+    for i, plane in enumerate(slices):
+        result = result & plane if score >> i & 1 else result & ~plane
+        if not result:
+            break
+    return result
+
+
+def top_k(slices, candidates, k):
+    """Seleziona i ``k`` candidati con il punteggio piu' alto.
+
+    Scorre i bit del punteggio dal piu' significativo: restituisce
+    ``(sicuri, pari)``, dove ``sicuri`` sono sicuramente nei primi ``k`` e
+    ``pari`` sono a pari merito per i posti rimanenti.
+    """
+    greater, equal = 0, candidates
+    for plane in reversed(slices):
+        selected = greater | (equal & plane)
+        count = selected.bit_count()
+        if count > k:
+            equal &= plane
+        elif count < k:
+            greater = selected
+            equal &= ~plane
+        else:
+            return selected, 0
+    return greater, equal
+
+
+@register_index('similarity')
+class SimilarityIndex(CatalogIndex):
+
+    depends_on_tags = True
+
+    def __init__(self):
+        self.station_tags = defaultdict(list)  # station id -> [(categoria, nome)]
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        for arg, name, station_id in tag_rows():
+            if arg in SIMILARITY_WEIGHTS:
+                index.station_tags[station_id].append((arg, name))
+        return index
+
+    def apply(self, upserted, deleted):
+        for station_id in set(upserted) | set(deleted):
+            self.station_tags.pop(station_id, None)
+        if upserted:
+            for arg, name, station_id in tag_rows(list(upserted)):
+                if arg in SIMILARITY_WEIGHTS:
+                    self.station_tags[station_id].append((arg, name))
+        return True
+
+    def similar(self, station_id, limit):
+        """Lista di ``(station_id, punteggio)`` ordinata per punteggio e id."""
+        source_tags = self.station_tags.get(station_id)
+        if not source_tags or limit <= 0:
+            return []
+        tag_bitmaps = get_index('tags').bitmaps
+
+        slices = []
+        candidates = 0
+        max_score = 0
+        for arg, name in source_tags:
+            members = tag_bitmaps[arg].get(name, 0)
+            weight = SIMILARITY_WEIGHTS[arg]
+            add_weighted(slices, members, weight)
+            candidates |= members
+            max_score += weight
+        candidates &= ~(1 << station_id)
+
+        result = []
+        for score in range(max_score, 0, -1):
+            if not candidates:
+                break
+            matching = with_score(slices, score, candidates)
+            if not matching:
+                continue
+            candidates &= ~matching
+            for similar_id in bitmap.take(matching, limit - len(result)):
+                result.append((similar_id, score))
+            if len(result) >= limit:
+                break
+        return result
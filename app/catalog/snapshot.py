@@ -0,0 +1,238 @@
+"""Snapshot del catalogo in un file binario condiviso via mmap dai worker.
+
+Il file contiene le stazioni in formato colonnare: id ordinati, colonne di
+testo come offset + blob UTF-8, interi e float come array, e per ogni
+categoria di tag un vocabolario di nomi e le liste di tag in formato CSR
+(``indptr``/``indices``). Ogni worker mappa il file in sola lettura: le
+pagine sono condivise dal sistema operativo tra tutti i processi e
+l'apertura e' istantanea. Le stazioni vengono ricostruite nello stesso
+formato JSON degli endpoint direttamente dalle sezioni del file.
+
+Il file viene scritto da ``flask catalog snapshot`` in un file temporaneo
+e poi rinominato, quindi la sostituzione e' atomica; i worker si
+accorgono del nuovo file e lo usano solo se la sua versione coincide con
+quella corrente del catalogo.
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from flask import current_app
+
+from app.catalog.version import catalog_version, read_catalog_version
+
+MAGIC = b'TTCATSN1'
+_PREAMBLE = struct.Struct('<8sQ')
+
+TEXT_FIELDS = ('name', 'url', 'url_resolved', 'homepage', 'favicon',
+               'country', 'countrycode', 'state', 'codec')
+INT_FIELDS = ('bitrate',)
+FLOAT_FIELDS = ('geo_lat', 'geo_long')
+TAG_FIELDS = ('music_genres', 'decades', 'topics', 'langs', 'moods')
+
+_INT_NULL = -(1 << 63)
+
+class SnapshotWriter:
+    """Accumula le stazioni (gia' serializzate) e scrive il file."""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.text = {field: (array('q', [0]), bytearray(), bytearray()) for field in TEXT_FIELDS}
+        self.ints = {field: array('q') for field in INT_FIELDS}
+        self.floats = {field: array('d') for field in FLOAT_FIELDS}
+        self.vocab = {field: {} for field in TAG_FIELDS}
+        self.tags = {field: (array('I', [0]), array('I')) for field in TAG_FIELDS}
+
+    def add(self, item):
+        """Aggiunge una stazione; gli id devono arrivare in ordine crescente."""
+        self.ids.append(item['id'])
+        for field in TEXT_FIELDS:
+            starts, blob, nulls = self.text[field]
+            value = item[field]
+            nulls.append(value is None)
+            if value is not None:
+                blob += value.encode('utf-8')
+            starts.append(len(blob))
+        for field in INT_FIELDS:
+            value = item[field]
+            self.ints[field].append(_INT_NULL if value is None else value)
+        for field in FLOAT_FIELDS:
+            value = item[field]
+            self.floats[field].append(math.nan if value is None else value)
+        for field in TAG_FIELDS:
+            indptr, indices = self.tags[field]
+            vocab = self.vocab[field]
+            for tag in item[field]:
+                indices.append(vocab.setdefault(tag['name'], len(vocab)))
+            indptr.append(len(indices))
+
+    def _sections(self):
+        yield 'ids', self.ids
+        for field, (starts, blob, nulls) in self.text.items():
+            yield f'{field}.starts', starts
+            yield f'{field}.blob', blob
+            yield f'{field}.nulls', nulls
+        for field, values in self.ints.items():
+            yield field, values
+        for field, values in self.floats.items():
+            yield field, values
+        for field, (indptr, indices) in self.tags.items():
+            yield f'{field}.indptr', indptr
+            yield f'{field}.indices', indices
+
+    def write(self, path, version):
+        """Scrive il file in modo atomico (file temporaneo + rename).
+
+        Gli offset delle sezioni sono relativi all'inizio dei dati, subito
+        dopo l'header.
+        """
+        sections, payload, offset = {}, [], 0
+        for name, data in self._sections():
+            raw = data.tobytes() if isinstance(data, array) else bytes(data)
+            fmt = data.typecode if isinstance(data, array) else 'B'
+            sections[name] = [offset, len(raw), fmt]
+            padding = -len(raw) % 8
+            payload.append(raw + b'\0' * padding)
+            offset += len(raw) + padding
+        header = json.dumps({
+            'catalog_version': version,
+            'count': len(self.ids),
+            'vocab': {field: list(vocab) for field, vocab in self.vocab.items()},
+            'sections': sections,
+        }).encode('utf-8')
+        # Padding perche' i dati inizino allineati a 8 byte
+        header += b' ' * (-(len(header) + _PREAMBLE.size) % 8)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_PREAMBLE.pack(MAGIC, len(header)))
+                f.write(header)
+                for chunk in payload:
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp crea il file leggibile solo dal proprietario
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+class CatalogSnapshot:
+    """Vista in sola lettura (zero-copy) di un file di snapshot."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_size = _PREAMBLE.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a catalog snapshot')
+        header = json.loads(self.mm[_PREAMBLE.size:_PREAMBLE.size + header_size])
+        self.version = header['catalog_version']
+        self.count = header['count']
+        self.vocab = header['vocab']
+        view = memoryview(self.mm)[_PREAMBLE.size + header_size:]
+        self.sections = {name: view[offset:offset + length].cast(fmt)
+                         for name, (offset, length, fmt) in header['sections'].items()}
+        self.ids = self.sections['ids']
+
+    def row(self, station_id):
+        """Indice della riga della stazione o ``None``."""
+        i = bisect_left(self.ids, station_id)
+        return i if i < self.count and self.ids[i] == station_id else None
+
+    def station(self, i):
+        """La stazione alla riga ``i`` nello stesso formato di ``dump_stations``."""
+        s = self.sections
+        item = {'id': self.ids[i]}
+        for field in TEXT_FIELDS:
+            if s[f'{field}.nulls'][i]:
+                item[field] = None
+            else:
+                starts = s[f'{field}.starts']
+                item[field] = bytes(s[f'{field}.blob'][starts[i]:starts[i + 1]]).decode('utf-8')
+        for field in INT_FIELDS:
+            value = s[field][i]
+            item[field] = None if value == _INT_NULL else value
+        for field in FLOAT_FIELDS:
+            value = s[field][i]
+            item[field] = None if math.isnan(value) else value
+        for field in TAG_FIELDS:
+            indptr, names = s[f'{field}.indptr'], self.vocab[field]
+            item[field] = [{'name': names[t]} for t in s[f'{field}.indices'][indptr[i]:indptr[i + 1]]]
+        return item
+
+    def stations(self, station_ids):
+        """Stazioni serializzate in ordine di ``station_ids`` (gli id mancanti sono saltati)."""
+        result = []
+        for station_id in station_ids:
+            i = self.row(station_id)
+            if i is not None:
+                result.append(self.station(i))
+        return result
+
+
+class SnapshotHolder:
+    """Tiene aperto lo snapshot corrente e lo riapre quando il file cambia."""
+
+    def __init__(self, path):
+        self.path = path
+        self.snapshot = None
+        self.identity = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, ttl):
+        if time.monotonic() - self.checked_at >= ttl:
+            with self.lock:
+                self.checked_at = time.monotonic()
+                try:
+                    stat = os.stat(self.path)
+                except FileNotFoundError:
+                    self.snapshot, self.identity = None, None
+                else:
+                    identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                    if identity != self.identity:
+                        self.snapshot = CatalogSnapshot(self.path)
+                        self.identity = identity
+        return self.snapshot
+
+
+def current_snapshot():
+    """Lo snapshot configurato, se esiste ed e' allineato alla versione corrente."""
+    path = current_app.config.get('CATALOG_SNAPSHOT_PATH')
+    if not path:
+        return None
+    holder = current_app.extensions.get('catalog_snapshot')
+    if holder is None:
+        holder = current_app.extensions.setdefault('catalog_snapshot', SnapshotHolder(path))
+    snapshot = holder.get(current_app.config['CATALOG_VERSION_TTL'])
+    if snapshot is None or snapshot.version != catalog_version()[0]:
+        return None
+    return snapshot
+
+
+def build_snapshot(path):
+    """Scrive lo snapshot del catalogo corrente in ``path``; restituisce (versione, numero stazioni)."""
+    from app.api.loading import station_tags
+    from app.api.stations import dump_stations
+    from app.models import Station
+
+    version, _ = read_catalog_version()
+    writer = SnapshotWriter()
+    query = Station.query.options(*station_tags()).order_by(Station.id).yield_per(2000)
+    for item in dump_stations(query):
+        writer.add(item)
+    writer.write(path, version)
+    return version, len(writer.ids)
@@ -0,0 +1,220 @@
+"""Generatore di dataset sintetici e riproducibili per i benchmark.
+
+Produce un catalogo di dimensione arbitraria con distribuzioni verosimili
+(popolarita' dei tag a legge di Zipf, lingue legate al paese, coordinate
+raggruppate attorno al centro del paese) e l'attivita' degli utenti:
+preferiti, playlist e cronologia di ascolto con stazioni scelte secondo
+una Zipf, cosi' poche stazioni ricevono la maggior parte degli ascolti.
+
+Tutto viene scritto con il percorso di importazione in blocco
+(``replace_catalog``). A parita' di ``seed`` il dataset e' identico; le
+date degli ascolti sono relative al giorno in cui viene generato.
+"""
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from app.catalog.importer import DEFAULT_BATCH_SIZE, content_hash, replace_catalog
+from app.history.rollups import rebuild_rollups
+from app.models import PlayHistory, Playlist, User, playlist_station_association, user_favorites
+
+ZIPF_EXPONENT = 1.1
+
+# Password di tutti gli utenti generati (user1, user2, ...)
+PASSWORD = 'password'
+
+# codice, nome, lingue, lat, lon, dispersione in gradi, peso
+COUNTRIES = [
+    ('US', 'The United States Of America', ('english', 'spanish'), 39.8, -98.6, 9.0, 20),
+    ('DE', 'Germany', ('german',), 51.2, 10.4, 2.0, 9),
+    ('GB', 'The United Kingdom Of Great Britain And Northern Ireland', ('english',), 53.0, -1.5, 2.0, 6),
+    ('FR', 'France', ('french',), 46.6, 2.4, 2.5, 6),
+    ('IT', 'Italy', ('italian',), 42.8, 12.5, 2.5, 6),
+    ('ES', 'Spain', ('spanish', 'catalan'), 40.2, -3.7, 2.5, 5),
+    ('NL', 'The Netherlands', ('dutch',), 52.2, 5.3, 0.7, 4),
+    ('BR', 'Brazil', ('portuguese',), -14.2, -51.9, 8.0, 5),
+    ('MX', 'Mexico', ('spanish',), 23.6, -102.5, 5.0, 4),
+    ('CA', 'Canada', ('english', 'french'), 50.0, -90.0, 8.0, 3),
+    ('RU', 'The Russian Federation', ('russian',), 55.7, 37.6, 6.0, 4),
+    ('PL', 'Poland', ('polish',), 52.1, 19.4, 1.5, 3),
+    ('AU', 'Australia', ('english',), -27.0, 140.0, 8.0, 2),
+    ('IN', 'India', ('hindi', 'english'), 21.0, 78.0, 6.0, 3),
+    ('JP', 'Japan', ('japanese',), 36.2, 138.2, 3.0, 2),
+    ('AR', 'Argentina', ('spanish',), -34.6, -64.0, 6.0, 2),
+    ('GR', 'Greece', ('greek',), 39.1, 21.8, 1.5, 2),
+    ('TR', 'Turkey', ('turkish',), 39.0, 35.2, 3.0, 2),
+    ('CH', 'Switzerland', ('german', 'french', 'italian'), 46.8, 8.2, 0.7, 2),
+    ('AT', 'Austria', ('german',), 47.5, 14.5, 1.0, 2),
+    ('BE', 'Belgium', ('dutch', 'french'), 50.6, 4.5, 0.6, 2),
+    ('PT', 'Portugal', ('portuguese',), 39.5, -8.0, 1.2, 2),
+    ('RO', 'Romania', ('romanian',), 45.9, 24.9, 2.0, 2),
+    ('SE', 'Sweden', ('swedish',), 60.1, 18.6, 4.0, 1),
+    ('CN', 'China', ('chinese',), 35.0, 104.0, 8.0, 1),
+]
+
+# categoria -> (tag in ordine di popolarita', probabilita' di averne almeno uno, massimo)
+TAG_VOCABULARY = {
+    'genre': (['pop', 'rock', 'dance', 'news', 'classical', 'jazz', 'electronic', 'hits', 'oldies',
+               'country', 'hiphop', 'house', 'latin', 'folk', 'metal', 'alternative', 'blues', 'soul',
+               'rnb', 'reggae', 'ambient', 'techno', 'indie', 'gospel', 'funk', 'lounge', 'chillout',
+               'punk', 'disco', 'trance', 'world', 'schlager', 'ska', 'opera', 'soundtrack'], 0.8, 3),
+    'decade': (['80s', '90s', '70s', '2000s', '60s', '2010s', '50s', '2020s', '40s'], 0.35, 2),
+    'topic': (['news', 'talk', 'sports', 'religion', 'community', 'culture', 'local', 'university',
+               'public', 'kids', 'comedy', 'politics', 'business', 'weather'], 0.3, 2),
+    'lang': (None, 0.85, 2),
+    'mood': (['chill', 'party', 'relax', 'energetic', 'romantic', 'focus'], 0.15, 1),
+}
+
+NAME_PREFIXES = ['Radio', 'Classic', 'Smooth', 'Planet', 'Star', 'Sky', 'Sound', 'Capital',
+                 'Metro', 'Wave', 'Hit', 'Power', 'Cool', 'City', 'Sunshine', 'Golden', 'Free']
+NAME_CORES = ['Nova', 'Rock', 'Jazz', 'Pop', 'Dance', 'Beat', 'Vibes', 'Blue', 'Express',
+              'Horizon', 'Kiss', 'Energy', 'Latino', 'Oldies', 'Classica', 'Lounge', 'Voice',
+              'Deep', 'Antenne', 'Europa', 'Onda', 'Melodia', 'Pulse', 'Spirit', 'Echo']
+NAME_SUFFIXES = ['FM', 'Radio', 'Hits', 'Live', 'Stream', 'One', 'Plus', '24', 'Web', '']
+
+CODECS = (['MP3', 'AAC', 'AAC+', 'OGG', 'FLAC'], [60, 25, 10, 4, 1])
+BITRATES = ([64, 96, 128, 192, 256, 320], [8, 10, 45, 15, 7, 15])
+
+
+def _zipf_cum_weights(n, exponent=ZIPF_EXPONENT):
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def _pick_tags(rng, names, cum_weights, probability, maximum):
+    if rng.random() >= probability:
+        return []
+    count = rng.randint(1, maximum)
+    return list(dict.fromkeys(rng.choices(names, cum_weights=cum_weights, k=count)))
+
+
+def generate_stations(count, seed=0):
+    """Righe ``(campi, tag, hash)`` come quelle di ``read_csv``."""
+    rng = random.Random(seed)
+    country_weights = list(accumulate(country[-1] for country in COUNTRIES))
+    vocab = {arg: (names, names and _zipf_cum_weights(len(names)), probability, maximum)
+             for arg, (names, probability, maximum) in TAG_VOCABULARY.items()}
+    codecs = (CODECS[0], list(accumulate(CODECS[1])))
+    bitrates = (BITRATES[0], list(accumulate(BITRATES[1])))
+
+    for i in range(1, count + 1):
+        code, country, langs, lat, lon, spread, _ = rng.choices(COUNTRIES, cum_weights=country_weights)[0]
+        name = ' '.join(part for part in (rng.choice(NAME_PREFIXES), rng.choice(NAME_CORES),
+                                          rng.choice(NAME_SUFFIXES)) if part)
+        if rng.random() < 0.3:
+            name += f' {rng.randint(87, 107)}.{rng.randint(0, 9)}'
+        slug = f"{name.lower().replace(' ', '-').replace('.', '')}-{i}"
+        url = f'http://stream{i % 97}.example.net/{slug}'
+        has_geo = rng.random() < 0.8
+        fields = (
+            name, url, url if rng.random() < 0.9 else url + '/live',
+            f'https://{slug}.example.org/' if rng.random() < 0.85 else None,
+            f'https://{slug}.example.org/favicon.png' if rng.random() < 0.6 else None,
+            country, code, None,
+            rng.choices(*codecs)[0], rng.choices(*bitrates)[0],
+            max(-90.0, min(90.0, rng.gauss(lat, spread))) if has_geo else None,
+            (rng.gauss(lon, spread * 1.5) + 180) % 360 - 180 if has_geo else None,
+        )
+        tags = []
+        for arg, (names, cum_weights, probability, maximum) in vocab.items():
+            if arg == 'lang':
+                # La lingua dipende dal paese, a volte con l'inglese in piu'
+                picked = [] if rng.random() >= probability else [langs[0]]
+                if picked and rng.random() < 0.3:
+                    picked.append(rng.choice(langs[1:] or ('english',)))
+                tags.append(list(dict.fromkeys(picked)))
+            else:
+                tags.append(_pick_tags(rng, names, cum_weights, probability, maximum))
+        tags = tuple(tags)
+        yield fields, tags, content_hash(fields, tags)
+
+
+class ActivityGenerator:
+    """Utenti, preferiti, playlist e cronologia di ascolto."""
+
+    def __init__(self, stations, users, favorites, playlists, plays, seed=0, days=90, now=None):
+        self.rng = random.Random(seed + 1)
+        # Durate delle sessioni (media 15 minuti) da un generatore separato,
+        # cosi' il resto del dataset non cambia
+        self.durations = random.Random(seed + 2)
+        self.stations = stations
+        self.users = users
+        self.favorites = favorites
+        self.playlists = playlists
+        self.plays = plays
+        self.days = days
+        # Popolarita' Zipf su una permutazione casuale degli id delle stazioni
+        self.ranked = list(range(1, stations + 1))
+        self.rng.shuffle(self.ranked)
+        self.cum_weights = _zipf_cum_weights(stations)
+        self.now = now or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.counts = {}
+
+    def popular(self, k):
+        return self.rng.choices(self.ranked, cum_weights=self.cum_weights, k=k)
+
+    def _count(self, mean):
+        # Attivita' molto variabile tra gli utenti (esponenziale)
+        return int(self.rng.expovariate(1 / mean)) if mean else 0
+
+    def _timestamp(self, within_days):
+        return self.now - timedelta(seconds=self.rng.randrange(int(within_days * 86400)))
+
+    def write(self, writer, batch_size=DEFAULT_BATCH_SIZE):
+        """Scrive tutto con ``writer``; restituisce le tabelle con id da riallineare."""
+        if not self.stations:
+            return []
+        user = User()
+        user.set_password(PASSWORD)
+        user_rows, favorite_rows, playlist_rows, entry_rows, play_rows = [], [], [], [], []
+        playlist_id = play_id = 0
+
+        def flush(force=False):
+            if not (force or len(play_rows) >= batch_size or len(user_rows) >= batch_size):
+                return
+            for table, columns, rows in (
+                    (User.__table__, ('id', 'username', 'password_hash', 'created_at'), user_rows),
+                    (user_favorites, ('user_id', 'station_id'), favorite_rows),
+                    (Playlist.__table__, ('id', 'name', 'description', 'is_public', 'created_at', 'user_id'),
+                     playlist_rows),
+                    (playlist_station_association, ('playlist_id', 'station_id'), entry_rows),
+                    (PlayHistory.__table__, ('id', 'user_id', 'station_id', 'played_at', 'ended_at'),
+                     play_rows)):
+                writer.insert(table, columns, rows)
+                self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+                rows.clear()
+
+        for user_id in range(1, self.users + 1):
+            user_rows.append((user_id, f'user{user_id}', user.password_hash, self._timestamp(365)))
+            favorites = set(self.popular(self._count(self.favorites)))
+            favorite_rows.extend((user_id, station_id) for station_id in sorted(favorites))
+            for n in range(self._count(self.playlists)):
+                playlist_id += 1
+                playlist_rows.append((playlist_id, f'Playlist {n + 1} di user{user_id}', None,
+                                      self.rng.random() < 0.7, self._timestamp(365), user_id))
+                entries = set(self.popular(self.rng.randint(5, 30)))
+                entry_rows.extend((playlist_id, station_id) for station_id in sorted(entries))
+            # Ogni utente ascolta soprattutto un piccolo insieme di stazioni
+            taste = list(favorites) + self.popular(10)
+            for _ in range(self._count(self.plays)):
+                station_id = self.rng.choice(taste) if self.rng.random() < 0.7 else self.popular(1)[0]
+                play_id += 1
+                played_at = self._timestamp(self.days)
+                ended_at = played_at + timedelta(seconds=int(self.durations.expovariate(1 / 900)))
+                play_rows.append((play_id, user_id, station_id, played_at, ended_at))
+            flush()
+        flush(force=True)
+        rebuild_rollups(writer.connection)
+        return [User.__table__, Playlist.__table__, PlayHistory.__table__]
+
+
+def generate_dataset(stations, users=0, favorites=10, playlists=1, plays=50, seed=0,
+                     batch_size=DEFAULT_BATCH_SIZE):
+    """Sostituisce il database con un dataset sintetico.
+
+    Restituisce le statistiche dell'importazione e il numero di righe
+    generate per ogni tabella dell'attivita' degli utenti.
+    """
+    activity = ActivityGenerator(stations, users, favorites, playlists, plays, seed=seed)
+    stats = replace_catalog(generate_stations(stations, seed), batch_size,
+                            extra=lambda writer: activity.write(writer, batch_size))
+    return stats, activity.counts
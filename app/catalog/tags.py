@@ -0,0 +1,140 @@
+"""Indice a bitmap dei tag (e dei country code) delle stazioni.
+
+Per ogni valore di ogni categoria teniamo la bitmap delle stazioni che lo
+hanno: i filtri di ``get_stations`` diventano unioni (``match=any``) o
+intersezioni (``match=all``) di bitmap all'interno di una categoria, e
+intersezioni tra categorie diverse. Nessun JOIN e nessun duplicato.
+"""
+from collections import defaultdict
+from functools import reduce
+import operator
+
+from app import db
+from app.catalog import CatalogIndex, register_index
+from app.catalog import bitmap
+from app.models import (Station, MusicGenre, Decade, Topic, Lang, Mood,
+                        station_musicgenres, station_decades, station_topics,
+                        station_langs, station_moods)
+
+# argomento della query -> (modello del tag, tabella di associazione, colonna fk)
+TAG_CATEGORIES = {
+    'genre': (MusicGenre, station_musicgenres, station_musicgenres.c.musicgenre_id),
+    'decade': (Decade, station_decades, station_decades.c.decade_id),
+    'topic': (Topic, station_topics, station_topics.c.topic_id),
+    'lang': (Lang, station_langs, station_langs.c.lang_id),
+    'mood': (Mood, station_moods, station_moods.c.mood_id),
+}
+
+FILTER_ARGS = tuple(TAG_CATEGORIES) + ('countrycode',)
+
+MATCH_MODES = {'any': operator.or_, 'all': operator.and_}
+
+
+def parse_values(raw):
+    return [value.strip() for value in raw.split(',') if value.strip()]
+
+
+def tag_rows(station_ids=None):
+    """Coppie (categoria, nome, station_id) lette dalle tabelle di associazione."""
+    for arg, (model, table, fk) in TAG_CATEGORIES.items():
+        query = db.session.query(table.c.station_id, model.name).join(model, model.id == fk)
+        if station_ids is not None:
+            query = query.filter(table.c.station_id.in_(station_ids))
+        for station_id, name in query.yield_per(10000):
+            yield arg, name, station_id
+
+
+def _station_rows(station_ids=None):
+    query = db.session.query(Station.id, Station.countrycode)
+    if station_ids is not None:
+        query = query.filter(Station.id.in_(station_ids))
+    return query.yield_per(10000)
+
+
+def _collect(station_ids=None):
+    """Restituisce (id di tutte le stazioni, {categoria: {valore: [id]}})."""
+    members = defaultdict(lambda: defaultdict(list))
+    all_ids = []
+    for station_id, countrycode in _station_rows(station_ids):
+        all_ids.append(station_id)
+        if countrycode:
+            members['countrycode'][countrycode].append(station_id)
+    for arg, name, station_id in tag_rows(station_ids):
+        members[arg][name].append(station_id)
+    return all_ids, members
+
+
+@register_index('tags')
+class TagBitmapIndex(CatalogIndex):
+
+    depends_on_tags = True
+
+    def __init__(self):
+        self.all = 0
+        self.bitmaps = {arg: {} for arg in FILTER_ARGS}
+        self._contains = None  # (bitmap, test) per ``contains``
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        all_ids, members = _collect()
+        index.all = bitmap.from_ids(all_ids)
+        for arg, values in members.items():
+            index.bitmaps[arg] = {value: bitmap.from_ids(ids) for value, ids in values.items()}
+        return index
+
+    def apply(self, upserted, deleted):
+        affected = set(upserted) | set(deleted)
+        if not affected:
+            return True
+        keep = ~bitmap.from_ids(affected)
+        self.all &= keep
+        for values in self.bitmaps.values():
+            for value in values:
+                values[value] &= keep
+        if upserted:
+            all_ids, members = _collect(list(upserted))
+            self.all |= bitmap.from_ids(all_ids)
+            for arg, values in members.items():
+                target = self.bitmaps[arg]
+                for value, ids in values.items():
+                    target[value] = target.get(value, 0) | bitmap.from_ids(ids)
+        return True
+
+    def contains(self, station_id):
+        """True se la stazione esiste (test O(1), riusato finche' ``all`` non cambia)."""
+        cached = self._contains
+        if cached is None or cached[0] is not self.all:
+            cached = self._contains = (self.all, bitmap.membership(self.all))
+        return station_id >= 0 and cached[1](station_id)
+
+    def counts(self, selected):
+        """Numero di stazioni di ``selected`` per ogni valore di ogni categoria."""
+        facets = {}
+        for arg, values in self.bitmaps.items():
+            counts = {}
+            for value, members in values.items():
+                count = (members & selected).bit_count()
+                if count:
+                    counts[value] = count
+            facets[arg] = counts
+        return facets
+
+    def filter(self, args, match='any'):
+        """Bitmap delle stazioni che soddisfano i filtri in ``args``.
+
+        Restituisce ``None`` se non c'e' nessun filtro. Solleva
+        ``ValueError`` se ``match`` non e' ``any`` o ``all``.
+        """
+        if match not in MATCH_MODES:
+            raise ValueError(match)
+        combine = MATCH_MODES[match]
+        result = None
+        for arg in FILTER_ARGS:
+            values = parse_values(args.get(arg) or '')
+            if not values:
+                continue
+            category = self.bitmaps[arg]
+            selected = reduce(combine, [category.get(value, 0) for value in values])
+            result = selected if result is None else result & selected
+        return result
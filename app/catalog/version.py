@@ -0,0 +1,193 @@
+"""Versione del catalogo condivisa tra i processi.
+
+La riga di ``catalog_version`` viene incrementata nella stessa transazione
+di ogni modifica a stazioni o tag (vedi ``app.catalog.events``) e dagli
+script di importazione. Ogni worker tiene in memoria l'ultima versione
+letta e la rilegge al massimo ogni ``CATALOG_VERSION_TTL`` secondi: se nel
+frattempo un altro processo ha cambiato il catalogo, gli indici in memoria
+vengono ricostruiti. La versione e' anche la base degli ETag.
+
+Nella stessa riga ``playlists_version`` viene incrementata nella transazione
+di ogni modifica a una playlist e riletta insieme alla versione del
+catalogo: la usa la cache dei risultati per le liste di playlist, cosi'
+tutti i worker smettono di servire le risposte vecchie entro il TTL.
+Allo stesso modo ``generation`` cambia solo con una sostituzione completa
+del catalogo (che svuota anche utenti e cronologia): chi la vede cambiare
+invia ``catalog_replaced``. Entra anche nei token (vedi ``app.api.identity``)
+perche' dopo una sostituzione gli id degli utenti ripartono da capo.
+"""
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert, select, update
+
+from app import db
+from app.catalog import catalog_changed, catalog_replaced
+from app.models import CatalogVersion, Station
+
+_table = CatalogVersion.__table__
+_station = Station.__table__
+
+_MARK_BATCH = 1000
+
+
+class VersionState:
+
+    def __init__(self):
+        self.version = None
+        self.updated_at = None
+        self.playlists_version = None
+        self.generation = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+
+def _state(app):
+    state = app.extensions.get('catalog_version')
+    if state is None:
+        state = app.extensions.setdefault('catalog_version', VersionState())
+    return state
+
+
+def bump_catalog_version(connection):
+    """Incrementa la versione usando ``connection``; restituisce (versione, data)."""
+    now = datetime.utcnow()
+    row = connection.execute(
+        update(_table).where(_table.c.id == 1)
+        .values(version=_table.c.version + 1, updated_at=now)
+        .returning(_table.c.version)
+    ).first()
+    if row is None:
+        connection.execute(insert(_table).values(id=1, version=1, updated_at=now))
+        return 1, now
+    return row[0], now
+
+
+def bump_playlists_version(connection):
+    """Incrementa la versione delle playlist usando ``connection`` e la restituisce."""
+    row = connection.execute(
+        update(_table).where(_table.c.id == 1)
+        .values(playlists_version=_table.c.playlists_version + 1)
+        .returning(_table.c.playlists_version)
+    ).first()
+    if row is None:
+        connection.execute(insert(_table).values(id=1, version=0, playlists_version=1,
+                                                 updated_at=datetime.utcnow()))
+        return 1
+    return row[0]
+
+
+def bump_catalog_generation(connection):
+    """Registra una sostituzione completa del catalogo; restituisce la nuova generazione.
+
+    Va chiamata dopo ``bump_catalog_version`` nella stessa transazione.
+    """
+    return connection.execute(
+        update(_table).where(_table.c.id == 1)
+        .values(generation=_table.c.generation + 1)
+        .returning(_table.c.generation)
+    ).scalar_one()
+
+
+def mark_stations(connection, station_ids, version):
+    """Registra in ``station.updated_version`` la versione che ha modificato le stazioni.
+
+    Il ``content_hash`` viene azzerato: la prossima sincronizzazione del
+    catalogo riallinea le stazioni modificate fuori dall'importatore.
+    """
+    station_ids = sorted(station_ids)
+    for start in range(0, len(station_ids), _MARK_BATCH):
+        batch = station_ids[start:start + _MARK_BATCH]
+        connection.execute(update(_station).where(_station.c.id.in_(batch))
+                           .values(updated_version=version, content_hash=None))
+
+
+def _read_versions():
+    row = db.session.execute(select(_table.c.version, _table.c.updated_at, _table.c.playlists_version,
+                                    _table.c.generation)
+                             .where(_table.c.id == 1)).first()
+    return tuple(row) if row else (0, None, 0, 0)
+
+
+def read_catalog_version():
+    version, updated_at, _, _ = _read_versions()
+    return version, updated_at
+
+
+def record_version(app, version, updated_at):
+    """Registra una versione prodotta da questo processo.
+
+    Se non e' la successiva di quella nota, nel mezzo c'e' stata una
+    modifica fatta da un altro processo: gli indici vanno ricostruiti.
+    """
+    state = _state(app)
+    with state.lock:
+        missed = state.version is not None and version != state.version + 1
+        state.version, state.updated_at = version, updated_at
+        state.checked_at = time.monotonic()
+    return missed
+
+
+def record_playlists_version(app, version):
+    """Registra una versione delle playlist prodotta da questo processo."""
+    state = _state(app)
+    with state.lock:
+        if state.playlists_version is None or version > state.playlists_version:
+            state.playlists_version = version
+
+
+def record_generation(app, generation):
+    """Registra una sostituzione completa fatta da questo processo."""
+    state = _state(app)
+    with state.lock:
+        state.generation = generation
+
+
+def refresh_catalog_version():
+    """Rilegge la versione dal database se quella in memoria e' scaduta."""
+    app = current_app._get_current_object()
+    state = _state(app)
+    if time.monotonic() - state.checked_at < app.config['CATALOG_VERSION_TTL']:
+        return
+    version, updated_at, playlists, generation = _read_versions()
+    with state.lock:
+        changed = state.version is not None and version != state.version
+        replaced = state.generation is not None and generation != state.generation
+        state.version, state.updated_at = version, updated_at
+        state.playlists_version = playlists
+        state.generation = generation
+        state.checked_at = time.monotonic()
+    if changed:
+        catalog_changed.send(app, full=True)
+    if replaced:
+        catalog_replaced.send(app)
+
+
+def catalog_version():
+    """``(versione, data di modifica)`` correnti per questo processo."""
+    state = _state(current_app)
+    if state.version is None:
+        refresh_catalog_version()
+    return state.version, state.updated_at
+
+
+def playlists_version():
+    """Versione corrente delle playlist per questo processo."""
+    state = _state(current_app)
+    if state.playlists_version is None:
+        refresh_catalog_version()
+    return state.playlists_version
+
+
+def catalog_generation():
+    """Generazione corrente del catalogo per questo processo."""
+    state = _state(current_app)
+    if state.generation is None:
+        refresh_catalog_version()
+    return state.generation
+
+
+def init_app(app):
+    app.before_request(refresh_catalog_version)
@@ -12,4 +12,93 @@ class Config:
 
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=7)
\ No newline at end of file
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=7)
+    # Versioni dei token in cache per processo: secondi prima di rileggerle
+    # (ritardo massimo di una revoca negli altri worker) e utenti tenuti
+    TOKEN_VERSION_TTL = int(os.environ.get('TOKEN_VERSION_TTL', 60))
+    TOKEN_VERSION_CACHE_SIZE = 100000
+
+    # Ricerca per nome: soglia di similarita' a trigrammi
+    SEARCH_MIN_SIMILARITY = float(os.environ.get('SEARCH_MIN_SIMILARITY', 0.3))
+
+    # Stazioni vicine: lato delle celle dell'indice spaziale e limiti delle richieste
+    GEO_CELL_KM = float(os.environ.get('GEO_CELL_KM', 50))
+    NEARBY_DEFAULT_RADIUS_KM = 100
+    NEARBY_MAX_RADIUS_KM = 2000
+    NEARBY_MAX_LIMIT = 100
+
+    # Raccomandazioni: decadimento degli ascolti, peso dei preferiti e cache per utente
+    RECOMMENDATION_HALF_LIFE_DAYS = 14
+    RECOMMENDATION_FAVORITE_WEIGHT = 3.0
+    RECOMMENDATION_HISTORY_DAYS = 120
+    RECOMMENDATION_CACHE_SIZE = 10000
+    RECOMMENDATION_CACHE_DEPTH = 50
+
+    # Versione del catalogo: ogni quanti secondi ricontrollarla nel database
+    # e per quanto browser e CDN possono riusare le risposte pubbliche
+    CATALOG_VERSION_TTL = float(os.environ.get('CATALOG_VERSION_TTL', 2))
+    CATALOG_CACHE_MAX_AGE = int(os.environ.get('CATALOG_CACHE_MAX_AGE', 60))
+
+    # Cache dei risultati: 'memory' (LRU per processo) oppure 'modulo:Classe'
+    # di un backend condiviso che implementa app.api.result_cache.CacheBackend
+    RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') != '0'
+    RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND', 'memory')
+    RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 300))
+    RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 2048))
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+    # Snapshot mmap del catalogo condiviso dai worker (flask catalog snapshot);
+    # se non impostato gli endpoint leggono le stazioni dal database
+    CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH')
+
+    # Strumentazione SQL: frazione di richieste tracciate (0 = disattivata),
+    # soglia del log delle richieste lente e ripetizioni che indicano un N+1
+    SQL_SAMPLE_RATE = float(os.environ.get('SQL_SAMPLE_RATE', 0))
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+    SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+    SQL_SLOWEST_KEPT = 5
+    # Token richiesto dagli endpoint /api/metrics (non impostato = disattivati)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Password: costo di bcrypt (gli hash con un costo diverso vengono
+    # rigenerati al login), processi dedicati (0 = nel worker), operazioni
+    # in attesa oltre le quali si risponde 503 e attesa massima in secondi
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 16))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+    # Login: tentativi falliti ammessi per username e per IP nella finestra
+    # in secondi, oltre i quali si risponde 429
+    LOGIN_MAX_FAILURES_PER_USER = int(os.environ.get('LOGIN_MAX_FAILURES_PER_USER', 5))
+    LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', 30))
+    LOGIN_THROTTLE_WINDOW = int(os.environ.get('LOGIN_THROTTLE_WINDOW', 300))
+
+    # Ascolti: eventi per blocco, secondi massimi di attesa prima della
+    # scrittura (0 = scrittura immediata) e limite della coda per processo
+    HISTORY_FLUSH_SIZE = int(os.environ.get('HISTORY_FLUSH_SIZE', 500))
+    HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', 1.0))
+    HISTORY_MAX_PENDING = int(os.environ.get('HISTORY_MAX_PENDING', 50000))
+    # Sessioni di ascolto: heartbeat oltre il timeout ignorati, start sulla
+    # stessa stazione entro la finestra uniti alla sessione precedente, e
+    # secondi di ascolto che valgono quanto un ascolto in piu'
+    SESSION_TIMEOUT_SECONDS = int(os.environ.get('SESSION_TIMEOUT_SECONDS', 300))
+    SESSION_MERGE_SECONDS = int(os.environ.get('SESSION_MERGE_SECONDS', 120))
+    SESSION_SECONDS_PER_PLAY = 600
+    SESSION_RECENT_USERS = 100000
+    # Giorni di ascolti grezzi conservati (0 = tutti; i conteggi giornalieri
+    # restano), partizioni mensili create in anticipo e righe per blocco
+    HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 365))
+    HISTORY_PARTITION_MONTHS_AHEAD = 2
+    HISTORY_PRUNE_BATCH_SIZE = 10000
+
+    # Stazioni di tendenza e popolari: mezza vita dei contatori, ogni quanti
+    # secondi leggere i nuovi ascolti dal database e quanti secondi rileggere
+    # prima del controllo precedente (ascolti scritti in ritardo)
+    TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 6))
+    POPULAR_HALF_LIFE_DAYS = float(os.environ.get('POPULAR_HALF_LIFE_DAYS', 7))
+    TRENDING_REFRESH_SECONDS = float(os.environ.get('TRENDING_REFRESH_SECONDS', 10))
+    TRENDING_POLL_OVERLAP_SECONDS = 120
+    TRENDING_MAX_LIMIT = 100
+
+    # Esportazione NDJSON: stazioni caricate e scritte per ogni blocco
+    EXPORT_BATCH_SIZE = 1000
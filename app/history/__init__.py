@@ -0,0 +1,8 @@
+"""Ascolti degli utenti: scrittura bufferizzata e segnali per chi li consuma."""
+from blinker import Namespace
+
+_signals = Namespace()
+
+# Inviato dopo il commit di un blocco di ascolti. Argomenti: sender=app,
+# plays (lista di dict con id, user_id, station_id e played_at).
+plays_recorded = _signals.signal('plays-recorded')
@@ -0,0 +1,233 @@
+"""Buffer degli ascolti con scrittura a blocchi.
+
+``POST /api/user/history`` non scrive piu' nel database: la stazione viene
+validata sull'indice in memoria e l'inizio della sessione di ascolto (o
+l'heartbeat, vedi ``app.history.sessions``) finisce in una coda del
+processo. Un thread la svuota con un solo INSERT multiplo quando arriva a
+``HISTORY_FLUSH_SIZE`` eventi o al piu' ogni ``HISTORY_FLUSH_INTERVAL``
+secondi, quindi il costo per ascolto e' una frazione di un round trip. Nella
+stessa transazione vengono aggiornati i conteggi giornalieri
+(``app.history.rollups``).
+
+Garanzie di consegna: at-most-once. L'ascolto viene confermato al client
+prima di essere scritto; ``played_at`` e' l'istante di ricezione, quindi il
+ritardo della scrittura non cambia l'ordine. In uscita normale del
+processo (``atexit``, anche sul SIGTERM con cui gunicorn ferma i worker) la
+coda viene svuotata; con un arresto brusco (SIGKILL, OOM) si perdono al
+massimo gli eventi degli ultimi ``HISTORY_FLUSH_INTERVAL`` secondi. Se il
+database non risponde il blocco resta in coda e viene ritentato; oltre
+``HISTORY_MAX_PENDING`` eventi in attesa i nuovi vengono rifiutati (503).
+Chi rilegge la propria cronologia vede comunque i propri ascolti: la
+lettura svuota prima la coda se contiene eventi di quell'utente.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app import db
+from app.history import plays_recorded
+from app.history.rollups import record_plays
+from app.history.sessions import RecentSessions, apply_heartbeats
+from app.models import PlayHistory, Station, User
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+
+class BufferFull(Exception):
+    """Troppi ascolti in attesa di essere scritti."""
+
+
+class HistoryBuffer:
+
+    def __init__(self, app, flush_size, flush_interval, max_pending):
+        config = app.config
+        self.app = app
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.merge_window = timedelta(seconds=config['SESSION_MERGE_SECONDS'])
+        self.timeout = timedelta(seconds=config['SESSION_TIMEOUT_SECONDS'])
+        self.recent = RecentSessions(config['SESSION_RECENT_USERS'])
+        self.events = []
+        self.heartbeats = {}  # (utente, stazione, inizio) -> ultimo segnale
+        self.users = set()  # utenti con eventi in coda
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # un solo blocco in scrittura alla volta
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.closed = False
+
+    def start(self, user_id, station_id, now=None):
+        """Apre (o riprende, vedi app.history.sessions) una sessione; restituisce l'inizio."""
+        now = now or datetime.utcnow()
+        started_at = self.recent.resume(user_id, station_id, now, self.merge_window)
+        if started_at is not None:
+            self.heartbeat(user_id, station_id, started_at, now)
+            return started_at
+        self.add(user_id, station_id, now)
+        self.recent.seen(user_id, station_id, now, now)
+        return now
+
+    def add(self, user_id, station_id, played_at=None):
+        played_at = played_at or datetime.utcnow()
+        event = {'user_id': user_id, 'station_id': station_id,
+                 'played_at': played_at, 'ended_at': played_at}
+        with self.lock:
+            if len(self.events) + len(self.heartbeats) >= self.max_pending:
+                raise BufferFull()
+            self.events.append(event)
+            self.users.add(user_id)
+            full = len(self.events) >= self.flush_size
+        self._schedule(full)
+
+    def heartbeat(self, user_id, station_id, started_at, now=None):
+        """Registra che la sessione e' ancora attiva (o, per lo stop, fin quando lo e' stata)."""
+        now = now or datetime.utcnow()
+        key = (user_id, station_id, started_at)
+        with self.lock:
+            previous = self.heartbeats.get(key)
+            if previous is None and len(self.events) + len(self.heartbeats) >= self.max_pending:
+                raise BufferFull()
+            # Stessa regola del flush: oltre il timeout il segnale non prolunga la sessione
+            if previous is None or previous < now <= previous + self.timeout:
+                self.heartbeats[key] = now
+            self.users.add(user_id)
+        self.recent.seen(user_id, station_id, started_at, now)
+        self._schedule(False)
+
+    def _schedule(self, full):
+        if not self.flush_interval or self.closed:
+            # Buffer disattivato (o processo in chiusura): scrittura immediata
+            self.flush()
+            return
+        self._ensure_thread()
+        if full:
+            self.wakeup.set()
+
+    def pending(self, user_id=None):
+        with self.lock:
+            if user_id is not None:
+                return user_id in self.users
+            return len(self.events) + len(self.heartbeats)
+
+    def flush(self):
+        """Scrive gli eventi in coda; restituisce quanti ne sono stati scritti."""
+        with self.flush_lock:
+            with self.lock:
+                events, self.events = self.events, []
+                heartbeats, self.heartbeats = self.heartbeats, {}
+                self.users = set()
+            if not events and not heartbeats:
+                return 0
+            with self.app.app_context():
+                try:
+                    written = self._write(events, heartbeats)
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    log.exception('Scrittura di %d ascolti e %d heartbeat fallita, '
+                                  'nuovo tentativo al prossimo giro', len(events), len(heartbeats))
+                    self._requeue(events, heartbeats)
+                    return 0
+                finally:
+                    db.session.remove()
+                if written:
+                    plays_recorded.send(self.app, plays=written)
+            return len(written) + len(heartbeats)
+
+    def _write(self, events, heartbeats):
+        try:
+            self._insert(events, heartbeats)
+            return events
+        except IntegrityError:
+            # Stazione (o utente) cancellata dopo la validazione: si scartano
+            # solo gli eventi che non hanno piu' un riferimento valido
+            db.session.rollback()
+        stations = set(db.session.scalars(
+            select(Station.id).where(Station.id.in_({e['station_id'] for e in events}))))
+        users = set(db.session.scalars(
+            select(User.id).where(User.id.in_({e['user_id'] for e in events}))))
+        valid = [e for e in events if e['station_id'] in stations and e['user_id'] in users]
+        if len(valid) < len(events):
+            log.warning('Scartati %d ascolti di stazioni o utenti non piu\' esistenti',
+                        len(events) - len(valid))
+        self._insert(valid, heartbeats)
+        return valid
+
+    def _insert(self, events, heartbeats):
+        # Sessioni nuove, heartbeat e aggregati giornalieri nella stessa transazione
+        connection = db.session.connection()
+        ids = []
+        if events:
+            ids = db.session.scalars(
+                insert(PlayHistory).returning(PlayHistory.id, sort_by_parameter_order=True), events).all()
+            record_plays(connection, events)
+        apply_heartbeats(connection, heartbeats, self.timeout)
+        db.session.commit()
+        # Solo dopo il commit: un blocco rimesso in coda non deve avere gli id
+        for event, play_id in zip(events, ids):
+            event['id'] = play_id
+
+    def _requeue(self, events, heartbeats):
+        with self.lock:
+            merged = events + self.events
+            dropped = len(merged) - self.max_pending
+            if dropped > 0:
+                log.error('Coda degli ascolti piena: scartati i %d eventi piu\' vecchi', dropped)
+                merged = merged[dropped:]
+            self.events = merged
+            for key, seen_at in heartbeats.items():
+                if seen_at > self.heartbeats.get(key, seen_at - self.timeout):
+                    self.heartbeats[key] = seen_at
+            self.users = {e['user_id'] for e in merged} | {user_id for user_id, _, _ in self.heartbeats}
+
+    def _ensure_thread(self):
+        # Dopo un fork (gunicorn --preload) il thread del padre non esiste piu'
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name='history-buffer', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            # Con il database in errore si evita di ritentare in un ciclo stretto
+            if not self.flush() and self.pending():
+                time.sleep(self.flush_interval)
+
+    def close(self):
+        """Ferma il thread e scrive cio' che resta in coda (chiamata da ``atexit``)."""
+        self.closed = True
+        self.wakeup.set()
+        thread = self.thread
+        if thread is not None and thread.is_alive() and self.pid == os.getpid():
+            thread.join(timeout=max(self.flush_interval, 1) * 5)
+        self.flush()
+
+
+def get_buffer(app=None):
+    app = app or current_app._get_current_object()
+    buffer = app.extensions.get('history_buffer')
+    if buffer is None:
+        with _lock:
+            buffer = app.extensions.get('history_buffer')
+            if buffer is None:
+                buffer = app.extensions['history_buffer'] = HistoryBuffer(
+                    app, app.config['HISTORY_FLUSH_SIZE'], app.config['HISTORY_FLUSH_INTERVAL'],
+                    app.config['HISTORY_MAX_PENDING'])
+                atexit.register(buffer.close)
+    return buffer
@@ -0,0 +1,41 @@
+"""Comandi ``flask history ...`` per la manutenzione della cronologia."""
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import db
+from app.history.rollups import rebuild_rollups
+from app.history.storage import ensure_partitions, prune_history, retention_cutoff
+
+history_cli = AppGroup('history', help='Manutenzione della cronologia degli ascolti.')
+
+
+@history_cli.command('maintain')
+def maintain_command():
+    """Crea le partizioni dei prossimi mesi ed elimina gli ascolti oltre la retention."""
+    config = current_app.config
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        created = ensure_partitions(connection, now.date(), config['HISTORY_PARTITION_MONTHS_AHEAD'])
+    for name in created:
+        click.echo(f'Creata la partizione {name}')
+    if not config['HISTORY_RETENTION_DAYS']:
+        return
+    cutoff = retention_cutoff(now, config['HISTORY_RETENTION_DAYS'])
+    dropped, deleted = prune_history(db.engine, cutoff, config['HISTORY_PRUNE_BATCH_SIZE'])
+    click.echo(f'Ascolti precedenti al {cutoff:%Y-%m-%d}: {len(dropped)} partizioni '
+               f'e {deleted} righe eliminate')
+
+
+@history_cli.command('rollup')
+def rollup_command():
+    """Ricalcola i conteggi giornalieri dagli ascolti presenti."""
+    with db.engine.begin() as connection:
+        rows = rebuild_rollups(connection)
+    click.echo(f'Aggregati ricalcolati: {rows} righe per utente, stazione e giorno')
+
+
+def init_app(app):
+    app.cli.add_command(history_cli)
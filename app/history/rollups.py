@@ -0,0 +1,133 @@
+"""Aggregati giornalieri degli ascolti.
+
+``daily_user_plays`` (utente, giorno, stazione) e ``daily_station_plays``
+(stazione, giorno) contengono il numero di ascolti (sessioni) e i secondi
+ascoltati, attribuiti al giorno di inizio della sessione, e vengono aggiornati
+nella stessa transazione che scrive gli ascolti (il blocco del buffer),
+quindi sono sempre coerenti con ``play_history`` anche quando gli eventi
+grezzi piu' vecchi vengono eliminati dalla retention. Raccomandazioni e
+statistiche leggono questi aggregati invece di scorrere gli eventi.
+
+``rebuild_rollups`` li ricalcola da ``play_history`` (dopo importazioni o
+scritture fatte fuori dal buffer).
+"""
+from collections import Counter
+
+from sqlalchemy import Date, Integer, cast, func, insert, select
+
+from app.models import DailyStationPlays, DailyUserPlays, PlayHistory
+
+_user_table = DailyUserPlays.__table__
+_station_table = DailyStationPlays.__table__
+_history = PlayHistory.__table__
+
+_VALUES = ('plays', 'seconds')
+
+
+def _dialect_insert(connection):
+    name = connection.dialect.name
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def _increment(connection, table, keys, rows):
+    """Somma ``plays`` e ``seconds`` alle righe esistenti o le crea (upsert)."""
+    if not rows:
+        return
+    # Ordine fisso: due blocchi concorrenti bloccano le righe nello stesso ordine
+    rows.sort(key=lambda row: tuple(row[key] for key in keys))
+    dialect_insert = _dialect_insert(connection)
+    if dialect_insert is not None:
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(index_elements=keys, set_={
+            column: table.c[column] + statement.excluded[column] for column in _VALUES})
+        connection.execute(statement, rows)
+        return
+    for row in rows:
+        condition = [table.c[key] == row[key] for key in keys]
+        result = connection.execute(table.update().where(*condition).values(
+            {column: table.c[column] + row[column] for column in _VALUES}))
+        if not result.rowcount:
+            connection.execute(table.insert().values(**row))
+
+
+def _record(connection, per_user, column):
+    """``per_user``: Counter di (utente, giorno, stazione) -> valore da sommare a ``column``."""
+    per_station = Counter()
+    for (_, day, station_id), value in per_user.items():
+        per_station[(station_id, day)] += value
+    other = 'seconds' if column == 'plays' else 'plays'
+    _increment(connection, _user_table, ['user_id', 'day', 'station_id'],
+               [{'user_id': user_id, 'day': day, 'station_id': station_id, column: value, other: 0}
+                for (user_id, day, station_id), value in per_user.items()])
+    _increment(connection, _station_table, ['station_id', 'day'],
+               [{'station_id': station_id, 'day': day, column: value, other: 0}
+                for (station_id, day), value in per_station.items()])
+
+
+def record_plays(connection, plays):
+    """Aggiunge agli aggregati gli ascolti appena scritti (dict come quelli del buffer)."""
+    _record(connection, Counter((play['user_id'], play['played_at'].date(), play['station_id'])
+                                for play in plays), 'plays')
+
+
+def record_listening(connection, listened):
+    """Aggiunge i secondi ascoltati: ``[(utente, giorno di inizio, stazione, secondi)]``."""
+    per_user = Counter()
+    for user_id, day, station_id, seconds in listened:
+        per_user[(user_id, day, station_id)] += seconds
+    _record(connection, +per_user, 'seconds')
+
+
+def play_weight(plays, seconds, seconds_per_play):
+    """Peso di un gruppo di ascolti: ogni ``seconds_per_play`` ascoltati valgono un ascolto in piu'."""
+    return plays + seconds / seconds_per_play
+
+
+def day_of(column, dialect):
+    """Espressione SQL per il giorno di un DateTime."""
+    if dialect.name == 'sqlite':
+        # CAST(... AS DATE) in SQLite restituisce solo l'anno
+        return func.date(column)
+    return cast(column, Date)
+
+
+def _seconds_between(start, end, dialect):
+    if dialect.name == 'sqlite':
+        return (func.julianday(end) - func.julianday(start)) * 86400
+    return func.extract('epoch', end - start)
+
+
+def rebuild_rollups(connection):
+    """Ricalcola entrambi gli aggregati dagli ascolti ancora presenti in ``play_history``.
+
+    I giorni gia' eliminati dalla retention non sono piu' ricostruibili e
+    restano come sono.
+    """
+    day = day_of(_history.c.played_at, connection.dialect)
+    first = connection.execute(select(func.min(_history.c.played_at))).scalar()
+    if first is None:
+        return 0
+    since = first.date()
+    connection.execute(_user_table.delete().where(_user_table.c.day >= since))
+    connection.execute(_station_table.delete().where(_station_table.c.day >= since))
+    listened = _seconds_between(_history.c.played_at, _history.c.ended_at, connection.dialect)
+    connection.execute(insert(_user_table).from_select(
+        ['user_id', 'day', 'station_id', 'plays', 'seconds'],
+        select(_history.c.user_id, day, _history.c.station_id, func.count(),
+               cast(func.coalesce(func.sum(listened), 0), Integer))
+        .where(_history.c.played_at.is_not(None))
+        .group_by(_history.c.user_id, day, _history.c.station_id)))
+    connection.execute(insert(_station_table).from_select(
+        ['station_id', 'day', 'plays', 'seconds'],
+        select(_user_table.c.station_id, _user_table.c.day,
+               func.sum(_user_table.c.plays), func.sum(_user_table.c.seconds))
+        .where(_user_table.c.day >= since)
+        .group_by(_user_table.c.station_id, _user_table.c.day)))
+    return connection.execute(
+        select(func.count()).select_from(_user_table).where(_user_table.c.day >= since)).scalar()
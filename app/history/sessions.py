@@ -0,0 +1,141 @@
+"""Sessioni di ascolto.
+
+Ogni riga di ``play_history`` e' una sessione: ``played_at`` e' l'inizio,
+``ended_at`` l'ultimo heartbeat (o lo stop) ricevuto. Il client invia
+``start`` quando cambia stazione e poi un ``heartbeat`` ogni minuto circa
+con il ``session_id`` ricevuto allo start (id della stazione e istante di
+inizio, l'utente e' quello del token); ``stop`` chiude la sessione.
+
+- Gli heartbeat non scrivono subito: il buffer tiene per ogni sessione
+  solo il piu' recente e al flush aggiorna ``ended_at`` con un UPDATE per
+  sessione nella stessa transazione degli inserimenti. Qualunque processo
+  puo' ricevere gli heartbeat: ``ended_at`` viene solo spostato in avanti.
+- Un heartbeat arrivato dopo piu' di ``SESSION_TIMEOUT_SECONDS`` dal
+  precedente (client sospeso, rete assente) viene ignorato: il client deve
+  aprire una nuova sessione.
+- Uno start sulla stessa stazione di una sessione finita da meno di
+  ``SESSION_MERGE_SECONDS`` la riprende invece di crearne una nuova (l'utente
+  che passa avanti e indietro tra due stazioni). Le sessioni recenti sono
+  in memoria nel processo, quindi con piu' worker la fusione e' garantita
+  solo se lo start arriva allo stesso processo.
+
+I secondi ascoltati finiscono anche negli aggregati giornalieri
+(``app.history.rollups``), attribuiti al giorno di inizio della sessione.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, bindparam, select
+
+from app.history.rollups import record_listening
+from app.models import PlayHistory
+
+_history = PlayHistory.__table__
+
+_EPOCH = datetime(1970, 1, 1)
+
+_HEARTBEAT_BATCH = 500
+
+SESSION_EVENTS = ('start', 'heartbeat', 'stop')
+
+
+def encode_session(station_id, started_at):
+    micros = (started_at - _EPOCH) // timedelta(microseconds=1)
+    return f'{station_id}:{micros}'
+
+
+def decode_session(session_id):
+    """``(station_id, started_at)``; solleva ``ValueError`` se non e' valido."""
+    station, _, micros = str(session_id).partition(':')
+    station_id, micros = int(station), int(micros)
+    if station_id < 0 or micros < 0:
+        raise ValueError(session_id)
+    return station_id, _EPOCH + timedelta(microseconds=micros)
+
+
+def _whole_seconds(moment):
+    return (moment - _EPOCH) // timedelta(seconds=1)
+
+
+class RecentSessions:
+    """Ultime sessioni per utente, per riprendere quelle appena interrotte."""
+
+    def __init__(self, max_users, per_user=4):
+        self.max_users = max_users
+        self.per_user = per_user
+        self.entries = OrderedDict()  # utente -> {stazione: (inizio, ultimo segnale)}
+        self.lock = threading.Lock()
+
+    def resume(self, user_id, station_id, now, window):
+        """Inizio della sessione da riprendere, oppure None."""
+        with self.lock:
+            sessions = self.entries.get(user_id)
+            if sessions is None or station_id not in sessions:
+                return None
+            started_at, seen_at = sessions[station_id]
+            if now - seen_at > window:
+                return None
+            sessions[station_id] = (started_at, now)
+            self.entries.move_to_end(user_id)
+            return started_at
+
+    def seen(self, user_id, station_id, started_at, now):
+        with self.lock:
+            sessions = self.entries.setdefault(user_id, {})
+            current = sessions.get(station_id)
+            if current is None or current[0] != started_at:
+                sessions.pop(station_id, None)
+                sessions[station_id] = (started_at, now)
+                while len(sessions) > self.per_user:
+                    del sessions[next(iter(sessions))]
+            elif now > current[1]:
+                sessions[station_id] = (started_at, now)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+
+def apply_heartbeats(connection, heartbeats, timeout):
+    """Sposta in avanti ``ended_at`` delle sessioni; restituisce quante ne sono cambiate.
+
+    ``heartbeats``: dict (utente, stazione, inizio) -> ultimo segnale.
+    """
+    keys = sorted(heartbeats)
+    changed = 0
+    for start in range(0, len(keys), _HEARTBEAT_BATCH):
+        batch = {key: heartbeats[key] for key in keys[start:start + _HEARTBEAT_BATCH]}
+        changed += _apply_batch(connection, batch, timeout)
+    return changed
+
+
+def _apply_batch(connection, heartbeats, timeout):
+    users = {user_id for user_id, _, _ in heartbeats}
+    starts = {started_at for _, _, started_at in heartbeats}
+    query = (select(_history.c.id, _history.c.user_id, _history.c.station_id,
+                    _history.c.played_at, _history.c.ended_at)
+             .where(_history.c.user_id.in_(users), _history.c.played_at.in_(starts)))
+    if connection.dialect.name == 'postgresql':
+        # Due processi con heartbeat della stessa sessione non contano due volte i secondi
+        query = query.with_for_update()
+    updates, listened = [], []
+    for row in connection.execute(query):
+        seen_at = heartbeats.get((row.user_id, row.station_id, row.played_at))
+        if seen_at is None:
+            continue
+        ended_at = row.ended_at or row.played_at
+        if seen_at <= ended_at or seen_at - ended_at > timeout:
+            continue
+        updates.append({'b_id': row.id, 'b_played_at': row.played_at, 'b_ended_at': seen_at})
+        seconds = _whole_seconds(seen_at) - _whole_seconds(ended_at)
+        if seconds:
+            listened.append((row.user_id, row.played_at.date(), row.station_id, seconds))
+    if updates:
+        # played_at nella condizione: su PostgreSQL limita l'UPDATE a una partizione
+        connection.execute(
+            _history.update()
+            .where(and_(_history.c.id == bindparam('b_id'), _history.c.played_at == bindparam('b_played_at')))
+            .values(ended_at=bindparam('b_ended_at')),
+            updates)
+        record_listening(connection, listened)
+    return len(updates)
@@ -0,0 +1,116 @@
+"""Partizioni e retention di ``play_history``.
+
+Su PostgreSQL la tabella e' partizionata per mese su ``played_at``
+(``play_history_pYYYYMM`` piu' una partizione di default per gli ascolti
+fuori dagli intervalli): le partizioni dei mesi successivi vanno create in
+anticipo con ``flask history maintain`` (da cron, almeno una volta al
+mese), e la retention elimina intere partizioni con un ``DROP TABLE``
+invece di cancellare milioni di righe. Su SQLite la tabella resta unica e
+la retention cancella le righe a blocchi.
+
+Gli eventi piu' vecchi di ``HISTORY_RETENTION_DAYS`` giorni vengono
+eliminati; i conteggi giornalieri in ``app.history.rollups`` restano. Il
+limite e' sempre a mezzanotte, cosi' il primo giorno ancora presente e'
+completo e gli aggregati si possono ricostruire.
+"""
+import re
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import select, text
+
+from app.models import PlayHistory
+
+_history = PlayHistory.__table__
+
+_PARTITION = re.compile(r'^play_history_p(\d{4})(\d{2})$')
+
+
+def _month(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'play_history_p{month.year:04d}{month.month:02d}'
+
+
+def is_partitioned(connection):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass('play_history'))")).scalar()
+
+
+def partitions(connection):
+    """Mesi delle partizioni mensili esistenti, in ordine."""
+    rows = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('play_history')"))
+    months = []
+    for name, in rows:
+        match = _PARTITION.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def create_partition(connection, month):
+    name = partition_name(month)
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF play_history "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"))
+    return name
+
+
+def ensure_partitions(connection, today, months_ahead):
+    """Crea le partizioni dal mese di ``today`` ai ``months_ahead`` successivi.
+
+    Restituisce i nomi di quelle create. Senza partizionamento non fa nulla.
+    """
+    if not is_partitioned(connection):
+        return []
+    existing = set(partitions(connection))
+    created = []
+    month = _month(today)
+    for _ in range(months_ahead + 1):
+        if month not in existing:
+            created.append(create_partition(connection, month))
+        month = _next_month(month)
+    return created
+
+
+def retention_cutoff(now, days):
+    """Mezzanotte del primo giorno da conservare."""
+    return datetime.combine((now - timedelta(days=days)).date(), time())
+
+
+def prune_history(engine, cutoff, batch_size):
+    """Elimina gli ascolti precedenti a ``cutoff``; restituisce ``(partizioni, righe)``.
+
+    Ogni partizione o blocco di righe e' una transazione separata, per non
+    tenere lock lunghi sulla tabella.
+    """
+    dropped = []
+    with engine.begin() as connection:
+        months = partitions(connection) if is_partitioned(connection) else []
+    for month in months:
+        if _next_month(month) > cutoff.date():
+            break
+        with engine.begin() as connection:
+            name = partition_name(month)
+            connection.execute(text(f'ALTER TABLE play_history DETACH PARTITION {name}'))
+            connection.execute(text(f'DROP TABLE {name}'))
+            dropped.append(name)
+
+    deleted = 0
+    while True:
+        with engine.begin() as connection:
+            batch = select(_history.c.id).where(_history.c.played_at < cutoff).limit(batch_size)
+            result = connection.execute(_history.delete().where(_history.c.id.in_(batch.scalar_subquery())))
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return dropped, deleted
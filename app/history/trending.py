@@ -0,0 +1,223 @@
+"""Stazioni di tendenza e piu' popolari, da contatori in memoria con decadimento.
+
+Ogni ascolto vale 1 (piu' il tempo di ascolto, vedi
+``SESSION_SECONDS_PER_PLAY``) e dimezza il suo peso ogni ``TRENDING_HALF_LIFE_HOURS``
+ore (tendenza) o ``POPULAR_HALF_LIFE_DAYS`` giorni (popolari). I pesi sono
+memorizzati con il "forward decay": ``exp(rate * (t - origine))`` e' fisso
+nel tempo, quindi un nuovo ascolto aggiorna una sola voce e l'ordinamento
+non cambia col passare del tempo; l'origine viene spostata solo quando gli
+esponenti diventano troppo grandi. La classifica seleziona con un heap solo
+le prime voci, senza ordinare tutti i pesi.
+
+All'avvio (primo uso nel processo) i contatori vengono ricostruiti dai
+conteggi giornalieri (``daily_station_plays``) e dagli ascolti grezzi
+degli ultimi giorni. Poi:
+
+- gli ascolti scritti da questo processo vengono contati subito, al
+  segnale ``plays_recorded`` del buffer;
+- ogni ``TRENDING_REFRESH_SECONDS`` secondi vengono riletti gli ascolti con
+  ``played_at`` negli ultimi ``TRENDING_POLL_OVERLAP_SECONDS`` secondi prima
+  del controllo precedente, saltando gli id gia' contati, cosi' ogni
+  worker vede anche quelli degli altri processi. Non si legge per id
+  crescente: i blocchi di worker diversi fanno il commit in ordine diverso
+  da quello degli id. La sovrapposizione deve superare il ritardo tra
+  l'inizio di un ascolto e la sua scrittura (``HISTORY_FLUSH_INTERVAL``);
+  gli ascolti scritti piu' tardi (es. dopo un errore del database) li
+  conta solo il processo che li ha scritti.
+
+Solo una sostituzione completa del catalogo (``catalog_replaced``, che
+svuota anche la cronologia) azzera i contatori; le stazioni cancellate da
+una sincronizzazione o dall'ORM vengono solo tolte dai contatori.
+"""
+import heapq
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import select
+
+from app import db
+from app.catalog import catalog_changed, catalog_replaced
+from app.history import plays_recorded
+from app.history.rollups import play_weight
+from app.models import DailyStationPlays, PlayHistory
+
+_history = PlayHistory.__table__
+_daily = DailyStationPlays.__table__
+
+# Oltre questo esponente l'origine del forward decay viene spostata
+_MAX_EXPONENT = 60.0
+# Pesi (gia' decaduti) sotto questa soglia vengono dimenticati
+_MIN_WEIGHT = 1e-3
+# Storico letto all'avvio, in mezze vite: oltre, un ascolto pesa meno di 1/256
+_HORIZON_HALF_LIVES = 8
+
+_lock = threading.Lock()
+
+
+def _epoch(moment):
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+class DecayedCounter:
+    """Conteggi per stazione con decadimento esponenziale."""
+
+    def __init__(self, half_life, origin):
+        self.rate = math.log(2) / half_life
+        self.origin = origin
+        self.weights = {}
+
+    def add(self, station_id, when, count=1):
+        exponent = self.rate * (when - self.origin)
+        if exponent > _MAX_EXPONENT:
+            self._rebase(when)
+            exponent = 0.0
+        self.weights[station_id] = self.weights.get(station_id, 0.0) + count * math.exp(exponent)
+
+    def _rebase(self, origin):
+        factor = math.exp(-self.rate * (origin - self.origin))
+        self.weights = {station_id: weight * factor for station_id, weight in self.weights.items()
+                        if weight * factor >= _MIN_WEIGHT}
+        self.origin = origin
+
+    def forget(self, station_ids):
+        for station_id in station_ids:
+            self.weights.pop(station_id, None)
+
+    def score(self, weight, now):
+        return weight * math.exp(-self.rate * (now - self.origin))
+
+    def top(self, limit, now, accept=None):
+        """Le ``limit`` stazioni con il peso piu' alto: ``[(id, punteggio)]``."""
+        # Con un filtro si prendono via via piu' candidati finche' ne
+        # restano abbastanza o i pesi finiscono
+        wanted = limit
+        while True:
+            ranking = heapq.nlargest(wanted, self.weights, key=self.weights.get)
+            result = [(station_id, self.score(self.weights[station_id], now)) for station_id in ranking
+                      if accept is None or accept(station_id)]
+            if len(result) >= limit or len(ranking) < wanted:
+                return result[:limit]
+            wanted *= 4
+
+
+class TrendingCounters:
+
+    def __init__(self, config):
+        now = time.time()
+        self.counters = {
+            'trending': DecayedCounter(config['TRENDING_HALF_LIFE_HOURS'] * 3600.0, now),
+            'popular': DecayedCounter(config['POPULAR_HALF_LIFE_DAYS'] * 86400.0, now),
+        }
+        self.refresh_seconds = config['TRENDING_REFRESH_SECONDS']
+        self.overlap = timedelta(seconds=config['TRENDING_POLL_OVERLAP_SECONDS'])
+        self.seconds_per_play = config['SESSION_SECONDS_PER_PLAY']
+        self.raw_seconds = config['TRENDING_HALF_LIFE_HOURS'] * 3600.0 * _HORIZON_HALF_LIVES
+        # Ascolti gia' contati con played_at successivo a ``since`` (id -> played_at)
+        self.seen = {}
+        self.since = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def _add(self, station_id, when, count=1):
+        for counter in self.counters.values():
+            counter.add(station_id, when, count)
+
+    def build(self):
+        self.since = datetime.utcnow() - self.overlap
+        # Giorni interi prima della finestra degli ascolti grezzi dai conteggi
+        # giornalieri, il resto evento per evento
+        raw_since = datetime.combine(
+            (datetime.utcnow() - timedelta(seconds=self.raw_seconds)).date(), datetime.min.time())
+        popular = self.counters['popular']
+        horizon = raw_since - timedelta(seconds=_HORIZON_HALF_LIVES * math.log(2) / popular.rate)
+        days = db.session.execute(
+            select(_daily.c.station_id, _daily.c.day, _daily.c.plays, _daily.c.seconds)
+            .where(_daily.c.day >= horizon.date(), _daily.c.day < raw_since.date()))
+        for station_id, day, plays, seconds in days:
+            # Ascolti del giorno collocati a mezzogiorno
+            popular.add(station_id, _epoch(datetime.combine(day, datetime.min.time())) + 43200,
+                        play_weight(plays, seconds, self.seconds_per_play))
+        self._read_plays(raw_since)
+        self.checked_at = time.monotonic()
+
+    def _read_plays(self, since):
+        rows = db.session.execute(
+            select(_history.c.id, _history.c.station_id, _history.c.played_at, _history.c.ended_at)
+            .where(_history.c.played_at >= since))
+        for play_id, station_id, played_at, ended_at in rows:
+            if play_id in self.seen:
+                continue
+            # Le sessioni nuove hanno durata 0: il tempo di ascolto successivo
+            # arriva ai contatori solo con la ricostruzione dagli aggregati
+            seconds = (ended_at - played_at).total_seconds() if ended_at else 0
+            self._add(station_id, _epoch(played_at), play_weight(1, seconds, self.seconds_per_play))
+            if played_at >= self.since:
+                self.seen[play_id] = played_at
+
+    def record(self, plays):
+        """Conta gli ascolti appena scritti da questo processo."""
+        with self.lock:
+            for play in plays:
+                if play['id'] not in self.seen:
+                    self._add(play['station_id'], _epoch(play['played_at']))
+                    self.seen[play['id']] = play['played_at']
+
+    def refresh(self):
+        """Rilegge gli ascolti recenti (anche di altri processi) e conta quelli nuovi."""
+        if time.monotonic() - self.checked_at < self.refresh_seconds:
+            return
+        with self.lock:
+            if time.monotonic() - self.checked_at < self.refresh_seconds:
+                return
+            polled_at = datetime.utcnow()
+            self._read_plays(self.since)
+            self.since = polled_at - self.overlap
+            self.seen = {play_id: played_at for play_id, played_at in self.seen.items()
+                         if played_at >= self.since}
+            self.checked_at = time.monotonic()
+
+    def top(self, kind, limit, accept=None):
+        with self.lock:
+            return self.counters[kind].top(limit, time.time(), accept)
+
+    def forget(self, station_ids):
+        with self.lock:
+            for counter in self.counters.values():
+                counter.forget(station_ids)
+
+
+@catalog_replaced.connect
+def _reset_on_catalog_replace(app):
+    # Cronologia svuotata: gli id degli ascolti ripartono da capo
+    app.extensions.pop('trending', None)
+
+
+@plays_recorded.connect
+def _count_plays(app, plays):
+    counters = app.extensions.get('trending')
+    if counters is not None:
+        counters.record(plays)
+
+
+@catalog_changed.connect
+def _forget_deleted_stations(app, deleted=(), **changes):
+    counters = app.extensions.get('trending')
+    if counters is not None and deleted:
+        counters.forget(deleted)
+
+
+def get_trending(app=None):
+    app = app or current_app._get_current_object()
+    counters = app.extensions.get('trending')
+    if counters is None:
+        with _lock:
+            counters = app.extensions.get('trending')
+            if counters is None:
+                counters = TrendingCounters(app.config)
+                counters.build()
+                app.extensions['trending'] = counters
+    counters.refresh()
+    return counters
@@ -0,0 +1,198 @@
+"""Strumentazione SQL per richiesta (campionata).
+
+Per una frazione ``SQL_SAMPLE_RATE`` delle richieste gli eventi
+``before/after_cursor_execute`` di SQLAlchemy registrano ogni statement
+eseguito: numero, tempo nel database, statement piu' lenti e statement
+ripetuti (lo stesso SQL eseguito molte volte nella stessa richiesta e' il
+segno tipico di un caricamento N+1). A fine richiesta i dati vengono
+aggregati per endpoint (esposti da ``/api/metrics`` in formato Prometheus
+e da ``/api/metrics/sql``) e le richieste lente o con N+1 finiscono nel log
+``app.slow_requests`` come JSON su una riga.
+
+Con il campionamento a 0 gli eventi non vengono nemmeno registrati. Le
+metriche sono per processo: con piu' worker ognuno espone le proprie.
+"""
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_log = logging.getLogger('app.slow_requests')
+
+_current = ContextVar('sql_trace', default=None)
+
+# Limiti per gli istogrammi degli statement per richiesta
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_MAX_SQL_LENGTH = 300
+
+
+def _shorten(statement):
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= _MAX_SQL_LENGTH else statement[:_MAX_SQL_LENGTH] + '...'
+
+
+class RequestTrace:
+    """Statement eseguiti durante una richiesta campionata."""
+
+    def __init__(self, keep):
+        self.started = time.perf_counter()
+        self.keep = keep
+        self.count = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.slowest = []  # heap di (secondi, statement)
+        self.status = None
+
+    def add(self, statement, elapsed):
+        self.count += 1
+        self.db_time += elapsed
+        self.statements[statement] += 1
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, (elapsed, statement))
+        elif elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (elapsed, statement))
+
+    def repeated(self, threshold):
+        """Statement eseguiti almeno ``threshold`` volte (probabili N+1)."""
+        return [(statement, count) for statement, count in self.statements.most_common()
+                if count >= threshold]
+
+
+class EndpointStats:
+
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.request_seconds = 0.0
+        self.n_plus_one = 0
+        self.buckets = [0] * len(STATEMENT_BUCKETS)
+        self.slowest = []  # heap di (secondi, statement)
+        self.patterns = Counter()  # statement ripetuto -> richieste in cui e' comparso
+
+
+class SqlMetrics:
+    """Aggregati per endpoint delle richieste campionate."""
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, trace, duration, repeated):
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.requests += 1
+            stats.statements += trace.count
+            stats.db_seconds += trace.db_time
+            stats.request_seconds += duration
+            for i, limit in enumerate(STATEMENT_BUCKETS):
+                if trace.count <= limit:
+                    stats.buckets[i] += 1
+            if repeated:
+                stats.n_plus_one += 1
+                stats.patterns.update(statement for statement, _ in repeated)
+            for item in trace.slowest:
+                if len(stats.slowest) < self.keep:
+                    heapq.heappush(stats.slowest, item)
+                elif item[0] > stats.slowest[0][0]:
+                    heapq.heapreplace(stats.slowest, item)
+
+    def snapshot(self):
+        """Copia degli aggregati (per i due endpoint delle metriche)."""
+        with self.lock:
+            return {endpoint: {
+                'requests': stats.requests,
+                'statements': stats.statements,
+                'db_seconds': stats.db_seconds,
+                'request_seconds': stats.request_seconds,
+                'n_plus_one': stats.n_plus_one,
+                'buckets': list(zip(STATEMENT_BUCKETS, stats.buckets)),
+                'slowest': [{'ms': round(elapsed * 1000, 3), 'statement': _shorten(statement)}
+                            for elapsed, statement in sorted(stats.slowest, reverse=True)],
+                'repeated': [{'statement': _shorten(statement), 'requests': count}
+                             for statement, count in stats.patterns.most_common(self.keep)],
+            } for endpoint, stats in self.endpoints.items()}
+
+
+def get_metrics(app=None):
+    app = app or current_app
+    metrics = app.extensions.get('sql_metrics')
+    if metrics is None:
+        metrics = app.extensions.setdefault('sql_metrics', SqlMetrics(app.config['SQL_SLOWEST_KEPT']))
+    return metrics
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('sql_trace_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _current.get()
+    if trace is not None:
+        started = conn.info['sql_trace_started'].pop()
+        trace.add(statement, time.perf_counter() - started)
+
+
+def _start_trace():
+    if random.random() < current_app.config['SQL_SAMPLE_RATE']:
+        g.sql_trace_token = _current.set(RequestTrace(current_app.config['SQL_SLOWEST_KEPT']))
+
+
+def _remember_status(response):
+    trace = _current.get()
+    if trace is not None:
+        trace.status = response.status_code
+    return response
+
+
+def _finish_trace(exc):
+    # teardown: per le risposte in streaming arriva dopo la fine del body
+    token = g.pop('sql_trace_token', None)
+    if token is None:
+        return
+    trace = _current.get()
+    _current.reset(token)
+    config = current_app.config
+    duration = time.perf_counter() - trace.started
+    endpoint = request.endpoint or 'unmatched'
+    repeated = trace.repeated(config['SQL_N_PLUS_ONE_THRESHOLD'])
+    get_metrics().record(endpoint, trace, duration, repeated)
+
+    if duration * 1000 >= config['SLOW_REQUEST_MS'] or repeated:
+        slow_log.warning(json.dumps({
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': trace.status if exc is None else 500,
+            'duration_ms': round(duration * 1000, 3),
+            'statements': trace.count,
+            'db_ms': round(trace.db_time * 1000, 3),
+            'repeated': [{'statement': _shorten(statement), 'count': count}
+                         for statement, count in repeated],
+            'slowest': [{'ms': round(elapsed * 1000, 3), 'statement': _shorten(statement)}
+                        for elapsed, statement in sorted(trace.slowest, reverse=True)],
+        }))
+
+
+def init_app(app):
+    if not app.config['SQL_SAMPLE_RATE']:
+        return
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_trace)
+    app.after_request(_remember_status)
+    app.teardown_request(_finish_trace)
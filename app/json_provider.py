@@ -0,0 +1,36 @@
+"""JSON provider di Flask basato su orjson.
+
+Stesso comportamento del provider di default (chiavi ordinate, date in
+formato HTTP, output compatto fuori dal debug) ma con la codifica fatta in
+C. L'unica differenza e' che i caratteri non ASCII vengono scritti in UTF-8
+invece che come sequenze ``\\uXXXX``: il JSON decodificato e' identico.
+"""
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+
+    def _options(self, indent=False):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent))
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
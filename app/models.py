@@ -1,8 +1,6 @@
 from . import db
 from datetime import datetime
-from flask_bcrypt import Bcrypt
-
-bcrypt = Bcrypt()
+from . import passwords
 
 station_musicgenres = db.Table('station_musicgenres',
     db.Column('station_id', db.Integer, db.ForeignKey('station.id'), primary_key=True),
@@ -44,6 +42,8 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Incrementata per revocare tutti i token emessi (vedi app.api.identity)
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     favorite_stations = db.relationship('Station', secondary=user_favorites, lazy='dynamic')
     play_history = db.relationship('PlayHistory', backref='user', lazy='dynamic',
                                    order_by="desc(PlayHistory.played_at)")
@@ -51,11 +51,11 @@ class User(db.Model):
 
     def set_password(self, password):
         """Crea l'hash della password."""
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = passwords.hash_password(password)
 
     def check_password(self, password):
         """Verifica la password confrontandola con l'hash."""
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return passwords.check_password(self.password_hash, password)
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -75,6 +75,10 @@ class Station(db.Model):
     bitrate = db.Column(db.Integer)
     geo_lat = db.Column(db.Float)
     geo_long = db.Column(db.Float)
+    # Versione del catalogo dell'ultima modifica (per le esportazioni incrementali)
+    updated_version = db.Column(db.Integer, index=True)
+    # Hash di campi e tag come importati dal CSV (per la sincronizzazione incrementale)
+    content_hash = db.Column(db.String(32))
 
     music_genres = db.relationship('MusicGenre', secondary=station_musicgenres, back_populates='stations')
     decades = db.relationship('Decade', secondary=station_decades, back_populates='stations')
@@ -116,13 +120,40 @@ class Mood(db.Model):
 
 
 class PlayHistory(db.Model):
+    # Su PostgreSQL la tabella e' partizionata per mese su played_at
+    # (vedi app.history.storage)
+    __table_args__ = (db.Index('ix_play_history_user_played', 'user_id', 'played_at'),
+                      # Lettura degli ascolti recenti di tutti gli utenti (app.history.trending)
+                      db.Index('ix_play_history_played_at', 'played_at'))
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     station_id = db.Column(db.Integer, db.ForeignKey('station.id'), nullable=False)
     played_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Ultimo heartbeat (o stop) della sessione di ascolto; NULL per le righe
+    # precedenti alle sessioni
+    ended_at = db.Column(db.DateTime, nullable=True)
     station = db.relationship('Station')
 
 
+class DailyUserPlays(db.Model):
+    """Ascolti per utente, stazione e giorno (vedi app.history.rollups)."""
+    __tablename__ = 'daily_user_plays'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    station_id = db.Column(db.Integer, db.ForeignKey('station.id'), primary_key=True)
+    plays = db.Column(db.Integer, nullable=False)
+    seconds = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
+class DailyStationPlays(db.Model):
+    """Ascolti per stazione e giorno (vedi app.history.rollups)."""
+    __tablename__ = 'daily_station_plays'
+    station_id = db.Column(db.Integer, db.ForeignKey('station.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    plays = db.Column(db.Integer, nullable=False)
+    seconds = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
 class Playlist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
@@ -132,7 +163,18 @@ class Playlist(db.Model):
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
-    stations = db.relationship('Station', secondary=playlist_station_association, lazy='dynamic')
+    stations = db.relationship('Station', secondary=playlist_station_association)
 
     def __repr__(self):
         return f'<Playlist {self.name}>'
+
+
+class CatalogVersion(db.Model):
+    """Contatore (una sola riga) incrementato a ogni modifica del catalogo."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Incrementata a ogni modifica delle playlist (chiavi della cache dei risultati)
+    playlists_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Incrementata solo dalle sostituzioni complete del catalogo
+    generation = db.Column(db.Integer, nullable=False, default=0, server_default='0')
@@ -0,0 +1,186 @@
+"""Hash e verifica delle password fuori dal worker che serve la richiesta.
+
+bcrypt e' lento per costruzione: eseguito nel worker una raffica di login
+(o un attacco di credential stuffing) occupa tutta la CPU e la navigazione
+delle stazioni si ferma. Qui hash e verifiche vanno in un pool di processi
+di ``PASSWORD_HASH_WORKERS`` processi con al massimo ``PASSWORD_HASH_QUEUE``
+operazioni in attesa o in corso: oltre il limite ``PasswordHasherBusy``
+fa rispondere subito 503 invece di accodare. Con 0 processi le operazioni
+vengono eseguite nel processo chiamante (comandi da terminale, test).
+
+Il costo e' ``BCRYPT_LOG_ROUNDS``; ``needs_rehash`` dice se un hash e' stato
+creato con un costo diverso, cosi' il login lo puo' rigenerare.
+
+``LoginThrottle`` limita i tentativi falliti per username e per IP in una
+finestra di ``LOGIN_THROTTLE_WINDOW`` secondi, prima di calcolare bcrypt.
+Pool e contatori sono per processo.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+from flask import current_app
+
+_lock = threading.Lock()
+
+
+class PasswordHasherBusy(Exception):
+    """Troppe operazioni bcrypt in attesa: la richiesta va ritentata piu' tardi."""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password_hash, password):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except ValueError:
+        # Hash non valido (es. vuoto o di un altro algoritmo)
+        return False
+
+
+class PasswordHasher:
+
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pool = None
+        self.pid = None
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def _executor(self):
+        # Dopo un fork (gunicorn --preload) il pool del padre non e' utilizzabile
+        if self.pool is None or self.pid != os.getpid():
+            # spawn: i processi non ereditano i thread (buffer degli ascolti) del worker
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            self.pid = os.getpid()
+        return self.pool
+
+    def _release(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise PasswordHasherBusy()
+            try:
+                future = self._executor().submit(function, *args)
+            except BrokenProcessPool:
+                self.pool = None
+                raise PasswordHasherBusy()
+            self.pending += 1
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise PasswordHasherBusy()
+        except BrokenProcessPool:
+            with self.lock:
+                self.pool = None
+            raise PasswordHasherBusy()
+
+    def shutdown(self):
+        if self.pool is not None and self.pid == os.getpid():
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = None
+
+
+def get_hasher(app=None):
+    app = app or current_app._get_current_object()
+    hasher = app.extensions.get('password_hasher')
+    if hasher is None:
+        with _lock:
+            hasher = app.extensions.get('password_hasher')
+            if hasher is None:
+                hasher = app.extensions['password_hasher'] = PasswordHasher(
+                    app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE'],
+                    app.config['PASSWORD_HASH_TIMEOUT'])
+    return hasher
+
+
+def hash_password(password):
+    return get_hasher().run(_hash, password, current_app.config['BCRYPT_LOG_ROUNDS'])
+
+
+def check_password(password_hash, password):
+    return get_hasher().run(_check, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """True se l'hash non usa il costo configurato in ``BCRYPT_LOG_ROUNDS``."""
+    try:
+        rounds = int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds != current_app.config['BCRYPT_LOG_ROUNDS']
+
+
+class LoginThrottle:
+    """Tentativi falliti recenti per chiave (``user:...`` o ``ip:...``)."""
+
+    def __init__(self, window, max_keys=100000):
+        self.window = window
+        self.max_keys = max_keys
+        self.failures = {}  # chiave -> deque degli istanti dei fallimenti
+        self.lock = threading.Lock()
+
+    def _recent(self, key, now):
+        attempts = self.failures.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if not attempts:
+            del self.failures[key]
+            return None
+        return attempts
+
+    def retry_after(self, limits):
+        """Secondi da attendere se una delle chiavi ha superato il suo limite, altrimenti 0.
+
+        ``limits``: dict chiave -> numero massimo di fallimenti nella finestra.
+        """
+        now = time.monotonic()
+        wait = 0.0
+        with self.lock:
+            for key, limit in limits.items():
+                attempts = self._recent(key, now)
+                if attempts is not None and len(attempts) >= limit:
+                    wait = max(wait, attempts[-limit] + self.window - now)
+        return wait
+
+    def failed(self, *keys):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.failures) >= self.max_keys:
+                # Prima si eliminano le chiavi scadute, poi le piu' vecchie
+                for key in list(self.failures):
+                    self._recent(key, now)
+                while len(self.failures) >= self.max_keys:
+                    del self.failures[next(iter(self.failures))]
+            for key in keys:
+                self.failures.setdefault(key, deque()).append(now)
+
+    def reset(self, key):
+        with self.lock:
+            self.failures.pop(key, None)
+
+
+def get_throttle(app=None):
+    app = app or current_app._get_current_object()
+    throttle = app.extensions.get('login_throttle')
+    if throttle is None:
+        throttle = app.extensions.setdefault('login_throttle', LoginThrottle(app.config['LOGIN_THROTTLE_WINDOW']))
+    return throttle
@@ -0,0 +1,38 @@
+"""add listening sessions
+
+Revision ID: 4c8d2e7f1a36
+Revises: b71f3e5a9c24
+Create Date: 2026-10-18 15:12:30.584102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8d2e7f1a36'
+down_revision = 'b71f3e5a9c24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('play_history', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ended_at', sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table('daily_user_plays', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('seconds', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('daily_station_plays', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('seconds', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('daily_station_plays', schema=None) as batch_op:
+        batch_op.drop_column('seconds')
+
+    with op.batch_alter_table('daily_user_plays', schema=None) as batch_op:
+        batch_op.drop_column('seconds')
+
+    with op.batch_alter_table('play_history', schema=None) as batch_op:
+        batch_op.drop_column('ended_at')
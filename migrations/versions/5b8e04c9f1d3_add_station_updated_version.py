@@ -0,0 +1,28 @@
+"""add station updated_version
+
+Revision ID: 5b8e04c9f1d3
+Revises: a3c1e7d52b90
+Create Date: 2026-10-18 11:24:09.301874
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e04c9f1d3'
+down_revision = 'a3c1e7d52b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('station', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_version', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_station_updated_version'), ['updated_version'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('station', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_station_updated_version'))
+        batch_op.drop_column('updated_version')
@@ -0,0 +1,26 @@
+"""add playlists version
+
+Revision ID: 6a1f4c9e2b57
+Revises: 9e3b5d7c2a18
+Create Date: 2026-10-18 18:05:12.377164
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a1f4c9e2b57'
+down_revision = '9e3b5d7c2a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('catalog_version', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('playlists_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('catalog_version', schema=None) as batch_op:
+        batch_op.drop_column('playlists_version')
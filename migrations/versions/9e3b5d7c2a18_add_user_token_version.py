@@ -0,0 +1,26 @@
+"""add user token version
+
+Revision ID: 9e3b5d7c2a18
+Revises: 4c8d2e7f1a36
+Create Date: 2026-10-18 16:27:44.903215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3b5d7c2a18'
+down_revision = '4c8d2e7f1a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('token_version')
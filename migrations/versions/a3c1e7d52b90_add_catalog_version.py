@@ -0,0 +1,32 @@
+"""add catalog version
+
+Revision ID: a3c1e7d52b90
+Revises: 799d26f0ee20
+Create Date: 2026-10-18 11:02:41.518230
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c1e7d52b90'
+down_revision = '799d26f0ee20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    catalog_version = op.create_table('catalog_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(catalog_version, [{'id': 1, 'version': 1, 'updated_at': datetime.utcnow()}])
+
+
+def downgrade():
+    op.drop_table('catalog_version')
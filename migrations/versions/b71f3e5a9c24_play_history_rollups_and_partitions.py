@@ -0,0 +1,123 @@
+"""play history rollups and partitions
+
+Revision ID: b71f3e5a9c24
+Revises: e2d9a4c61f07
+Create Date: 2026-10-18 13:41:09.220417
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71f3e5a9c24'
+down_revision = 'e2d9a4c61f07'
+branch_labels = None
+depends_on = None
+
+# Partizioni mensili create oltre il mese corrente (HISTORY_PARTITION_MONTHS_AHEAD)
+MONTHS_AHEAD = 2
+
+
+def _next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def _partition_play_history(bind):
+    """Ricrea play_history come tabella partizionata per mese (solo PostgreSQL)."""
+    op.execute('ALTER TABLE play_history RENAME TO play_history_old')
+    op.execute('ALTER TABLE play_history_old RENAME CONSTRAINT play_history_pkey TO play_history_old_pkey')
+    op.execute("""
+        CREATE TABLE play_history (
+            id integer NOT NULL DEFAULT nextval('play_history_id_seq'::regclass),
+            user_id integer NOT NULL REFERENCES "user" (id),
+            station_id integer NOT NULL REFERENCES station (id),
+            played_at timestamp without time zone NOT NULL,
+            PRIMARY KEY (id, played_at)
+        ) PARTITION BY RANGE (played_at)
+    """)
+    op.execute('CREATE TABLE play_history_default PARTITION OF play_history DEFAULT')
+
+    today = datetime.utcnow().date()
+    first = bind.execute(sa.text('SELECT min(played_at) FROM play_history_old')).scalar()
+    month = date((first or today).year, (first or today).month, 1)
+    last = date(today.year, today.month, 1)
+    for _ in range(MONTHS_AHEAD):
+        last = _next_month(last)
+    while month <= last:
+        op.execute(f"CREATE TABLE play_history_p{month:%Y%m} PARTITION OF play_history "
+                   f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')")
+        month = _next_month(month)
+
+    op.execute("""
+        INSERT INTO play_history (id, user_id, station_id, played_at)
+        SELECT id, user_id, station_id, COALESCE(played_at, now() AT TIME ZONE 'utc')
+        FROM play_history_old
+    """)
+    op.execute('ALTER SEQUENCE play_history_id_seq OWNED BY play_history.id')
+    op.execute('DROP TABLE play_history_old')
+
+
+def _unpartition_play_history():
+    op.execute('ALTER TABLE play_history RENAME TO play_history_old')
+    op.execute('ALTER TABLE play_history_old RENAME CONSTRAINT play_history_pkey TO play_history_old_pkey')
+    op.execute("""
+        CREATE TABLE play_history (
+            id integer NOT NULL DEFAULT nextval('play_history_id_seq'::regclass),
+            user_id integer NOT NULL REFERENCES "user" (id),
+            station_id integer NOT NULL REFERENCES station (id),
+            played_at timestamp without time zone,
+            PRIMARY KEY (id)
+        )
+    """)
+    op.execute('INSERT INTO play_history SELECT id, user_id, station_id, played_at FROM play_history_old')
+    op.execute('ALTER SEQUENCE play_history_id_seq OWNED BY play_history.id')
+    op.execute('DROP TABLE play_history_old')
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        _partition_play_history(bind)
+    op.create_index('ix_play_history_user_played', 'play_history', ['user_id', 'played_at'], unique=False)
+
+    op.create_table('daily_user_plays',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('station_id', sa.Integer(), nullable=False),
+    sa.Column('plays', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['station_id'], ['station.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'day', 'station_id')
+    )
+    op.create_table('daily_station_plays',
+    sa.Column('station_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('plays', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['station_id'], ['station.id'], ),
+    sa.PrimaryKeyConstraint('station_id', 'day')
+    )
+
+    # Aggregati degli ascolti gia' presenti
+    day = 'date(played_at)' if bind.dialect.name == 'sqlite' else 'CAST(played_at AS DATE)'
+    op.execute(f"""
+        INSERT INTO daily_user_plays (user_id, day, station_id, plays)
+        SELECT user_id, {day}, station_id, count(*) FROM play_history
+        WHERE played_at IS NOT NULL
+        GROUP BY user_id, {day}, station_id
+    """)
+    op.execute("""
+        INSERT INTO daily_station_plays (station_id, day, plays)
+        SELECT station_id, day, sum(plays) FROM daily_user_plays
+        GROUP BY station_id, day
+    """)
+
+
+def downgrade():
+    op.drop_table('daily_station_plays')
+    op.drop_table('daily_user_plays')
+    op.drop_index('ix_play_history_user_played', table_name='play_history')
+    if op.get_bind().dialect.name == 'postgresql':
+        _unpartition_play_history()
@@ -0,0 +1,26 @@
+"""add catalog generation
+
+Revision ID: d5e8a2f0c6b3
+Revises: 6a1f4c9e2b57
+Create Date: 2026-10-18 18:41:53.106284
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e8a2f0c6b3'
+down_revision = '6a1f4c9e2b57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('catalog_version', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('generation', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('catalog_version', schema=None) as batch_op:
+        batch_op.drop_column('generation')
@@ -0,0 +1,26 @@
+"""add station content_hash
+
+Revision ID: e2d9a4c61f07
+Revises: 5b8e04c9f1d3
+Create Date: 2026-10-18 12:02:47.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2d9a4c61f07'
+down_revision = '5b8e04c9f1d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('station', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=32), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('station', schema=None) as batch_op:
+        batch_op.drop_column('content_hash')
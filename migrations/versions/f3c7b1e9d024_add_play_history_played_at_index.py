@@ -0,0 +1,24 @@
+"""add play history played_at index
+
+Revision ID: f3c7b1e9d024
+Revises: d5e8a2f0c6b3
+Create Date: 2026-10-18 19:02:37.648821
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c7b1e9d024'
+down_revision = 'd5e8a2f0c6b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_play_history_played_at', 'play_history', ['played_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_play_history_played_at', table_name='play_history')
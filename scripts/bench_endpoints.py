@@ -0,0 +1,241 @@
+# scripts/bench_endpoints.py
+# Benchmark degli endpoint principali su un dataset sintetico in SQLite
+# (nessuna rete, nessun server): per ogni caso misura latenza p50/p95,
+# numero di query SQL e byte della risposta, e li confronta con
+# scripts/bench_baseline.json. Esce con codice 1 se c'e' una regressione.
+# Le richieste girano nel processo (test client + SQLite), quindi la
+# latenza e' misurata come tempo di CPU del processo: non risente degli
+# altri processi della macchina. Le latenze vengono normalizzate con una
+# calibrazione; cambiando macchina conviene comunque rigenerare la
+# baseline con --update.
+#
+#   python -m scripts.bench_endpoints                 # confronto con la baseline
+#   python -m scripts.bench_endpoints --update        # riscrive la baseline
+#   python -m scripts.bench_endpoints --threshold 0.3 --rounds 5 --iterations 50
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event, func
+
+from app import create_app, db
+from app.api.pagination import encode_cursor
+from app.catalog.synthetic import PASSWORD, generate_dataset
+from app.config import Config
+from app.models import PlayHistory, User
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'bench_baseline.json')
+
+DATASET = {'stations': 20000, 'users': 500, 'favorites': 20, 'playlists': 2, 'plays': 200, 'seed': 0}
+
+# Sotto questa differenza (ms) una latenza piu' alta non e' considerata regressione
+LATENCY_SLACK_MS = 2.0
+
+
+def _cases(station_count):
+    """(nome, metodo, url, autenticato, iterazioni) di ogni caso."""
+    deep_page = max(station_count // 20 // 2, 1)
+    return [
+        ('stations', 'GET', '/api/stations', False, None),
+        ('stations_search', 'GET', '/api/stations?search=radio%20nova', False, None),
+        ('stations_search_typo', 'GET', '/api/stations?search=smoth%20jaz', False, None),
+        ('stations_genre', 'GET', '/api/stations?genre=rock', False, None),
+        ('stations_decade', 'GET', '/api/stations?decade=80s', False, None),
+        ('stations_topic', 'GET', '/api/stations?topic=news', False, None),
+        ('stations_lang', 'GET', '/api/stations?lang=english', False, None),
+        ('stations_mood', 'GET', '/api/stations?mood=chill', False, None),
+        ('stations_countrycode', 'GET', '/api/stations?countrycode=IT', False, None),
+        ('stations_combined', 'GET', '/api/stations?genre=rock,pop&lang=english&match=any', False, None),
+        ('stations_deep_page', 'GET', f'/api/stations?page={deep_page}', False, None),
+        ('stations_deep_cursor', 'GET',
+         f'/api/stations?cursor={encode_cursor([station_count // 2])}', False, None),
+        ('similar', 'GET', '/api/stations/1/similar', False, None),
+        ('history', 'GET', '/api/user/history', True, None),
+        ('history_deep_page', 'GET', '/api/user/history?page=5', True, None),
+        ('favorites', 'GET', '/api/user/favorites', True, None),
+        ('public_playlists', 'GET', '/api/playlists', False, None),
+        ('public_playlists_deep_page', 'GET', '/api/playlists?page=50', False, None),
+        # bcrypt rende il login lento per costruzione: poche iterazioni
+        ('login', 'POST', '/api/auth/login', False, 5),
+    ]
+
+
+def _calibrate():
+    """Tempo (ms) di un carico fisso solo CPU: misura la velocita' della macchina."""
+    payload = [{'id': i, 'name': f'station {i}', 'tags': [str(j) for j in range(i % 7)]} for i in range(2000)]
+    timings = []
+    for _ in range(7):
+        start = time.process_time()
+        for _ in range(5):
+            sorted(json.loads(json.dumps(payload)), key=lambda item: item['name'])
+        timings.append((time.process_time() - start) * 1000)
+    return statistics.median(timings)
+
+
+def _percentile(values, p):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
+
+
+def _setup(path):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        RESULT_CACHE_ENABLED = False
+        CATALOG_SNAPSHOT_PATH = None
+        # Nessuna rilettura periodica della versione: conteggi SQL stabili
+        CATALOG_VERSION_TTL = 3600
+        # bcrypt nel processo: con il pool il tempo di CPU misurato qui
+        # escluderebbe l'hash e il caso login non misurerebbe piu' nulla
+        PASSWORD_HASH_WORKERS = 0
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        generate_dataset(**DATASET)
+        user_id, = (db.session.query(PlayHistory.user_id).group_by(PlayHistory.user_id)
+                    .order_by(func.count().desc()).first())
+        username = db.session.get(User, user_id).username
+    return app, username
+
+
+def _measure(client, statements, method, url, kwargs, iterations):
+    """(tempi in ms, query SQL per richiesta, ultima risposta)."""
+    timings, counts = [], []
+    # Le pause del garbage collector renderebbero il p95 troppo rumoroso
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(iterations):
+            statements[0] = 0
+            start = time.process_time()
+            response = client.open(url, method=method, **kwargs)
+            timings.append((time.process_time() - start) * 1000)
+            counts.append(statements[0])
+    finally:
+        gc.enable()
+    return timings, counts, response
+
+
+def run(iterations, rounds):
+    """Esegue tutti i casi ``rounds`` volte e tiene il migliore p50/p95 di ogni caso."""
+    with tempfile.TemporaryDirectory() as tmp:
+        app, username = _setup(os.path.join(tmp, 'bench.db'))
+        client = app.test_client()
+
+        statements = [0]
+        with app.app_context():
+            @event.listens_for(db.engine, 'before_cursor_execute')
+            def _count(*args):
+                statements[0] += 1
+
+        credentials = {'username': username, 'password': PASSWORD}
+        token = client.post('/api/auth/login', json=credentials).get_json()['access_token']
+        headers = {'Authorization': f'Bearer {token}'}
+
+        results = {}
+        calibration = []
+        for _ in range(rounds):
+            calibration.append(_calibrate())
+            for name, method, url, auth, case_iterations in _cases(DATASET['stations']):
+                kwargs = {'headers': headers if auth else None}
+                if method == 'POST':
+                    kwargs['json'] = credentials
+                # Riscaldamento: indici in memoria e cache di SQLAlchemy
+                response = client.open(url, method=method, **kwargs)
+                if response.status_code != 200:
+                    raise SystemExit(f'{name}: {method} {url} ha risposto {response.status_code}')
+                timings, counts, response = _measure(client, statements, method, url, kwargs,
+                                                     case_iterations or iterations)
+                current = {
+                    'p50_ms': round(_percentile(timings, 50), 3),
+                    'p95_ms': round(_percentile(timings, 95), 3),
+                    'statements': max(counts),
+                    'bytes': len(response.get_data()),
+                }
+                best = results.setdefault(name, current)
+                for key in ('p50_ms', 'p95_ms'):
+                    best[key] = min(best[key], current[key])
+                best['statements'] = max(best['statements'], current['statements'])
+        return results, min(calibration)
+
+
+def compare(results, baseline, threshold, speed=1.0):
+    """Righe del confronto e lista delle regressioni.
+
+    Query SQL in piu' sono sempre una regressione. Le latenze vengono
+    divise per ``speed`` (calibrazione attuale / quella della baseline)
+    prima del confronto; il p95 tollera il doppio della soglia.
+    """
+    lines, regressions = [], []
+    for name, current in results.items():
+        base = baseline.get(name)
+        line = (f"{name:<28} p50 {current['p50_ms']:>9.2f} ms  p95 {current['p95_ms']:>9.2f} ms  "
+                f"sql {current['statements']:>3}  {current['bytes']:>8} B")
+        if base is None:
+            lines.append(line + '  (nuovo)')
+            continue
+        problems = []
+        if current['statements'] > base['statements']:
+            problems.append(f"sql {base['statements']} -> {current['statements']}")
+        if current['bytes'] > base['bytes'] * (1 + threshold):
+            problems.append(f"byte {base['bytes']} -> {current['bytes']}")
+        for key, tolerance in (('p50_ms', threshold), ('p95_ms', 2 * threshold)):
+            value = current[key] / speed
+            if value > base[key] * (1 + tolerance) and value - base[key] > LATENCY_SLACK_MS:
+                problems.append(f"{key} {base[key]:.2f} -> {value:.2f} (normalizzato)")
+        if problems:
+            regressions.append(name)
+            line += '  REGRESSIONE: ' + ', '.join(problems)
+        lines.append(line)
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark degli endpoint con baseline.')
+    parser.add_argument('--iterations', type=int, default=30, help='Richieste per caso in ogni giro.')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='Giri completi dei casi; per la latenza conta il migliore.')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='Peggioramento relativo tollerato per latenza e byte (0.25 = 25%%).')
+    parser.add_argument('--update', action='store_true', help='Scrive i risultati come nuova baseline.')
+    args = parser.parse_args(argv)
+
+    results, calibration = run(args.iterations, args.rounds)
+
+    if args.update:
+        with open(BASELINE, 'w') as f:
+            json.dump({'dataset': DATASET, 'calibration_ms': round(calibration, 3), 'cases': results},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline aggiornata: {BASELINE}')
+        lines, _ = compare(results, {}, args.threshold)
+        print('\n'.join(lines))
+        return 0
+
+    baseline, speed = {}, 1.0
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            saved = json.load(f)
+        if saved.get('dataset') != DATASET:
+            print('La baseline e\' stata registrata su un dataset diverso: eseguire con --update.')
+            return 2
+        baseline = saved['cases']
+        speed = calibration / saved['calibration_ms']
+        print(f'Calibrazione {calibration:.1f} ms (baseline {saved["calibration_ms"]:.1f} ms)')
+
+    lines, regressions = compare(results, baseline, args.threshold, speed)
+    print('\n'.join(lines))
+    if regressions:
+        print(f'\n{len(regressions)} regressioni: ' + ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
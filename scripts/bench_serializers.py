@@ -0,0 +1,57 @@
+# scripts/bench_serializers.py
+# Confronta i serializzatori compilati con gli schemi marshmallow:
+# misura il throughput di entrambi (la parita' dell'output e' verificata da
+# tests/test_serializers.py; qui viene ricontrollata sui dati reali).
+#
+#   python -m scripts.bench_serializers [numero_stazioni] [ripetizioni]
+import sys
+import time
+
+from app import create_app
+from app.api.loading import station_tags, stations_with_tags
+from app.api.playlist import playlists_schema, dump_playlists, playlist_loads
+from app.api.stations import stations_schema, dump_stations
+from app.api.user import play_history_schema, dump_play_history
+from app.models import Station, Playlist, PlayHistory
+
+
+def _bench(label, schema_dump, compiled_dump, objects, repeat):
+    expected = schema_dump(objects)
+    actual = compiled_dump(objects)
+    if expected != actual:
+        raise SystemExit(f"{label}: l'output del serializzatore compilato e' diverso da quello dello schema")
+
+    timings = {}
+    for name, dump in (('marshmallow', schema_dump), ('compilato', compiled_dump)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            dump(objects)
+        timings[name] = time.perf_counter() - start
+
+    rows = len(objects) * repeat
+    print(f"{label} ({len(objects)} oggetti x {repeat}):")
+    for name, elapsed in timings.items():
+        print(f"  {name:<12} {rows / elapsed:>12,.0f} oggetti/s")
+    print(f"  speedup      {timings['marshmallow'] / timings['compilato']:.1f}x")
+
+
+def main(limit=100, repeat=50):
+    app = create_app()
+    with app.app_context():
+        stations = Station.query.options(*station_tags()).order_by(Station.id).limit(limit).all()
+        if not stations:
+            raise SystemExit("Nessuna stazione nel database: eseguire prima il popolamento.")
+        _bench('Station', stations_schema.dump, dump_stations, stations, repeat)
+
+        history = (PlayHistory.query.options(stations_with_tags(PlayHistory.station))
+                   .order_by(PlayHistory.id).limit(limit).all())
+        if history:
+            _bench('PlayHistory', play_history_schema.dump, dump_play_history, history, repeat)
+
+        playlists = Playlist.query.options(*playlist_loads()).order_by(Playlist.id).limit(limit).all()
+        if playlists:
+            _bench('Playlist', playlists_schema.dump, dump_playlists, playlists, repeat)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,56 @@
+"""Chiavi della cache dei risultati."""
+import itertools
+
+import pytest
+
+from app import create_app
+from app.api.result_cache import _normalized_args
+from app.config import Config
+
+
+class CacheConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+@pytest.fixture
+def app():
+    return create_app(CacheConfig)
+
+
+QUERIES = [
+    'genre=rock&page=2',
+    'genre=rock%26page%3D2',
+    'genre=rock%26page=2',
+    'genre=rock&page%3D2',
+    'genre=rock,pop',
+    'genre=rock&genre=pop',
+    'genre=rock%2Cpop',
+    'genre%3Drock=pop',
+    'genre=rock%3Dpop',
+    'search=a+b',
+    'search=a%2Bb',
+    'search=a%20b%26c',
+]
+
+
+def _key(app, query):
+    with app.test_request_context(f'/api/stations?{query}'):
+        return _normalized_args()
+
+
+def test_different_queries_never_share_a_key(app):
+    keys = {query: _key(app, query) for query in QUERIES}
+    for first, second in itertools.combinations(QUERIES, 2):
+        with app.test_request_context(f'/api/stations?{first}') as ctx:
+            first_args = sorted(ctx.request.args.items(multi=True))
+        with app.test_request_context(f'/api/stations?{second}') as ctx:
+            second_args = sorted(ctx.request.args.items(multi=True))
+        if first_args != second_args:
+            assert keys[first] != keys[second], (first, second)
+
+
+def test_equivalent_queries_share_a_key(app):
+    # Ordine dei parametri e valori vuoti non cambiano la risposta
+    assert _key(app, 'page=2&genre=rock') == _key(app, 'genre=rock&page=2')
+    assert _key(app, 'genre=rock&page=2&search=') == _key(app, 'genre=rock&page=2')
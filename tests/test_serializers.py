@@ -0,0 +1,99 @@
+"""I serializzatori compilati devono produrre lo stesso output degli schemi marshmallow."""
+from datetime import datetime
+
+import pytest
+
+from app import create_app, db
+from app.config import Config
+from app.api.loading import station_tags, stations_with_tags
+from app.api.playlist import playlist_loads, playlist_schema, playlists_schema, dump_playlist, dump_playlists
+from app.api.stations import station_schema, stations_schema, dump_stations
+from app.api.serializers import compile_serializer
+from app.api.user import play_history_schema, dump_play_history
+from app.models import Decade, Lang, Mood, MusicGenre, PlayHistory, Playlist, Station, Topic, User
+
+
+class SerializerConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    PASSWORD_HASH_WORKERS = 0
+    BCRYPT_LOG_ROUNDS = 4
+    HISTORY_FLUSH_INTERVAL = 0
+
+
+@pytest.fixture
+def app():
+    app = create_app(SerializerConfig)
+    with app.app_context():
+        db.create_all()
+        _populate()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _populate():
+    rock, jazz = MusicGenre(name='rock'), MusicGenre(name='jazz')
+    eighties = Decade(name='80s')
+    news = Topic(name='news')
+    italian, english = Lang(name='italian'), Lang(name='english')
+    calm = Mood(name='calm')
+    stations = [
+        # Tutti i campi e piu' tag per tipo
+        Station(id=1, name='Radio Uno', url='http://uno', url_resolved='http://uno/stream',
+                homepage='http://uno.example', favicon='http://uno/icon.png', country='Italy',
+                countrycode='IT', state='Lazio', codec='MP3', bitrate=128, geo_lat=41.9, geo_long=12.5,
+                music_genres=[rock, jazz], decades=[eighties], topics=[news], langs=[italian, english],
+                moods=[calm]),
+        # Campi facoltativi nulli e nessun tag
+        Station(id=2, name='Senza dati'),
+        # Valori "falsy" che non devono diventare None
+        Station(id=3, name='', url='', bitrate=0, geo_lat=0.0, geo_long=-0.0, langs=[english]),
+    ]
+    db.session.add_all(stations)
+    user = User(id=1, username='ascoltatore', created_at=datetime(2024, 1, 2, 3, 4, 5))
+    user.set_password('password')
+    db.session.add(user)
+    db.session.add_all([
+        Playlist(id=1, name='Tutte', description='Con stazioni', is_public=True, user_id=1,
+                 created_at=datetime(2024, 5, 6, 7, 8, 9, 123456), stations=stations),
+        Playlist(id=2, name='Vuota', description='', is_public=False, user_id=1, stations=[]),
+        Playlist(id=3, name='Senza descrizione', description=None, is_public=True, user_id=1,
+                 stations=[stations[1]]),
+    ])
+    db.session.add_all([
+        PlayHistory(id=1, user_id=1, station_id=1, played_at=datetime(2024, 6, 1, 12, 0, 0, 500)),
+        PlayHistory(id=2, user_id=1, station_id=2, played_at=datetime(2024, 6, 1, 13, 0),
+                    ended_at=datetime(2024, 6, 1, 13, 30)),
+        PlayHistory(id=3, user_id=1, station_id=3, played_at=None),
+    ])
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def test_stations_match_schema(app):
+    stations = Station.query.options(*station_tags()).order_by(Station.id).all()
+    assert dump_stations(stations) == stations_schema.dump(stations)
+
+
+def test_single_station_matches_schema(app):
+    dump_station = compile_serializer(station_schema)
+    for station in Station.query.options(*station_tags()).all():
+        assert dump_station(station) == station_schema.dump(station)
+
+
+def test_empty_list(app):
+    assert dump_stations([]) == stations_schema.dump([]) == []
+
+
+def test_playlists_match_schema(app):
+    playlists = Playlist.query.options(*playlist_loads()).order_by(Playlist.id).all()
+    assert dump_playlists(playlists) == playlists_schema.dump(playlists)
+    for playlist in playlists:
+        assert dump_playlist(playlist) == playlist_schema.dump(playlist)
+
+
+def test_play_history_matches_schema(app):
+    history = (PlayHistory.query.options(stations_with_tags(PlayHistory.station))
+               .order_by(PlayHistory.id).all())
+    assert dump_play_history(history) == play_history_schema.dump(history)
@@ -0,0 +1,25 @@
+"""Classifica dei contatori con decadimento."""
+import random
+
+from app.history.trending import DecayedCounter
+
+
+def _expected(counter, limit, now, accept=None):
+    ranking = sorted(counter.weights, key=counter.weights.get, reverse=True)
+    ranking = [station_id for station_id in ranking if accept is None or accept(station_id)]
+    return [(station_id, counter.score(counter.weights[station_id], now)) for station_id in ranking[:limit]]
+
+
+def test_top_matches_full_sort():
+    rng = random.Random(7)
+    counter = DecayedCounter(3600.0, 0.0)
+    for _ in range(2000):
+        counter.add(rng.randrange(500), rng.uniform(0, 7200), rng.randint(1, 3))
+    counter.forget(range(0, 500, 10))
+    now = 7200.0
+    for limit in (0, 1, 10, 600):
+        assert counter.top(limit, now) == _expected(counter, limit, now)
+    # Filtro che scarta quasi tutte le stazioni: servono piu' candidati
+    rare = lambda station_id: station_id % 97 == 3
+    assert counter.top(5, now, rare) == _expected(counter, 5, now, rare)
+    assert counter.top(5, now, lambda station_id: False) == []